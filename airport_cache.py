@@ -0,0 +1,105 @@
+"""
+Bookkeeping for Logic.resolve_airport.
+
+ResolutionCache counts hits per tier (local map, offline DB, online) and
+remembers codes that no tier could resolve. Misses are kept in memory and
+in the airport_misses table, so every worker and restart skips the slow
+online lookup until the entry is older than the TTL.
+"""
+import os
+import time
+import threading
+import database
+import applog
+
+log = applog.get_logger("airport_cache")
+
+# Seconds before an unresolved code is looked up online again
+MISS_TTL = float(os.getenv("BILLETE_AIRPORT_MISS_TTL", str(24 * 3600)))
+
+TIERS = ("map", "offline", "online")
+
+
+class ResolutionCache:
+    def __init__(self, ttl=MISS_TTL):
+        self.ttl = ttl
+        self._misses = {}  # code -> checked_at (epoch seconds)
+        self._lock = threading.Lock()
+        self._hits = {tier: 0 for tier in TIERS}
+        self._negative_hits = 0
+        self._misses_count = 0
+        self._stale = 0
+
+    def hit(self, tier):
+        with self._lock:
+            self._hits[tier] += 1
+
+    def _fresh(self, checked_at, now):
+        return checked_at is not None and now - checked_at < self.ttl
+
+    def is_known_miss(self, code):
+        """
+        True if code failed to resolve within the TTL. Falls back to the
+        database when the in-memory entry is missing or stale, since another
+        worker may have looked it up more recently.
+        """
+        now = time.time()
+        with self._lock:
+            checked_at = self._misses.get(code)
+        if not self._fresh(checked_at, now):
+            try:
+                stored = database.get_airport_miss(code)
+            except Exception as e:
+                log.warning(f"Airport miss lookup failed for {code}: {e}")
+                stored = None
+            if stored is not None:
+                checked_at = stored
+                with self._lock:
+                    self._misses[code] = stored
+
+        with self._lock:
+            if self._fresh(checked_at, now):
+                self._negative_hits += 1
+                return True
+            if checked_at is not None:
+                self._stale += 1
+            return False
+
+    def record_miss(self, code):
+        now = time.time()
+        with self._lock:
+            self._misses[code] = now
+            self._misses_count += 1
+        try:
+            database.record_airport_miss(code, now)
+        except Exception as e:
+            log.warning(f"Failed to persist airport miss for {code}: {e}")
+
+    def forget(self, code):
+        """Drops a remembered miss, e.g. once a name has been added by hand."""
+        with self._lock:
+            self._misses.pop(code, None)
+        try:
+            database.delete_airport_miss(code)
+        except Exception as e:
+            log.warning(f"Failed to delete airport miss for {code}: {e}")
+
+    def forget_many(self, codes):
+        with self._lock:
+            for code in codes:
+                self._misses.pop(code, None)
+        try:
+            database.delete_airport_misses(codes)
+        except Exception as e:
+            log.warning(f"Failed to delete airport misses: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": dict(self._hits),
+                "negative_hits": self._negative_hits,
+                "misses": self._misses_count,
+                "stale": self._stale,
+                "known_misses": len(self._misses),
+                "miss_ttl": self.ttl
+            }
@@ -0,0 +1,179 @@
+"""
+Compact, read-only airport index (IATA code -> city, name, tz).
+
+airportsdata.load('IATA') builds a dict of dicts with every field for
+every airport, but Logic only needs city, name and tz. build_index()
+writes just those to a small binary file that AirportIndex memory-maps on
+first use. The mapping is backed by the page cache, so forked gunicorn
+workers and the desktop app share one copy.
+
+File layout (little-endian):
+    header   "BLAI", u16 format version, u32 airport count,
+             u16 length + airportsdata version string
+    slots    26**3 u32 offsets, one per AAA..ZZZ code (0 = absent)
+    records  u16 length + UTF-8 "city\\x1fname\\x1ftz"
+
+Build it with:
+    python airport_index.py [output_path]
+"""
+import os
+import sys
+import mmap
+import struct
+import threading
+import applog
+
+log = applog.get_logger("airport_index")
+
+INDEX_PATH = os.getenv(
+    "BILLETE_AIRPORT_INDEX",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "airport_index.bin")
+)
+
+MAGIC = b"BLAI"
+FORMAT_VERSION = 1
+SLOT_COUNT = 26 ** 3
+_HEADER = struct.Struct("<4sHI")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_SEP = "\x1f"
+
+
+def _slot(code):
+    if len(code) != 3:
+        return -1
+    a, b, c = (ord(ch) - 65 for ch in code)
+    if not (0 <= a < 26 and 0 <= b < 26 and 0 <= c < 26):
+        return -1
+    return (a * 26 + b) * 26 + c
+
+
+def build_index(path=INDEX_PATH):
+    """Writes the index from airportsdata. Returns the number of airports stored."""
+    import airportsdata
+
+    airports = airportsdata.load('IATA')
+    source = str(getattr(airportsdata, "__version__", "")).encode("utf-8")
+
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, 0) + _U16.pack(len(source)) + source
+    records_start = len(header) + SLOT_COUNT * _U32.size
+    slots = [0] * SLOT_COUNT
+    records = bytearray()
+    count = 0
+    for code, data in airports.items():
+        slot = _slot(code)
+        if slot < 0:
+            continue
+        fields = (data.get('city') or '', data.get('name') or '', data.get('tz') or '')
+        blob = _SEP.join(f.replace(_SEP, " ") for f in fields).encode("utf-8")
+        slots[slot] = records_start + len(records)
+        records += _U16.pack(len(blob)) + blob
+        count += 1
+
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, count) + header[_HEADER.size:]
+    # Write next to the target and swap in, so running workers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(struct.pack(f"<{SLOT_COUNT}I", *slots))
+        f.write(records)
+    os.replace(tmp_path, path)
+    return count
+
+
+class AirportIndex:
+    """
+    Read-only mapping of IATA code -> {'city', 'name', 'tz'}.
+    Opens the index file lazily; if it hasn't been built, falls back to
+    loading airportsdata once and keeping only the three fields.
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._mm = None
+        self._slots_at = 0
+        self._fallback = None
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                with open(self.path, "rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, _count = _HEADER.unpack_from(mm, 0)
+                if magic != MAGIC or version != FORMAT_VERSION:
+                    raise ValueError(f"unsupported airport index format in {self.path}")
+                (source_len,) = _U16.unpack_from(mm, _HEADER.size)
+                self._slots_at = _HEADER.size + _U16.size + source_len
+                self._mm = mm
+            except Exception as e:
+                log.warning(f"Airport index unavailable ({e}); loading airportsdata instead. "
+                            f"Run 'python airport_index.py' to build it.")
+                self._fallback = self._load_airportsdata()
+            self._loaded = True
+
+    @staticmethod
+    def _load_airportsdata():
+        try:
+            import airportsdata
+            airports = airportsdata.load('IATA')
+        except Exception as e:
+            log.error(f"Failed to load airportsdata: {e}")
+            return {}
+        return {
+            code: (data.get('city') or '', data.get('name') or '', data.get('tz') or '')
+            for code, data in airports.items()
+        }
+
+    def _fields(self, code):
+        if not self._loaded:
+            self._load()
+        if self._fallback is not None:
+            return self._fallback.get(code)
+        slot = _slot(code)
+        if slot < 0:
+            return None
+        (offset,) = _U32.unpack_from(self._mm, self._slots_at + slot * _U32.size)
+        if not offset:
+            return None
+        (length,) = _U16.unpack_from(self._mm, offset)
+        start = offset + _U16.size
+        return self._mm[start:start + length].decode("utf-8").split(_SEP)
+
+    def get(self, code, default=None):
+        fields = self._fields(code)
+        if fields is None:
+            return default
+        city, name, tz = fields
+        return {"city": city, "name": name, "tz": tz}
+
+    def __getitem__(self, code):
+        data = self.get(code)
+        if data is None:
+            raise KeyError(code)
+        return data
+
+    def __contains__(self, code):
+        return self._fields(code) is not None
+
+
+_shared_index = None
+_shared_lock = threading.Lock()
+
+
+def get_index():
+    """Process-wide AirportIndex; cheap to call, nothing is read until first lookup."""
+    global _shared_index
+    with _shared_lock:
+        if _shared_index is None:
+            _shared_index = AirportIndex()
+        return _shared_index
+
+
+if __name__ == "__main__":
+    out = sys.argv[1] if len(sys.argv) > 1 else INDEX_PATH
+    n = build_index(out)
+    print(f"Wrote {n} airports to {out} ({os.path.getsize(out) // 1024} KB)")
@@ -0,0 +1,130 @@
+"""
+Background online lookups for airport codes.
+
+Logic.resolve_airport hands codes it cannot resolve locally to a
+LookupQueue instead of blocking on fetch_online_airport_name. Each code is
+fetched at most once at a time no matter how many requests ask for it, and
+a found name is stored through Logic.update_airport so the next parse
+picks it up. Clients poll status() to know when to re-render.
+
+AsyncLookupQueue does the same on an event loop for the ASGI app: every
+lookup is a task on one pooled httpx.AsyncClient instead of a blocked
+thread.
+"""
+import os
+import queue
+import asyncio
+import threading
+import applog
+
+log = applog.get_logger("airport_lookup")
+
+LOOKUP_WORKERS = int(os.getenv("BILLETE_LOOKUP_WORKERS", "2"))
+# Online lookups in flight at once per process in the ASGI app
+LOOKUP_CONCURRENCY = int(os.getenv("BILLETE_LOOKUP_CONCURRENCY", "20"))
+
+
+class LookupQueue:
+    def __init__(self, logic, workers=LOOKUP_WORKERS):
+        self.logic = logic
+        self.workers = workers
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._pid = None
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so each process starts its own
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"airport-lookup-{i}", daemon=True)
+            t.start()
+
+    def submit(self, code):
+        """Queues an online lookup for code unless one is already in flight."""
+        with self._lock:
+            self._ensure_started()
+            if code in self._pending:
+                return
+            self._pending.add(code)
+        self._queue.put(code)
+
+    def is_pending(self, code):
+        with self._lock:
+            return code in self._pending
+
+    def status(self, codes):
+        """
+        Maps each code to {'status': 'pending'|'resolved'|'unresolved', 'name': ...}.
+        The lookup may be running in another worker, so a code that is neither
+        known nor pending here is checked against the database: resolved once
+        its name is stored, unresolved once its miss is recorded, and pending
+        until one of the two happens.
+        """
+        codes = [code.upper() for code in codes]
+        if any(code not in self.logic.airport_map and not self.is_pending(code) for code in codes):
+            self.logic.sync_airport_map(force=True)
+        out = {}
+        for code in codes:
+            name = self.logic.airport_map.get(code)
+            if name is not None:
+                out[code] = {"status": "resolved", "name": name}
+            elif self.is_pending(code) or not self.logic.resolution_cache.is_known_miss(code):
+                out[code] = {"status": "pending"}
+            else:
+                out[code] = {"status": "unresolved"}
+        return out
+
+    def _run(self):
+        while True:
+            code = self._queue.get()
+            try:
+                self.logic.resolve_online(code)
+            except Exception as e:
+                log.warning(f"Background lookup failed for {code}: {e}", extra={"sample": "background_lookup"})
+            finally:
+                with self._lock:
+                    self._pending.discard(code)
+                self._queue.task_done()
+
+
+class AsyncLookupQueue(LookupQueue):
+    """
+    submit() may be called from any thread (Logic.parse runs in an executor);
+    the lookup itself runs on `loop`. Saving the result touches the database
+    through Logic, so that part goes to `executor`.
+    """
+
+    def __init__(self, logic, loop, client, concurrency=LOOKUP_CONCURRENCY, executor=None):
+        super().__init__(logic, workers=0)
+        self._loop = loop
+        self._client = client
+        self._executor = executor
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+
+    def submit(self, code):
+        with self._lock:
+            if code in self._pending:
+                return
+            self._pending.add(code)
+        self._loop.call_soon_threadsafe(self._start, code)
+
+    def _start(self, code):
+        task = self._loop.create_task(self._lookup(code))
+        # The loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _lookup(self, code):
+        try:
+            async with self._semaphore:
+                name = await self.logic.fetch_online_airport_name_async(self._client, code)
+            await self._loop.run_in_executor(self._executor, self.logic.store_online_result, code, name)
+        except Exception as e:
+            log.warning(f"Background lookup failed for {code}: {e}", extra={"sample": "background_lookup"})
+        finally:
+            with self._lock:
+                self._pending.discard(code)
@@ -0,0 +1,172 @@
+"""
+Logging for Billete: leveled, structured and off the request path.
+
+get_logger(name) returns a "billete.<name>" logger. The first call sets
+up the "billete" logger with a QueueHandler feeding a bounded queue; a
+QueueListener thread (one per process, started lazily so forked workers
+get their own) formats the records and writes them to stderr. When the
+queue is full, records are dropped and counted instead of blocking the
+caller.
+
+Noisy messages pass extra={"sample": "<key>"}. At most SAMPLE_BURST of
+them per key get through in each SAMPLE_WINDOW seconds; the first one
+after a quiet spell carries the number that were suppressed.
+
+Settings:
+    BILLETE_LOG_LEVEL          DEBUG / INFO / WARNING / ERROR (default INFO)
+    BILLETE_LOG_FORMAT         json or text (default json)
+    BILLETE_LOG_QUEUE_SIZE     records buffered before dropping (default 10000)
+    BILLETE_LOG_SAMPLE_BURST   sampled records allowed per key and window (default 10)
+    BILLETE_LOG_SAMPLE_WINDOW  seconds (default 10)
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+LEVEL = os.getenv("BILLETE_LOG_LEVEL", "INFO").upper()
+FORMAT = os.getenv("BILLETE_LOG_FORMAT", "json").lower()
+QUEUE_SIZE = int(os.getenv("BILLETE_LOG_QUEUE_SIZE", "10000"))
+SAMPLE_BURST = int(os.getenv("BILLETE_LOG_SAMPLE_BURST", "10"))
+SAMPLE_WINDOW = float(os.getenv("BILLETE_LOG_SAMPLE_WINDOW", "10"))
+
+ROOT = "billete"
+
+_configure_lock = threading.Lock()
+_handler = None
+_sampler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any extra fields."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" (+{suppressed} similar suppressed)"
+        return text
+
+
+class SampleFilter(logging.Filter):
+    """Rate-limits records that carry a `sample` key; others always pass."""
+
+    def __init__(self, burst=SAMPLE_BURST, window=SAMPLE_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._lock = threading.Lock()
+        self._windows = {}  # key -> [window start, passed, suppressed]
+        self.suppressed_total = 0
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                carried = state[2] if state else 0
+                state = self._windows[key] = [now, 0, 0]
+                if carried:
+                    record.suppressed = carried
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            self.suppressed_total += 1
+            return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Drops records when the queue is full; starts the writer thread per process."""
+
+    def __init__(self, target, maxsize=QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.target = target
+        self.dropped = 0
+        self._pid = None
+        self._listener = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        # Threads don't survive fork, so each process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self._listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self._listener.stop)
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure():
+    """Sets up the "billete" logger once per interpreter. Safe to call repeatedly."""
+    global _handler, _sampler
+    with _configure_lock:
+        if _handler is not None:
+            return
+        target = logging.StreamHandler(sys.stderr)
+        target.setFormatter(TextFormatter() if FORMAT == "text" else JsonFormatter())
+
+        _sampler = SampleFilter()
+        _handler = NonBlockingQueueHandler(target)
+        _handler.addFilter(_sampler)
+
+        root = logging.getLogger(ROOT)
+        root.setLevel(getattr(logging, LEVEL, logging.INFO))
+        root.addHandler(_handler)
+        root.propagate = False
+
+
+def get_logger(name):
+    configure()
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+def stats():
+    """Records dropped on a full queue and suppressed by sampling, in this process."""
+    return {
+        "dropped": _handler.dropped if _handler else 0,
+        "suppressed": _sampler.suppressed_total if _sampler else 0,
+        "queued": _handler.queue.qsize() if _handler else 0,
+    }
@@ -0,0 +1,360 @@
+"""
+ASGI serving mode: the routes the browser uses, on an event loop.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 2
+
+It shares server.py's Logic, parse cache and history writer, so both modes
+give the same answers. Only the waiting is different:
+  - database reads that requests wait on go through async_database
+    (asyncpg on PostgreSQL)
+  - online airport lookups run as tasks on one pooled httpx.AsyncClient
+    (airport_lookup.AsyncLookupQueue)
+  - parsing is CPU-bound and writes through database.py, so it runs in a
+    thread pool of BILLETE_ASGI_PARSE_THREADS threads, as do airport edits,
+    clearing history and waiting for itinerary cards
+One process can then keep many slow requests in flight. Add workers to use
+more cores. The batch endpoint, PDF/Word documents, airport import/export
+and the debug routes are only served by server.py.
+"""
+import os
+import time
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+
+import server  # loads .env, the database schema, the shared Logic and warmup
+import async_database
+import metrics
+import logic as logic_module
+from airport_lookup import AsyncLookupQueue, LOOKUP_WORKERS, LOOKUP_CONCURRENCY
+
+PARSE_THREADS = int(os.getenv("BILLETE_ASGI_PARSE_THREADS", "4"))
+
+logic = server.logic
+result_cache = server.result_cache
+_executor = ThreadPoolExecutor(max_workers=PARSE_THREADS, thread_name_prefix="parse")
+
+
+async def run_blocking(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+def _timed(fn, *args):
+    # metrics keeps per-request timings per thread, so collect them in the worker thread
+    metrics.begin_request()
+    try:
+        return fn(*args), metrics.end_request()
+    except BaseException:
+        metrics.end_request()
+        raise
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or any(t.removeprefix("W/").strip('"') == etag for t in tags)
+
+
+async def home(request):
+    return HTMLResponse(server.app.jinja_env.get_template('index.html').render())
+
+
+async def process(request):
+    started = time.perf_counter()
+    try:
+        data = await request.json()
+        code = data.get('code', '')
+        if not code:
+            return JSONResponse({'error': 'No code provided'}, status_code=400)
+
+        (cached, hit, parse_id), timings = await run_blocking(_timed, server.process_code, code, data)
+        body = cached['body']
+
+        fields = {**body, 'parse_id': parse_id, 'cached': hit}
+        if data.get('record_history', True):
+            # The row is queued for the history writer; today's count is a cached read
+            history, history_timings = await run_blocking(_timed, server.record_history, code, cached, hit)
+            fields.update(history)
+            timings.update(history_timings)
+
+        response = JSONResponse(fields)
+        # Same stages as server.py's /process, including the whole request as "total"
+        timings['total'] = time.perf_counter() - started
+        response.headers['Server-Timing'] = metrics.server_timing(timings)
+        return response
+    except Exception as e:
+        server.log.exception(f"Error in process: {e}", extra={"sample": "process_error"})
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def get_history(request):
+    try:
+        limit = min(max(int(request.query_params.get('limit', 50)), 1), server.HISTORY_PAGE_MAX)
+        before_id = request.query_params.get('before_id')
+        before_id = int(before_id) if before_id else None
+    except ValueError:
+        return JSONResponse({'error': 'limit and before_id must be integers'}, status_code=400)
+
+    items = await async_database.get_history_entries(limit=limit, before_id=before_id)
+    return JSONResponse({
+        'items': items,
+        'next_before_id': items[-1]['id'] if len(items) == limit else None
+    })
+
+
+async def get_history_entry(request):
+    entry = await async_database.get_history_entry(request.path_params['entry_id'])
+    if entry is None:
+        return JSONResponse({'error': 'Not found'}, status_code=404)
+    return JSONResponse(entry)
+
+
+async def clear_history(request):
+    if await run_blocking(logic.clear_history):
+        return JSONResponse({'message': 'History cleared'})
+    return JSONResponse({'error': 'Failed to clear history'}, status_code=500)
+
+
+async def get_stats(request):
+    try:
+        count = await async_database.get_today_count()
+        return JSONResponse(
+            {'today_count': count, 'history_pending': logic.history_writer.depth()},
+            headers={"Cache-Control": "no-cache, no-store, must-revalidate"}
+        )
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def manage_airports(request):
+    if request.method == 'GET':
+        version = await async_database.get_airport_version()
+        if version != logic.airport_map_version:
+            # Another worker edited the map; reloading it is a blocking read
+            version = await run_blocking(logic.sync_airport_map, True)
+        etag = f"airports-{version}"
+        headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+        if _etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=headers)
+        return JSONResponse(dict(logic.airport_map), headers=headers)
+
+    data = await request.json()
+    code = data.get('code')
+    if request.method == 'POST':
+        name = data.get('name')
+        if not code or not name:
+            return JSONResponse({'error': 'Missing code or name'}, status_code=400)
+        await run_blocking(logic.update_airport, code, name)
+        return JSONResponse({'success': True, 'code': code, 'name': name})
+
+    if not code:
+        return JSONResponse({'error': 'Missing code'}, status_code=400)
+    if await run_blocking(logic.delete_airport, code):
+        return JSONResponse({'success': True, 'message': f'Deleted {code}'})
+    return JSONResponse({'error': 'Failed to delete'}, status_code=500)
+
+
+async def airport_changes(request):
+    try:
+        since = int(request.query_params.get('since', 0))
+    except ValueError:
+        return JSONResponse({'error': 'since must be an integer'}, status_code=400)
+    return JSONResponse(await async_database.get_airport_changes(since))
+
+
+async def airport_lookups(request):
+    codes = [c.strip() for c in request.query_params.get('codes', '').split(',') if c.strip()]
+    if not codes:
+        return JSONResponse({'error': 'No codes provided'}, status_code=400)
+    if logic.lookup_queue is None:
+        await run_blocking(logic.sync_airport_map, True)
+        return JSONResponse({
+            code.upper(): {'status': 'resolved', 'name': logic.airport_map[code.upper()]}
+            if code.upper() in logic.airport_map else {'status': 'unresolved'}
+            for code in codes
+        })
+    # status() may read the database to see other workers' lookups
+    return JSONResponse(await run_blocking(logic.lookup_queue.status, codes))
+
+
+async def _history_flights(first_id, last_id):
+    """server._history_flights with the history reads awaited and the parsing in the pool."""
+    remaining = server.ICS_MAX_HISTORY
+    while remaining > 0:
+        rows = await async_database.get_history_codes(first_id, last_id, limit=min(100, remaining))
+        if not rows:
+            return
+        for _, code, timestamp in rows:
+            try:
+                flights = await run_blocking(server.history_entry_flights, code, timestamp)
+            except Exception as e:
+                server.log.warning(f"ICS: failed to parse history entry: {e}", extra={"sample": "ics_history"})
+                continue
+            yield flights
+        remaining -= len(rows)
+        last_id = rows[-1][0] - 1
+
+
+async def download_ics(request):
+    """Same inputs as server.download_ics."""
+    data = {}
+    if request.method == 'POST':
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+    args = request.query_params
+
+    parse_ids = [p.strip() for arg in args.getlist('parse_id') for p in arg.split(',') if p.strip()]
+    parse_ids += [p for p in data.get('parse_ids') or [] if isinstance(p, str)]
+
+    flight_lists = []
+    missing = []
+    for parse_id in parse_ids:
+        # May read the database tier of the cache
+        cached = await run_blocking(result_cache.get, parse_id)
+        if cached is None:
+            missing.append(parse_id)
+        else:
+            flight_lists.append(cached['body']['structured']['flights'])
+    if missing:
+        return JSONResponse({'error': 'Unknown or expired parse_id', 'parse_ids': missing}, status_code=404)
+
+    try:
+        flight_lists += server.posted_ics_flights(data)
+    except ValueError as e:
+        return JSONResponse({'error': f'Invalid flight: {e}'}, status_code=400)
+
+    history = None
+    if 'history_from' in args or 'history_to' in args:
+        try:
+            first_id = int(args.get('history_from', 1))
+            last_id = int(args['history_to']) if 'history_to' in args else 2 ** 62
+        except ValueError:
+            return JSONResponse({'error': 'history_from/history_to must be integers'}, status_code=400)
+        history = _history_flights(first_id, last_id)
+    elif not any(f.get('utc_start') and f.get('utc_end') for flights in flight_lists for f in flights):
+        return JSONResponse({'error': 'No flight data to generate ICS'}, status_code=400)
+
+    async def calendar():
+        yield logic_module.ICS_BEGIN
+        for flights in flight_lists:
+            yield "".join(logic.iter_ics_events(flights))
+        if history is not None:
+            async for flights in history:
+                yield "".join(logic.iter_ics_events(flights))
+        yield logic_module.ICS_END
+
+    return StreamingResponse(
+        calendar(),
+        media_type="text/calendar",
+        headers={"Content-disposition": "attachment; filename=itinerary.ics"}
+    )
+
+
+async def itinerary_card(request):
+    """Same inputs as server.itinerary_card."""
+    if request.method == 'POST':
+        try:
+            item = await request.json()
+        except ValueError:
+            item = None
+    else:
+        item = {'parse_id': request.query_params.get('parse_id')}
+    try:
+        path, name = await run_blocking(server.render_card, item)
+    except LookupError as e:
+        return JSONResponse({'error': 'Unknown or expired parse_id', 'parse_ids': [str(e.args[0])]}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        server.log.exception(f"Error rendering card: {e}", extra={"sample": "card_error"})
+        return JSONResponse({'error': str(e)}, status_code=500)
+    return FileResponse(path, media_type='image/png', filename=name, content_disposition_type='inline',
+                        headers={'Cache-Control': 'public, max-age=3600'})
+
+
+async def ready(request):
+    if not server._ready:
+        return JSONResponse({'ready': False}, status_code=503)
+    try:
+        await async_database.get_airport_version()
+    except Exception as e:
+        return JSONResponse({'ready': False, 'error': str(e)}, status_code=503)
+    return JSONResponse({'ready': True, 'pid': os.getpid(), 'startup_ms': server.startup})
+
+
+async def prometheus_metrics(request):
+    return PlainTextResponse(metrics.render(server.metrics_extra()),
+                             media_type='text/plain; version=0.0.4')
+
+
+class RequestMetrics:
+    """Records billete_request_seconds / billete_requests_total like server.py's hooks."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            endpoint = getattr(scope.get('endpoint'), '__name__', 'unknown')
+            metrics.record_request(endpoint, status, time.perf_counter() - started)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    loop = asyncio.get_running_loop()
+    client = httpx.AsyncClient(limits=httpx.Limits(max_connections=LOOKUP_CONCURRENCY,
+                                                   max_keepalive_connections=LOOKUP_CONCURRENCY))
+    threaded_queue = logic.lookup_queue
+    if LOOKUP_WORKERS > 0:
+        logic.lookup_queue = AsyncLookupQueue(logic, loop, client, executor=_executor)
+    try:
+        yield
+    finally:
+        logic.lookup_queue = threaded_queue
+        await client.aclose()
+        await async_database.dispose()
+        _executor.shutdown(wait=False)
+
+
+routes = [
+    Route('/', home),
+    Route('/process', process, methods=['POST']),
+    Route('/history', get_history, methods=['GET']),
+    Route('/history', clear_history, methods=['DELETE']),
+    Route('/history/{entry_id:int}', get_history_entry, methods=['GET']),
+    Route('/stats', get_stats, methods=['GET']),
+    Route('/airports', manage_airports, methods=['GET', 'POST', 'DELETE']),
+    Route('/airports/changes', airport_changes, methods=['GET']),
+    Route('/airports/lookups', airport_lookups, methods=['GET']),
+    Route('/download_ics', download_ics, methods=['GET', 'POST']),
+    Route('/card', itinerary_card, methods=['GET', 'POST']),
+    Route('/ready', ready, methods=['GET']),
+    Route('/metrics', prometheus_metrics, methods=['GET']),
+    Mount('/static', StaticFiles(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))),
+]
+
+app = RequestMetrics(Starlette(routes=routes, lifespan=lifespan))
@@ -0,0 +1,117 @@
+"""
+Async reads of the tables in database.py, for the ASGI app (asgi.py).
+
+Same settings and the same SQL: each function runs one of database.py's
+connection-level helpers. On PostgreSQL it runs on an asyncpg engine
+through run_sync, so the network waits are awaited instead of blocking a
+thread. The engine is created on first use in the process that runs the
+event loop.
+
+SQLite reads are local and take well under a millisecond. aiosqlite
+passes several event-loop round trips per query, and under load those
+cost more than the query itself (/history p50 150 ms against 60 ms in
+benchmarks.loadtest --asgi). By default the whole read therefore runs on
+a small thread pool, in one hop. BILLETE_ASYNC_SQLITE=aiosqlite uses the
+driver instead.
+
+Writes still go through database.py. The history writer and airport
+edits run off the event loop.
+"""
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.ext.asyncio import create_async_engine
+import database
+
+SQLITE_MODE = os.getenv("BILLETE_ASYNC_SQLITE", "thread").strip().lower()
+SQLITE_THREADS = int(os.getenv("BILLETE_ASYNC_SQLITE_THREADS", "4"))
+
+_engine = None
+_sqlite_pool = None
+
+
+def async_url(url):
+    """The SQLAlchemy URL for the async driver of the same database."""
+    scheme, sep, rest = url.partition("://")
+    dialect = scheme.split("+", 1)[0]
+    if dialect == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if dialect == "postgresql":
+        return f"postgresql+asyncpg{sep}{rest}"
+    raise ValueError(f"No async driver configured for {dialect}")
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        url = database.read_db_url
+        if database._is_sqlite_memory(url):
+            raise ValueError("An in-memory SQLite database can't be shared with an async engine")
+        options = database._engine_options(url)
+        if database._is_sqlite(url):
+            # aiosqlite runs each connection on its own thread already
+            options["connect_args"].pop("check_same_thread", None)
+        _engine = create_async_engine(async_url(url), **options)
+        if database._is_sqlite(url):
+            database._tune_sqlite(_engine.sync_engine, "BEGIN")
+        database._time_queries(_engine.sync_engine)
+    return _engine
+
+
+async def dispose():
+    global _engine, _sqlite_pool
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+    if _sqlite_pool is not None:
+        _sqlite_pool.shutdown(wait=False)
+        _sqlite_pool = None
+
+
+def _use_engine():
+    return not database._is_sqlite(database.read_db_url) or SQLITE_MODE == "aiosqlite"
+
+
+def _read_sync(fn, *args):
+    with database.read_connection() as conn:
+        return fn(conn, *args)
+
+
+async def _read(fn, *args):
+    global _sqlite_pool
+    if not _use_engine():
+        if _sqlite_pool is None:
+            _sqlite_pool = ThreadPoolExecutor(max_workers=SQLITE_THREADS, thread_name_prefix="sqlite-read")
+        return await asyncio.get_running_loop().run_in_executor(_sqlite_pool, _read_sync, fn, *args)
+    async with get_engine().connect() as conn:
+        return await conn.run_sync(fn, *args)
+
+
+async def get_airport_version():
+    return await _read(database._read_version, "airports")
+
+
+async def get_airport_changes(since):
+    return await _read(database._airport_changes, since)
+
+
+async def get_history_entries(limit=100, before_id=None):
+    return await _read(database._history_entries, limit, before_id)
+
+
+async def get_history_codes(first_id, last_id, limit=100):
+    return await _read(database._history_codes, first_id, last_id, limit)
+
+
+async def get_history_entry(entry_id):
+    return await _read(database._history_entry, entry_id)
+
+
+async def get_today_count():
+    """Shares database.get_today_count's per-process cache."""
+    today, count = database._cached_today_count()
+    if count is not None:
+        return count
+    count = await _read(database._daily_count, today)
+    database._store_today_count(today, count)
+    return count
@@ -0,0 +1,100 @@
+"""
+Pool worker for /process/batch, and the /process response body it shares
+with server.py.
+
+Batch pool processes are started by a forkserver (spawn where that isn't
+available) and import only this module, not the web app: no init_db, no
+warmup, no history writer or lookup threads. Each process builds one Logic
+on first use. Online airport lookups are left to the web worker, which
+queues the codes a result reports in pending_airports.
+"""
+import datetime
+
+import database
+import logic as _mod
+
+logic = None
+
+
+def init(defer_lookups=True):
+    """Pool initializer."""
+    global logic
+    # A forkserver child forks from a process that may have opened connections
+    database.dispose_engines()
+    logic = _mod.Logic()
+    if defer_lookups:
+        logic.lookup_queue = _DeferredLookups()
+
+
+class _DeferredLookups:
+    """Stands in for a LookupQueue: resolve_airport reports the code as pending and moves on."""
+
+    def submit(self, code):
+        pass
+
+
+def process_item(data):
+    """Parses one batch entry. Returns (body, pax_str, route_str)."""
+    if logic is None:
+        init()
+    itinerary = logic.parse(data['code'])
+    return build_process_result(itinerary, data)
+
+
+def public_flight(flight):
+    # Aware datetimes on the flight record go out as ISO 8601 strings
+    return {k: v.isoformat() if isinstance(v, datetime.datetime) else v for k, v in flight.items()}
+
+
+def build_process_result(itinerary, data):
+    """
+    Turns a parsed Itinerary plus the request's luggage fields into the
+    /process response body and the history fields (pax_str, route_str).
+    """
+    result_text = itinerary.text
+
+    # Append Luggage
+    hand_count = data.get('hand_count', '1')
+    hand_weight = data.get('hand_weight', '8')
+    pack_count = data.get('pack_count', '2')
+    pack_weight = data.get('pack_weight', '23')
+
+    luggage_info = f"\n经济舱往返 欧\n托运行李{pack_count} 件,每件{pack_weight}公斤\n手提行李{hand_count}件{hand_weight} 公斤\n"
+    final_result = result_text + luggage_info
+
+    # If result is suspiciously empty (only luggage), append debug logs
+    if not result_text.strip() and itinerary.logs:
+         final_result += "\n\n[Debug Logs (Render Fix)]:\n" + "\n".join(itinerary.logs)
+
+    # Construct route string for history
+    flights = itinerary.flights
+    route_str = ""
+    if flights:
+        if len(flights) == 1:
+            route_str = f"{flights[0]['origin']}-{flights[0]['dest']}"
+        else:
+            full_path = [flights[0]['origin']]
+            for f in flights:
+                full_path.append(f['dest'])
+            route_str = "-".join(full_path)
+
+    # Extract passengers string for history
+    pax_names = [p['name'] for p in itinerary.passengers]
+    pax_str = ", ".join(pax_names)
+
+    body = {
+        'result': final_result,
+        'pending_airports': list(itinerary.pending_airports),
+        'structured': {
+            'passengers': pax_names,
+            'flights': [public_flight(f) for f in flights],
+            'layovers': list(itinerary.layovers),
+            'luggage': {
+                'hand_count': hand_count,
+                'hand_weight': hand_weight,
+                'pack_count': pack_count,
+                'pack_weight': pack_weight
+            }
+        }
+    }
+    return body, pax_str, route_str
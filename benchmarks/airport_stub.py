@@ -0,0 +1,120 @@
+"""
+Local stand-in for airport.supfree.net, for load tests.
+
+Serves /search.asp?s=<CODE> as a GBK-encoded results table in the shape
+Logic.fetch_online_airport_name scrapes, after a configurable delay. A
+share of requests can fail with a 500, hang past the client's timeout, or
+come back with no matching row.
+
+Point the server at it with
+    BILLETE_AIRPORT_LOOKUP_URL=http://127.0.0.1:<port>/search.asp?s={code}
+
+Usage (standalone):
+    python -m benchmarks.airport_stub [--port 8765] [--latency-ms 300] [--fail-rate 0.1]
+"""
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_PAGE = """<html><head><meta charset="gb2312"><title>机场查询</title></head><body>
+<table>
+<tr><td>三字码</td><td>机场名称</td><td>城市</td><td>国家</td></tr>
+{rows}
+</table></body></html>"""
+
+
+class StubConfig:
+    def __init__(self, latency_ms=300.0, jitter_ms=100.0, fail_rate=0.0, hang_rate=0.0,
+                 not_found_rate=0.0, hang_seconds=5.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.fail_rate = fail_rate
+        self.hang_rate = hang_rate
+        self.not_found_rate = not_found_rate
+        self.hang_seconds = hang_seconds
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"ok": 0, "failed": 0, "hung": 0, "not_found": 0}
+
+    def draw(self):
+        """Picks the outcome and delay (seconds) for one request."""
+        with self.lock:
+            roll = self.rng.random()
+            delay = max(0.0, self.rng.gauss(self.latency_ms, self.jitter_ms)) / 1000
+            if roll < self.hang_rate:
+                outcome = "hung"
+                delay = self.hang_seconds
+            elif roll < self.hang_rate + self.fail_rate:
+                outcome = "failed"
+            elif roll < self.hang_rate + self.fail_rate + self.not_found_rate:
+                outcome = "not_found"
+            else:
+                outcome = "ok"
+            self.counts[outcome] += 1
+        return outcome, delay
+
+
+def _handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            code = (parse_qs(url.query).get("s") or [""])[0].upper()
+            outcome, delay = config.draw()
+            time.sleep(delay)
+
+            if outcome == "failed":
+                self.send_response(500)
+                self.end_headers()
+                return
+            rows = ""
+            if outcome != "not_found" and code:
+                rows = f"<tr><td>{code}</td><td>测试机场{code}</td><td>测试城市</td><td>中国</td></tr>"
+            body = _PAGE.format(rows=rows).encode("gbk")
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=gb2312")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client gave up (timeout)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(config, host="127.0.0.1", port=0):
+    """Starts the stub on a daemon thread. Returns the server; its port is server.server_port."""
+    server = ThreadingHTTPServer((host, port), _handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="airport-stub", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--not-found-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency_ms, args.jitter_ms, args.fail_rate, args.hang_rate, args.not_found_rate)
+    server = start_stub(config, port=args.port)
+    print(f"Airport stub on http://127.0.0.1:{server.server_port}/search.asp?s={{code}}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(config.counts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Startup time and resident memory of the airport lookup data.
+
+Each variant runs in a fresh interpreter: load the data, look up every
+code used by benchmarks.samples, then report wall time and peak RSS growth
+over a bare interpreter.
+
+Usage (from the repo root, after `python airport_index.py`):
+    python -m benchmarks.bench_airport_index
+"""
+import json
+import subprocess
+import sys
+
+_PROBE = r"""
+import json, resource, sys, time
+base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+codes = {codes!r}
+if {variant!r} == "airportsdata":
+    import airportsdata
+    db = airportsdata.load('IATA')
+else:
+    import airport_index
+    db = airport_index.AirportIndex()
+found = [db[c]['tz'] for c in codes if c in db]
+elapsed = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# ru_maxrss is KiB on Linux, bytes on macOS
+per_mb = 1024 * 1024 if sys.platform == "darwin" else 1024
+print(json.dumps({{"seconds": elapsed, "rss_mb": (peak - base) / per_mb, "found": len(found)}}))
+"""
+
+
+def run(variant, codes):
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(variant=variant, codes=codes)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    from benchmarks.samples import AIRPORTS
+
+    print(f"{'variant':<16}{'load+lookup ms':>16}{'RSS growth MB':>16}")
+    for variant in ("airportsdata", "airport_index"):
+        runs = [run(variant, AIRPORTS) for _ in range(3)]
+        best = min(runs, key=lambda r: r["seconds"])
+        print(f"{variant:<16}{best['seconds'] * 1000:>16.1f}{best['rss_mb']:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+History insert/read throughput under concurrent load.
+
+Each configuration runs in a fresh interpreter, because database.py reads
+its settings at import. Writer threads call add_history_entry and reader
+threads call get_history_entries at the same time. The report shows
+operations per second and how many calls failed, e.g. with
+"database is locked".
+
+Each run starts by deleting every history row, so it never uses
+DATABASE_URL: SQLite runs use temporary files, and --postgres needs a
+scratch database in BENCH_DATABASE_URL.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_history_db [--threads 8] [--ops 200]
+    BENCH_DATABASE_URL=postgresql://.../scratch python -m benchmarks.bench_history_db --postgres
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from dotenv import dotenv_values
+
+_WORKER = r"""
+import json, sys, threading, time
+import database
+
+threads, ops = int(sys.argv[1]), int(sys.argv[2])
+database.init_db()
+database.clear_history_entries()
+result = "x" * 400
+code = "y" * 1500
+stats = {"insert": [0, 0, 0.0], "read": [0, 0, 0.0]}  # ok, failed, seconds
+lock = threading.Lock()
+
+def work(kind):
+    ok = failed = 0
+    start = time.perf_counter()
+    for i in range(ops):
+        try:
+            if kind == "insert":
+                database.add_history_entry(code, result, "PAX", "MAD-PEK")
+            else:
+                database.get_history_entries(limit=50)
+            ok += 1
+        except Exception:
+            failed += 1
+    elapsed = time.perf_counter() - start
+    with lock:
+        s = stats[kind]
+        s[0] += ok; s[1] += failed; s[2] = max(s[2], elapsed)
+
+workers = [threading.Thread(target=work, args=("insert" if i % 2 == 0 else "read",)) for i in range(threads)]
+for t in workers: t.start()
+for t in workers: t.join()
+print(json.dumps({k: {"ops_per_s": v[0] / v[2] if v[2] else 0, "failed": v[1]} for k, v in stats.items()}))
+"""
+
+
+def run(env, threads, ops):
+    out = subprocess.run(
+        [sys.executable, "-c", _WORKER, str(threads), str(ops)],
+        env={**os.environ, **env}, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=200)
+    parser.add_argument("--postgres", action="store_true",
+                        help="use BENCH_DATABASE_URL from the environment instead of temporary SQLite files")
+    args = parser.parse_args()
+
+    bench_url = os.getenv("BENCH_DATABASE_URL", "")
+    if args.postgres:
+        if not bench_url:
+            parser.error("--postgres needs BENCH_DATABASE_URL (a scratch database; its history is deleted)")
+        if bench_url in (os.getenv("DATABASE_URL"), dotenv_values().get("DATABASE_URL")):
+            parser.error("BENCH_DATABASE_URL is the app's DATABASE_URL; point it at a scratch database")
+        configs = [
+            ("postgres default pool", {}),
+            ("postgres pool 16+8", {"BILLETE_DB_POOL_SIZE": "16", "BILLETE_DB_MAX_OVERFLOW": "8"}),
+            ("postgres NullPool", {"BILLETE_DB_POOL": "null"}),
+        ]
+    else:
+        configs = [
+            ("sqlite rollback journal", {"BILLETE_SQLITE_WAL": "0", "BILLETE_SQLITE_SYNCHRONOUS": "FULL"}),
+            ("sqlite WAL+NORMAL", {}),
+        ]
+
+    print(f"{'config':<24}{'insert/s':>10}{'failed':>8}{'read/s':>10}{'failed':>8}")
+    for label, env in configs:
+        with tempfile.TemporaryDirectory() as tmp:
+            url = bench_url if args.postgres else f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+            env = {**env, "DATABASE_URL": url}
+            r = run(env, args.threads, args.ops)
+        print(f"{label:<24}{r['insert']['ops_per_s']:>10.0f}{r['insert']['failed']:>8}"
+              f"{r['read']['ops_per_s']:>10.0f}{r['read']['failed']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Throughput of pnr_lexer.tokenize() against the old multi-scan line parser.
+
+The legacy path below is the scanning half of the previous Logic.process:
+uncompiled merge regex, the month pre-pass, the dispatch pass and the
+per-token scans in parse_flight. Airport and timezone work is left out so
+only tokenizing is compared.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_lexer [--repeat N]
+"""
+import argparse
+import re
+import time
+
+import pnr_lexer
+from benchmarks.samples import group_pnr
+
+LEGACY_MONTHS = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
+
+
+def _legacy_contain_month(text):
+    return any(m in text for m in LEGACY_MONTHS)
+
+
+def _legacy_merge(text):
+    output = []
+    previous_line = None
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        if re.match(r'^\d+.*', line):
+            if previous_line is not None:
+                output.append(previous_line)
+            previous_line = line
+        else:
+            if previous_line is not None:
+                previous_line += " " + line
+            else:
+                previous_line = line
+    if previous_line is not None:
+        output.append(previous_line)
+    return "\n".join(output)
+
+
+def _legacy_flight(parts):
+    date_idx = -1
+    for i, part in enumerate(parts):
+        if _legacy_contain_month(part):
+            date_idx = i
+            break
+    if date_idx == -1 or date_idx + 2 >= len(parts):
+        return None
+    for i in range(date_idx + 3, len(parts)):
+        if re.match(r'^\d{4}$', parts[i]) or re.match(r'^\d{4}\+\d$', parts[i]):
+            return parts[i], parts[i + 1] if i + 1 < len(parts) else None
+    return None
+
+
+def legacy_scan(text):
+    lines = _legacy_merge(text).split("\n")
+    months_found = []
+    for line in lines:
+        if _legacy_contain_month(line) and "SSR" not in line and "FA" not in line:
+            for part in line.split():
+                if _legacy_contain_month(part):
+                    for m in LEGACY_MONTHS:
+                        if m in part:
+                            months_found.append(m)
+                            break
+
+    out = []
+    passenger_mode = True
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        if "." in line and passenger_mode and "SSR" not in line and "FA" not in line:
+            if "." in parts[0]:
+                out.append(pnr_lexer.NAME)
+                continue
+            passenger_mode = False
+        if "SSR" in line and "DOCS" in line:
+            out.append(pnr_lexer.SSR_DOCS)
+        elif "FA" in line and "PAX" in line:
+            out.append(pnr_lexer.FA_PAX)
+        elif _legacy_contain_month(line) and "SSR" not in line and "FA" not in line:
+            _legacy_flight(parts)
+            out.append(pnr_lexer.SEGMENT)
+    return out
+
+
+def lexer_scan(text):
+    return [r.kind for r in pnr_lexer.tokenize(text)]
+
+
+def _time(fn, text, repeat):
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'input':<14}{'legacy us':>12}{'lexer us':>12}{'speedup':>10}{'PNR/s':>12}")
+    for pax, segs in [(1, 2), (9, 16), (30, 16), (99, 16)]:
+        text = group_pnr(pax, segs, seed=pax)
+        legacy = _time(legacy_scan, text, args.repeat)
+        lexer = _time(lexer_scan, text, args.repeat)
+        print(f"{f'{pax}pax-{segs}seg':<14}{legacy * 1e6:>12.1f}{lexer * 1e6:>12.1f}"
+              f"{legacy / lexer:>9.2f}x{1 / lexer:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
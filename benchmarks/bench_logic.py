@@ -0,0 +1,183 @@
+"""
+Microbenchmarks for the Logic parsing pipeline.
+
+Times each stage on every input size in benchmarks.samples.SIZES:
+merge_lines_without_sequence_number, parse_flight (all segments of the
+PNR), resolve_airport (local map hit and known-miss), calculate_layovers,
+generate_text, generate_ics and end-to-end Logic.process. Online lookups
+are disabled and the database is a temporary SQLite file unless
+DATABASE_URL is set.
+
+Results can be saved as JSON and compared against an earlier run:
+    python -m benchmarks.bench_logic --json before.json
+    (change something)
+    python -m benchmarks.bench_logic --compare before.json [--threshold 10]
+--compare exits with status 1 if any case got slower by more than the
+threshold (percent).
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# database.py reads DATABASE_URL on import, so pick the database before importing logic
+_tmpdir = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmpdir.name, 'bench.db')}")
+
+import database  # noqa: E402
+import logic  # noqa: E402
+import pnr_lexer  # noqa: E402
+from benchmarks.samples import AIRPORTS, SIZES, group_pnr  # noqa: E402
+
+MISSING_CODE = "QQZ"
+
+
+def _timeit(fn, rounds, min_time):
+    """Best per-call time in seconds over `rounds` rounds of at least min_time each."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - start >= min_time:
+            break
+        number *= 2
+
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def make_logic():
+    database.init_db()
+    lg = logic.Logic()
+    lg.fetch_online_airport_name = lambda code, state=None: None
+    # Warm the map and the miss cache so resolve_airport timings are steady-state
+    for code in AIRPORTS:
+        lg.resolve_airport(code)
+    lg.resolution_cache.record_miss(MISSING_CODE)
+    return lg
+
+
+def cases(lg):
+    """Yields (name, callable) for every stage and input size."""
+    yield "resolve_airport[map]", lambda: lg.resolve_airport("PEK")
+    yield "resolve_airport[miss]", lambda: lg.resolve_airport(MISSING_CODE)
+
+    for label, pax, segs in SIZES:
+        text = group_pnr(pax, segs, seed=pax * 100 + segs)
+        itinerary = lg.parse(text)
+        passengers = list(itinerary.passengers)
+        flights = list(itinerary.flights)
+        layovers = list(itinerary.layovers)
+        segments = [r.parts for r in pnr_lexer.tokenize(text) if r.kind == pnr_lexer.SEGMENT]
+
+        def parse_flights(segments=segments):
+            state = logic.ParseState(lg.base_year)
+            state.current_year = lg.base_year
+            for parts in segments:
+                lg.parse_flight(parts, state)
+
+        def layover_pass(flights=flights):
+            state = logic.ParseState(lg.base_year)
+            state.flights = flights
+            lg.calculate_layovers(state)
+
+        yield f"merge_lines[{label}]", lambda text=text: lg.merge_lines_without_sequence_number(text)
+        yield f"parse_flight[{label}]", parse_flights
+        yield f"calculate_layovers[{label}]", layover_pass
+        yield f"generate_text[{label}]", lambda p=passengers, f=flights, l=layovers: lg.generate_text(p, f, l)
+        yield f"generate_ics[{label}]", lambda f=flights: lg.generate_ics(f)
+        yield f"process[{label}]", lambda text=text: lg.process(text)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(rounds, min_time, only=None):
+    lg = make_logic()
+    timings = []
+    for name, fn in cases(lg):
+        if only and only not in name:
+            continue
+        timings.append((name, _timeit(fn, rounds, min_time)))
+
+    results = {}
+    for name, seconds in timings:
+        results[name] = {"us": round(seconds * 1e6, 3), "ops_per_s": round(1 / seconds, 1)}
+        print(f"{name:<36}{seconds * 1e6:>12.2f} us{1 / seconds:>14.0f}/s")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Prints the change per case against baseline; returns the names that regressed."""
+    regressed = []
+    print()
+    print(f"{'case':<36}{'before us':>12}{'after us':>12}{'change':>10}")
+    for name, now in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            print(f"{name:<36}{'-':>12}{now['us']:>12.2f}{'new':>10}")
+            continue
+        change = (now["us"] - before["us"]) / before["us"] * 100
+        flag = ""
+        if change > threshold:
+            regressed.append(name)
+            flag = "  <-- slower"
+        print(f"{name:<36}{before['us']:>12.2f}{now['us']:>12.2f}{change:>+9.1f}%{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rounds", type=int, default=5, help="timed rounds per case (best is kept)")
+    parser.add_argument("--min-time", type=float, default=0.05, help="seconds per round")
+    parser.add_argument("--only", help="run only cases whose name contains this text")
+    parser.add_argument("--json", metavar="PATH", help="write results to PATH")
+    parser.add_argument("--compare", metavar="PATH", help="compare against results saved with --json")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="percent slowdown that counts as a regression with --compare")
+    args = parser.parse_args()
+
+    results = run(args.rounds, args.min_time, args.only)
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds")
+        },
+        "results": results
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.json}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressed = compare(results, baseline, args.threshold)
+        if regressed:
+            print(f"\n{len(regressed)} case(s) slower than {args.threshold:.0f}%: {', '.join(regressed)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
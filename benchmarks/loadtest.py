@@ -0,0 +1,268 @@
+"""
+Load test for server.py under gunicorn, fully offline.
+
+Starts benchmarks.airport_stub in-process and gunicorn with a temporary
+SQLite database, with the online airport lookup pointed at the stub. Then
+client threads send a weighted mix of /process (synthetic PNRs from
+benchmarks.samples, some with codes only the stub knows), /history, /stats
+and /airports (revalidated with If-None-Match like the browser does).
+Reports requests/s and p50/p95/p99 latency per endpoint.
+
+To see what the inline 2s online fallback does to tail latency, compare
+    python -m benchmarks.loadtest
+    python -m benchmarks.loadtest --inline-lookups
+The first run uses the background lookup queue; the second sets
+BILLETE_LOOKUP_WORKERS=0 so /process waits on the stub. --asgi serves
+asgi.py with uvicorn instead of server.py with gunicorn.
+
+Usage (from the repo root):
+    python -m benchmarks.loadtest [--clients 16] [--duration 20] [--workers 2] [--threads 4]
+        [--unknown-rate 0.2] [--stub-latency-ms 300] [--stub-fail-rate 0.1] [--stub-hang-rate 0.05]
+        [--asgi] [--json results.json]
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmarks.airport_stub import StubConfig, start_stub
+from benchmarks.samples import AIRPORTS, group_pnr
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# endpoint -> weight
+MIX = {"process": 60, "history": 15, "stats": 15, "airports": 10}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def unknown_codes(count, seed):
+    """Three-letter codes that neither the airport index nor airportsdata knows."""
+    import airport_index
+
+    index = airport_index.AirportIndex()
+    rng = random.Random(seed)
+    codes = set()
+    while len(codes) < count:
+        code = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(3))
+        if code not in index:
+            codes.add(code)
+    return sorted(codes)
+
+
+def make_pnrs(count, unknown_rate, unknown, seed):
+    rng = random.Random(seed)
+    pnrs = []
+    for i in range(count):
+        pax = rng.choice([1, 1, 1, 2, 3, 5, 9])
+        segs = rng.choice([1, 2, 2, 4, 6, 16])
+        airports = AIRPORTS
+        if unknown and rng.random() < unknown_rate:
+            airports = AIRPORTS[:4] + rng.sample(unknown, min(3, len(unknown)))
+        pnrs.append(group_pnr(pax, segs, seed=seed * 10000 + i, airports=airports))
+    return pnrs
+
+
+def start_server(port, workers, threads, env, asgi=False):
+    if asgi:
+        cmd = [
+            sys.executable, "-m", "uvicorn", "asgi:app",
+            "--port", str(port),
+            "--workers", str(workers),
+            "--log-level", "warning",
+        ]
+    else:
+        cmd = [
+            sys.executable, "-m", "gunicorn", "server:app",
+            "--bind", f"127.0.0.1:{port}",
+            "--workers", str(workers),
+            "--worker-class", "gthread",
+            "--threads", str(threads),
+            "--log-level", "warning",
+        ]
+    proc = subprocess.Popen(cmd, cwd=REPO_ROOT, env={**os.environ, **env},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{cmd[2]} exited:\n{proc.stderr.read()}")
+        try:
+            if requests.get(base + "/ready", timeout=1).status_code == 200:
+                return proc, base
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"{cmd[2]} did not become ready within 60s")
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+class Client(threading.Thread):
+    def __init__(self, base, pnrs, stop_at, seed, results, lock):
+        super().__init__(daemon=True)
+        self.base = base
+        self.pnrs = pnrs
+        self.stop_at = stop_at
+        self.rng = random.Random(seed)
+        self.results = results
+        self.lock = lock
+        self.session = requests.Session()
+        self.airports_etag = None
+
+    def _call(self, kind):
+        if kind == "process":
+            resp = self.session.post(self.base + "/process", json={
+                "code": self.rng.choice(self.pnrs),
+                "hand_count": "1", "hand_weight": "8", "pack_count": "2", "pack_weight": "23"
+            }, timeout=30)
+        elif kind == "history":
+            resp = self.session.get(self.base + "/history?limit=50", timeout=30)
+        elif kind == "stats":
+            resp = self.session.get(self.base + "/stats", timeout=30)
+        else:
+            headers = {"If-None-Match": self.airports_etag} if self.airports_etag else {}
+            resp = self.session.get(self.base + "/airports", headers=headers, timeout=30)
+            self.airports_etag = resp.headers.get("ETag", self.airports_etag)
+        return resp.status_code < 400
+
+    def run(self):
+        kinds = list(MIX)
+        weights = [MIX[k] for k in kinds]
+        local = {k: {"latencies": [], "errors": 0} for k in kinds}
+        while time.time() < self.stop_at:
+            kind = self.rng.choices(kinds, weights)[0]
+            start = time.perf_counter()
+            try:
+                ok = self._call(kind)
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            local[kind]["latencies"].append(elapsed)
+            if not ok:
+                local[kind]["errors"] += 1
+        with self.lock:
+            for kind, data in local.items():
+                self.results[kind]["latencies"].extend(data["latencies"])
+                self.results[kind]["errors"] += data["errors"]
+
+
+def summarize(results, duration):
+    report = {}
+    everything = []
+    for kind, data in list(results.items()) + [("all", None)]:
+        if data is None:
+            latencies = sorted(everything)
+            errors = sum(d["errors"] for d in results.values())
+        else:
+            latencies = sorted(data["latencies"])
+            errors = data["errors"]
+            everything.extend(latencies)
+        report[kind] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "rps": round(len(latencies) / duration, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round((latencies[-1] if latencies else 0) * 1000, 2),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn/uvicorn workers")
+    parser.add_argument("--threads", type=int, default=4, help="threads per gunicorn worker")
+    parser.add_argument("--asgi", action="store_true", help="serve asgi.py with uvicorn instead")
+    parser.add_argument("--pnrs", type=int, default=200, help="distinct synthetic PNRs")
+    parser.add_argument("--unknown-rate", type=float, default=0.2,
+                        help="share of PNRs that route through codes only the stub resolves")
+    parser.add_argument("--unknown-codes", type=int, default=300)
+    parser.add_argument("--inline-lookups", action="store_true",
+                        help="BILLETE_LOOKUP_WORKERS=0: /process waits on online lookups")
+    parser.add_argument("--stub-latency-ms", type=float, default=300.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--stub-fail-rate", type=float, default=0.1)
+    parser.add_argument("--stub-hang-rate", type=float, default=0.05)
+    parser.add_argument("--stub-not-found-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH", help="write the report to PATH")
+    args = parser.parse_args()
+
+    stub_config = StubConfig(args.stub_latency_ms, args.stub_jitter_ms, args.stub_fail_rate,
+                             args.stub_hang_rate, args.stub_not_found_rate, seed=args.seed)
+    stub = start_stub(stub_config)
+
+    unknown = unknown_codes(args.unknown_codes, args.seed) if args.unknown_rate > 0 else []
+    pnrs = make_pnrs(args.pnrs, args.unknown_rate, unknown, args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'load.db')}",
+            "BILLETE_AIRPORT_LOOKUP_URL": f"http://127.0.0.1:{stub.server_port}/search.asp?s={{code}}",
+            "BILLETE_HISTORY_SPOOL": os.path.join(tmp, "history_spool.jsonl"),
+        }
+        if args.inline_lookups:
+            env["BILLETE_LOOKUP_WORKERS"] = "0"
+        proc, base = start_server(_free_port(), args.workers, args.threads, env, args.asgi)
+
+        try:
+            results = {k: {"latencies": [], "errors": 0} for k in MIX}
+            lock = threading.Lock()
+            stop_at = time.time() + args.duration
+            clients = [Client(base, pnrs, stop_at, args.seed * 1000 + i, results, lock)
+                       for i in range(args.clients)]
+            started = time.time()
+            for c in clients:
+                c.start()
+            for c in clients:
+                c.join()
+            elapsed = time.time() - started
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            stub.shutdown()
+
+    report = summarize(results, elapsed)
+    mode = "inline lookups" if args.inline_lookups else "background lookups"
+    server = f"{args.workers} uvicorn" if args.asgi else f"{args.workers}x{args.threads} gunicorn"
+    print(f"{args.clients} clients, {elapsed:.1f}s, {server}, {mode}")
+    print(f"{'endpoint':<10}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'max ms':>10}")
+    for kind, r in report.items():
+        print(f"{kind:<10}{r['requests']:>10}{r['errors']:>8}{r['rps']:>9.1f}{r['p50_ms']:>10.1f}"
+              f"{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}")
+    print(f"stub: {stub_config.counts}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "stub": stub_config.counts, "results": report}, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Synthetic Amadeus PNRs shaped like the sample in history.json.
+
+group_pnr(passengers, segments) builds a booking with one name line per
+passenger, chained segments, SSR DOCS / FA PAX lines per passenger and the
+usual continuation lines, so benchmarks can scale input size predictably.
+"""
+import random
+
+# Codes that are in airportsdata, so resolution stays offline
+AIRPORTS = ["MAD", "PEK", "ULN", "PVG", "CDG", "FRA", "AMS", "LHR", "BCN", "CAN",
+            "HKG", "IST", "DXB", "DOH", "VLC", "CTU", "SZX", "FCO", "MUC", "ZRH"]
+AIRLINES = ["CA", "MU", "CZ", "IB", "AF", "LH", "KL", "TK", "EK", "QR"]
+MONTHS = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
+SURNAMES = ["XIAO", "WANG", "LI", "ZHANG", "LIU", "CHEN", "YANG", "ZHAO", "HUANG", "ZHOU"]
+GIVEN = ["YIYI", "WEI", "FANG", "NA", "MIN", "JING", "LEI", "YAN", "TAO", "MEI"]
+
+
+def group_pnr(passengers=1, segments=2, seed=0, airports=AIRPORTS):
+    rng = random.Random(seed)
+    lines = []
+    seq = 1
+
+    names = [f"{rng.choice(SURNAMES)}/{rng.choice(GIVEN)}" for _ in range(passengers)]
+    # Amadeus prints up to three names per line
+    for i in range(0, passengers, 3):
+        chunk = names[i:i + 3]
+        lines.append("  ".join(f"{seq + j}.{n}" for j, n in enumerate(chunk)))
+        seq += len(chunk)
+
+    route = [rng.choice(airports)]
+    while len(route) <= segments:
+        code = rng.choice(airports)
+        if code != route[-1]:
+            route.append(code)
+
+    month = rng.randrange(12)
+    day = rng.randint(1, 20)
+    for i in range(segments):
+        if i and rng.random() < 0.25:
+            month = (month + 1) % 12
+            day = rng.randint(1, 20)
+        dep = f"{rng.randint(0, 23):02d}{rng.choice(['00', '15', '30', '45'])}"
+        arr = f"{rng.randint(0, 23):02d}{rng.choice(['05', '20', '35', '50'])}"
+        if rng.random() < 0.3:
+            arr += "+1"
+        lines.append(
+            f"{seq:>3}  {rng.choice(AIRLINES)} {rng.randint(100, 9999)} L {day:02d}{MONTHS[month]} "
+            f"{rng.randint(1, 7)} {route[i]}{route[i + 1]} HK{passengers}       1  {dep} {arr}   *1A/E*"
+        )
+        seq += 1
+        day = min(day + 1, 28)
+
+    lines.append(f"{seq:>3} APE AEREOMAD@SANHE.ES")
+    seq += 1
+    lines.append(f"{seq:>3} TK OK27MAR/VLCI12260//ETCA")
+    seq += 1
+    for p, name in enumerate(names, start=1):
+        surname, given = name.split("/")
+        lines.append(f"{seq:>3} SSR DOCS CA HK1 P/CHN/EL{rng.randint(1000000, 9999999)}/CHN/22SEP93/F/26FEB34/{surname}/{given[:1]}")
+        lines.append(f"       {given[1:]}/P{p}")
+        seq += 1
+    for p in range(1, passengers + 1):
+        lines.append(f"{seq:>3} FA PAX 999-{rng.randint(1000000000, 9999999999)}/ETCA/EUR696.11/27MAR24/VLCI12260/78234")
+        lines.append(f"       063/P{p}/S2-{segments + 1}")
+        seq += 1
+    lines.append(f"{seq:>3} FM PAX *C*0.00/S2-{segments + 1}")
+    return "\n".join(lines)
+
+
+# (label, passengers, segments) from a single traveller to a full group
+SIZES = [
+    ("1pax-1seg", 1, 1),
+    ("1pax-2seg", 1, 2),
+    ("3pax-4seg", 3, 4),
+    ("9pax-16seg", 9, 16),
+]
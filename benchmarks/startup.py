@@ -0,0 +1,135 @@
+"""
+Cold-start time of the web app.
+
+Two measurements, each against a fresh temporary SQLite database:
+  import   runs `import server` in new interpreters and reports the wall time
+           (interpreter start included) and server.startup's phases
+  gunicorn starts gunicorn with gunicorn.conf.py, with preload_app on and off,
+           and reports the time until /ready first answers 200 and until every
+           worker has answered it
+
+Usage (from the repo root):
+    python -m benchmarks.startup [--runs 5] [--workers 4] [--no-warmup] [--json results.json]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT = r"""
+import json, server
+print(json.dumps(server.startup))
+"""
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(env):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", _IMPORT], cwd=REPO_ROOT, env={**os.environ, **env},
+                         check=True, capture_output=True, text=True).stdout
+    wall = (time.perf_counter() - start) * 1000
+    return wall, json.loads(out.strip().splitlines()[-1])
+
+
+def measure_gunicorn(env, workers, timeout=60):
+    """Returns (ms until the first /ready 200, ms until all workers answered it)."""
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "server:app",
+         "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--log-level", "warning"],
+        cwd=REPO_ROOT, env={**os.environ, **env}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    first = None
+    pids = set()
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            try:
+                resp = requests.get(base + "/ready", timeout=1)
+            except requests.RequestException:
+                time.sleep(0.01)
+                continue
+            if resp.status_code == 200:
+                if first is None:
+                    first = (time.perf_counter() - start) * 1000
+                pids.add(resp.json()["pid"])
+                if len(pids) >= workers:
+                    return first, (time.perf_counter() - start) * 1000
+        raise RuntimeError(f"only {len(pids)} of {workers} workers ready after {timeout}s")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5, help="repetitions per measurement (median is kept)")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--no-warmup", action="store_true", help="BILLETE_WARMUP=0")
+    parser.add_argument("--json", metavar="PATH", help="write the report to PATH")
+    args = parser.parse_args()
+
+    report = {"import": {}, "gunicorn": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'startup.db')}",
+            "BILLETE_HISTORY_SPOOL": os.path.join(tmp, "history_spool.jsonl"),
+            "BILLETE_LOG_LEVEL": "WARNING",
+        }
+        if args.no_warmup:
+            env["BILLETE_WARMUP"] = "0"
+
+        walls, phases = [], {}
+        for _ in range(args.runs):
+            wall, startup = measure_import(env)
+            walls.append(wall)
+            for phase, ms in startup.items():
+                phases.setdefault(phase, []).append(ms)
+        report["import"] = {"wall_ms": round(statistics.median(walls), 1),
+                            **{f"{p}_ms": round(statistics.median(v), 1) for p, v in phases.items()}}
+
+        for preload in ("1", "0"):
+            firsts, alls = [], []
+            for _ in range(args.runs):
+                first, everyone = measure_gunicorn({**env, "BILLETE_PRELOAD": preload}, args.workers)
+                firsts.append(first)
+                alls.append(everyone)
+            report["gunicorn"][f"preload={preload}"] = {
+                "first_ready_ms": round(statistics.median(firsts), 1),
+                "all_ready_ms": round(statistics.median(alls), 1),
+            }
+
+    print(f"import server: {report['import']['wall_ms']:.0f} ms wall  "
+          + "  ".join(f"{k[:-3]}={v:.0f}" for k, v in report["import"].items() if k != "wall_ms"))
+    print(f"{'gunicorn':<14}{'first ready ms':>16}{'all ready ms':>14}   ({args.workers} workers)")
+    for label, r in report["gunicorn"].items():
+        print(f"{label:<14}{r['first_ready_ms']:>16.0f}{r['all_ready_ms']:>14.0f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), **report}, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+The itinerary card as a PNG, drawn with Pillow from docgen.itinerary_data.
+
+Same layout as the card the page used to build with html2canvas: a header
+band with the QR code, passengers on the left, flights (with outbound,
+layover and return banners) and the baggage allowance on the right. Sizes
+below are in CSS pixels of that 800 px wide card; BILLETE_CARD_SCALE sets
+the output pixels per CSS pixel.
+
+Pillow needs a font file with CJK glyphs. BILLETE_CARD_FONT (and optionally
+BILLETE_CARD_FONT_BOLD) name one; otherwise the usual Windows, macOS and
+Linux locations are tried. Fonts and the header band are loaded once per
+process, see preload().
+"""
+import io
+import os
+import datetime
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+import applog
+
+log = applog.get_logger("card_image")
+
+SCALE = float(os.getenv("BILLETE_CARD_SCALE", "2"))
+FONT = os.getenv("BILLETE_CARD_FONT", "")
+FONT_BOLD = os.getenv("BILLETE_CARD_FONT_BOLD", "")
+QR_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "qrcode.jpg")
+
+FONT_CANDIDATES = (
+    "C:/Windows/Fonts/msyh.ttc",
+    "C:/Windows/Fonts/simhei.ttf",
+    "C:/Windows/Fonts/simsun.ttc",
+    "/System/Library/Fonts/PingFang.ttc",
+    "/System/Library/Fonts/STHeiti Medium.ttc",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/wenquanyi/wqy-microhei/wqy-microhei.ttc",
+)
+BOLD_CANDIDATES = (
+    "C:/Windows/Fonts/msyhbd.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Bold.ttc",
+)
+
+# Layout (CSS px)
+WIDTH = 800
+HEADER_HEIGHT = 108
+PAD = 20
+CARD_PAD = 20
+GAP = 15
+LEFT_WIDTH = round((WIDTH - 2 * PAD) * 0.35)
+RIGHT_WIDTH = WIDTH - 2 * PAD - LEFT_WIDTH - GAP
+FOOTER_HEIGHT = 46
+RADIUS = 12
+
+BG = "#F3F4F6"
+WHITE = "#FFFFFF"
+INK = "#111827"
+TEXT = "#374151"
+MUTED = "#6B7280"
+FAINT = "#9CA3AF"
+RULE = "#E5E7EB"
+ACCENT = "#4F46E5"
+BANNER = "#EEF2FF"
+PILL = "#F3F4F6"
+RED = "#DC2626"
+GRADIENT = ((0x63, 0x66, 0xF1), (0xA8, 0x55, 0xF7))
+
+
+def _find_font(configured, candidates):
+    if configured:
+        return configured
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+@lru_cache(maxsize=None)
+def font_paths():
+    """(regular, bold) font files; bold falls back to regular."""
+    regular = _find_font(FONT, FONT_CANDIDATES)
+    if regular is None:
+        log.warning("No CJK font found for itinerary cards; set BILLETE_CARD_FONT. "
+                    "Chinese text will not render.")
+    bold = _find_font(FONT_BOLD, BOLD_CANDIDATES if regular and not FONT else ()) or regular
+    return regular, bold
+
+
+@lru_cache(maxsize=None)
+def _font(size, bold=False):
+    regular, heavy = font_paths()
+    path = heavy if bold else regular
+    if path is None:
+        return ImageFont.load_default(size * SCALE)
+    return ImageFont.truetype(path, round(size * SCALE))
+
+
+class _Canvas:
+    """ImageDraw in CSS px."""
+
+    def __init__(self, image):
+        self.image = image
+        self.draw = ImageDraw.Draw(image)
+
+    def text(self, x, y, text, size, fill=TEXT, bold=False, anchor="la"):
+        self.draw.text((x * SCALE, y * SCALE), text, font=_font(size, bold), fill=fill, anchor=anchor)
+
+    def rect(self, x, y, w, h, fill, radius=RADIUS):
+        self.draw.rounded_rectangle((x * SCALE, y * SCALE, (x + w) * SCALE, (y + h) * SCALE),
+                                    radius=radius * SCALE, fill=fill)
+
+    def line(self, x1, y, x2, fill=RULE, dash=None):
+        if dash is None:
+            self.draw.line((x1 * SCALE, y * SCALE, x2 * SCALE, y * SCALE), fill=fill, width=max(1, round(SCALE)))
+            return
+        x = x1
+        while x < x2:
+            self.line(x, y, min(x + dash, x2), fill)
+            x += 2 * dash
+
+
+def _width(text, size, bold=False):
+    return _font(size, bold).getlength(text) / SCALE
+
+
+def _fit(text, size, max_width, bold=False):
+    """text, shortened with an ellipsis to fit max_width."""
+    if _width(text, size, bold) <= max_width:
+        return text
+    while text and _width(text + "…", size, bold) > max_width:
+        text = text[:-1]
+    return text + "…"
+
+
+@lru_cache(maxsize=None)
+def _header():
+    """The header band without the date: gradient, titles and QR code."""
+    w, h = round(WIDTH * SCALE), round(HEADER_HEIGHT * SCALE)
+    (r1, g1, b1), (r2, g2, b2) = GRADIENT
+    ramp = Image.linear_gradient("L").rotate(90).resize((w, h))
+    # The ramp runs dark to light left to right, so the mask picks the start colour on the left
+    band = Image.composite(Image.new("RGB", (w, h), (r2, g2, b2)), Image.new("RGB", (w, h), (r1, g1, b1)), ramp)
+    canvas = _Canvas(band)
+    canvas.text(32, 24, "行程确认单", 24, fill=WHITE, bold=True)
+    canvas.text(32, 60, "Flight Itinerary", 14, fill="#E0E7FF")
+    try:
+        qr = Image.open(QR_IMAGE).convert("RGB")
+        qr.thumbnail((round(60 * SCALE), round(60 * SCALE)))
+        band.paste(qr, (round((WIDTH - 32 - 60) * SCALE), round(20 * SCALE)))
+        canvas.text(WIDTH - 32 - 30, 84, "Weixin", 8, fill=WHITE, anchor="ma")
+    except OSError as e:
+        log.warning(f"Card QR image not loaded: {e}")
+    canvas.text(WIDTH - 32 - 60 - 15, 24, "LuLu", 18, fill=WHITE, bold=True, anchor="ra")
+    return band
+
+
+def preload():
+    """Loads the fonts and draws the header band, so the first card is as fast as the rest."""
+    for size, bold in ((8, False), (10, False), (12, False), (12, True), (13, False), (14, False),
+                       (14, True), (18, True), (24, True)):
+        _font(size, bold)
+    _header()
+
+
+# --- Layout ---
+
+PAX_ROW = 28
+BANNER_HEIGHT = 40
+LAYOVER_HEIGHT = 34
+FLIGHT_HEIGHT = 160
+LUGGAGE_HEIGHT = 132
+
+
+def _pax_height(data):
+    return CARD_PAD * 2 + 30 + PAX_ROW * max(1, len(data['passengers']))
+
+
+def _flight_blocks(data):
+    """(kind, payload) rows of the right column, in order."""
+    layovers = {l.get('flight_index'): l for l in data['layovers']}
+    blocks = []
+    for index, flight in enumerate(data['flights']):
+        layover = layovers.get(index)
+        if layover and layover.get('type') == 'return_split':
+            blocks.append(('banner', "回程 Return Trip"))
+        elif layover and layover.get('type', 'layover') == 'layover':
+            blocks.append(('layover', f"停留 {layover['place']}: {layover['hours']}h {layover['minutes']}m"))
+        elif index == 0:
+            blocks.append(('banner', "启程 Outbound"))
+        blocks.append(('flight', flight))
+    return blocks
+
+
+_BLOCK_HEIGHT = {'banner': BANNER_HEIGHT + 20, 'layover': LAYOVER_HEIGHT, 'flight': FLIGHT_HEIGHT + 15}
+
+
+def _draw_pax(canvas, data, x, y):
+    canvas.rect(x, y, LEFT_WIDTH, _pax_height(data), WHITE)
+    canvas.text(x + CARD_PAD, y + CARD_PAD, "乘客信息 / Passenger Details", 14, fill=TEXT, bold=True)
+    row_y = y + CARD_PAD + 30
+    inner = LEFT_WIDTH - 2 * CARD_PAD
+    for i, p in enumerate(data['passengers'], 1):
+        canvas.text(x + CARD_PAD, row_y + 6, _fit(f"乘客 {i}: {p['name']}", 13, inner), 13, fill="#4B5563")
+        canvas.line(x + CARD_PAD, row_y + PAX_ROW - 1, x + LEFT_WIDTH - CARD_PAD, dash=3)
+        row_y += PAX_ROW
+
+
+def _draw_flight(canvas, f, x, y):
+    w = RIGHT_WIDTH
+    canvas.rect(x, y, w, FLIGHT_HEIGHT, WHITE)
+    left, right = x + CARD_PAD, x + w - CARD_PAD
+    date = f"{f['year']}年{f['month']}月{f['day']}日 / {f['month']}-{f['day']}" if f['year'] \
+        else f"{f['month']}-{f['day']}"
+    canvas.text(left, y + CARD_PAD, date, 14, fill=INK, bold=True)
+    pill = _width(f['id'], 14, True) + 16
+    canvas.rect(right - pill, y + CARD_PAD - 3, pill, 24, PILL, radius=4)
+    canvas.text(right - 8, y + CARD_PAD, f['id'], 14, fill=INK, bold=True, anchor="ra")
+
+    half = (w - 2 * CARD_PAD) / 2 - 40
+    route_y = y + CARD_PAD + 36
+    canvas.text(left, route_y, _fit(f['origin'], 18, half, True), 18, fill=INK, bold=True)
+    canvas.text(left, route_y + 28, f['start'], 14, fill=INK, bold=True)
+    canvas.text(left, route_y + 48, f"{f['month']}-{f['day']}", 10, fill=MUTED)
+
+    canvas.text(right, route_y, _fit(f['dest'], 18, half, True), 18, fill=INK, bold=True, anchor="ra")
+    end = f['end'].replace("+1", "")
+    if f.get('next_day'):
+        canvas.text(right, route_y + 28, "+1", 10, fill=RED, anchor="ra")
+        canvas.text(right - _width("+1", 10) - 2, route_y + 28, end, 14, fill=INK, bold=True, anchor="ra")
+    else:
+        canvas.text(right, route_y + 28, end, 14, fill=INK, bold=True, anchor="ra")
+    canvas.text(right, route_y + 48, f['arrival_date'], 10, fill=MUTED, anchor="ra")
+
+    mid_left, mid_right = left + half + 20, right - half - 20
+    canvas.line(mid_left, route_y + 14, mid_right)
+    canvas.text((mid_left + mid_right) / 2, route_y + 20, "→", 18, fill=ACCENT, anchor="ma")
+    details = "Class: Economy | Non-Stop" + (f" | {f['duration']}" if f['duration'] else "")
+    canvas.text(left, y + FLIGHT_HEIGHT - CARD_PAD - 14, details, 12, fill=MUTED)
+
+
+def _draw_banner(canvas, text, x, y):
+    canvas.rect(x, y, RIGHT_WIDTH, BANNER_HEIGHT, BANNER, radius=8)
+    canvas.text(x + 10, y + BANNER_HEIGHT / 2, text, 14, fill=ACCENT, bold=True, anchor="lm")
+
+
+def _draw_luggage(canvas, lug, x, y):
+    canvas.rect(x, y, RIGHT_WIDTH, LUGGAGE_HEIGHT, WHITE)
+    left, right = x + CARD_PAD, x + RIGHT_WIDTH - CARD_PAD
+    canvas.rect(left, y + CARD_PAD, RIGHT_WIDTH - 2 * CARD_PAD, BANNER_HEIGHT, BANNER, radius=8)
+    canvas.text(left + 10, y + CARD_PAD + BANNER_HEIGHT / 2, "行李额度 Baggage Allowance", 14,
+                fill=ACCENT, bold=True, anchor="lm")
+    row_y = y + CARD_PAD + BANNER_HEIGHT + 15
+    canvas.text(left, row_y, "经济舱往返", 14, fill=INK, bold=True)
+    canvas.text(left, row_y + 22, "Economy Round Trip", 12, fill=MUTED)
+    for i, (label, count, weight) in enumerate((("手提 Carry-on", lug['hand_count'], lug['hand_weight']),
+                                                ("托运 Checked", lug['pack_count'], lug['pack_weight']))):
+        col = right - i * 110
+        canvas.text(col, row_y, label, 12, fill=MUTED, anchor="ra")
+        canvas.text(col, row_y + 20, f"{count} x {weight}kg", 12, fill=INK, bold=True, anchor="ra")
+
+
+def render_png(data):
+    """PNG bytes of the card for itinerary data (plus an optional 'date' label)."""
+    blocks = _flight_blocks(data)
+    right_height = sum(_BLOCK_HEIGHT[kind] for kind, _ in blocks) + LUGGAGE_HEIGHT
+    body_height = max(_pax_height(data), right_height) + 2 * PAD
+    height = HEADER_HEIGHT + body_height + FOOTER_HEIGHT
+
+    image = Image.new("RGB", (round(WIDTH * SCALE), round(height * SCALE)), BG)
+    image.paste(_header(), (0, 0))
+    canvas = _Canvas(image)
+    date = data.get('date') or datetime.date.today().isoformat()
+    canvas.text(WIDTH - 32 - 60 - 15, 52, date, 13, fill="#E0E7FF", anchor="ra")
+
+    top = HEADER_HEIGHT + PAD
+    _draw_pax(canvas, data, PAD, top)
+    x, y = PAD + LEFT_WIDTH + GAP, top
+    for kind, payload in blocks:
+        if kind == 'flight':
+            _draw_flight(canvas, payload, x, y)
+        elif kind == 'banner':
+            _draw_banner(canvas, payload, x, y)
+        else:
+            canvas.text(x + 20, y + 8, payload, 13, fill=MUTED)
+        y += _BLOCK_HEIGHT[kind]
+    _draw_luggage(canvas, data['luggage'], x, y)
+
+    footer_y = HEADER_HEIGHT + body_height
+    canvas.line(0, footer_y, WIDTH, dash=4)
+    canvas.text(WIDTH / 2, footer_y + FOOTER_HEIGHT / 2, "祝您旅途愉快 Have a pleasant journey!  |  Generated by Billete",
+                12, fill=FAINT, anchor="mm")
+
+    # Rounded corners, transparent outside
+    mask = Image.new("L", image.size, 0)
+    ImageDraw.Draw(mask).rounded_rectangle((0, 0, image.size[0] - 1, image.size[1] - 1),
+                                           radius=RADIUS * SCALE, fill=255)
+    image.putalpha(mask)
+
+    out = io.BytesIO()
+    image.save(out, "PNG", optimize=False, compress_level=6)
+    return out.getvalue()
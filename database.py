@@ -1,15 +1,139 @@
 import os
+import time
 import datetime
-from sqlalchemy import create_engine, text, MetaData, Table, Column, String, Integer
+import threading
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, text, select, MetaData, Table, Column, Index, String, Integer, Float
 from sqlalchemy.pool import NullPool
+import metrics
+import applog
+
+log = applog.get_logger("database")
 
 # Detect environment: Render uses DATABASE_URL
 # Handle "postgres://" fix for SQLAlchemy 1.4+
-db_url = os.getenv("DATABASE_URL", "sqlite:///billete.db")
-if db_url.startswith("postgres://"):
-    db_url = db_url.replace("postgres://", "postgresql://", 1)
+def _normalize_url(url):
+    if url and url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    return url
+
+db_url = _normalize_url(os.getenv("DATABASE_URL", "sqlite:///billete.db"))
+# Optional read replica; reads use the main database when unset
+read_db_url = _normalize_url(os.getenv("DATABASE_READ_URL")) or db_url
+
+# Pool settings (ignored for SQLite in-memory databases, which use one connection per thread)
+#   BILLETE_DB_POOL=null        open a new connection per use (e.g. behind pgbouncer)
+#   BILLETE_DB_POOL_SIZE        connections kept open per process
+#   BILLETE_DB_MAX_OVERFLOW     extra connections allowed under load
+#   BILLETE_DB_POOL_RECYCLE     seconds before a connection is replaced
+#   BILLETE_DB_PRE_PING         1/0, test connections before use (default on for servers)
+# SQLite tuning, applied to every new connection:
+#   BILLETE_SQLITE_WAL          1/0, write-ahead logging so readers don't block the writer
+#   BILLETE_SQLITE_SYNCHRONOUS  PRAGMA synchronous value (default NORMAL)
+#   BILLETE_SQLITE_BUSY_TIMEOUT_MS  how long a writer waits for the lock (default 5000)
+def _env_flag(name, default):
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def _is_sqlite(url):
+    return url.startswith("sqlite")
+
+def _is_sqlite_memory(url):
+    return url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url
+
+def _engine_options(url):
+    options = {}
+    if _is_sqlite(url):
+        busy_ms = int(os.getenv("BILLETE_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+        options["connect_args"] = {"timeout": busy_ms / 1000, "check_same_thread": False}
+        if _is_sqlite_memory(url):
+            return options
+
+    if os.getenv("BILLETE_DB_POOL", "").lower() == "null":
+        options["poolclass"] = NullPool
+    else:
+        if os.getenv("BILLETE_DB_POOL_SIZE"):
+            options["pool_size"] = int(os.getenv("BILLETE_DB_POOL_SIZE"))
+        if os.getenv("BILLETE_DB_MAX_OVERFLOW"):
+            options["max_overflow"] = int(os.getenv("BILLETE_DB_MAX_OVERFLOW"))
+    if os.getenv("BILLETE_DB_POOL_RECYCLE"):
+        options["pool_recycle"] = int(os.getenv("BILLETE_DB_POOL_RECYCLE"))
+    options["pool_pre_ping"] = _env_flag("BILLETE_DB_PRE_PING", not _is_sqlite(url))
+    return options
+
+def _tune_sqlite(sqlite_engine, begin_sql):
+    """
+    Sets PRAGMAs on each new SQLite connection and takes over transaction
+    start from the driver, so the write role can use BEGIN IMMEDIATE (grab
+    the write lock up front and honour busy_timeout, instead of failing on
+    a read-to-write lock upgrade).
+    """
+    wal = _env_flag("BILLETE_SQLITE_WAL", True) and not _is_sqlite_memory(str(sqlite_engine.url))
+    synchronous = os.getenv("BILLETE_SQLITE_SYNCHRONOUS", "NORMAL")
+    busy_ms = int(os.getenv("BILLETE_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+    @event.listens_for(sqlite_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        if wal:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={busy_ms}")
+        cursor.close()
+
+    @event.listens_for(sqlite_engine, "begin")
+    def _on_begin(conn):
+        conn.exec_driver_sql(begin_sql)
+
+def _time_queries(new_engine):
+    @event.listens_for(new_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(new_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("query_started", None)
+        if started is not None:
+            metrics.record_query(time.perf_counter() - started)
+
+def _make_engine(url, begin_sql):
+    new_engine = create_engine(url, **_engine_options(url))
+    if _is_sqlite(url):
+        _tune_sqlite(new_engine, begin_sql)
+    _time_queries(new_engine)
+    return new_engine
+
+# Write role: every INSERT/UPDATE/DELETE goes through write_transaction()
+engine = _make_engine(db_url, "BEGIN IMMEDIATE")
+# Read role: plain deferred transactions; in WAL mode they never block the writer
+if read_db_url == db_url and not _is_sqlite(db_url):
+    read_engine = engine
+elif _is_sqlite_memory(db_url):
+    # A second engine would see a different in-memory database
+    read_engine = engine
+else:
+    read_engine = _make_engine(read_db_url, "BEGIN")
+
+@contextmanager
+def read_connection():
+    with read_engine.connect() as conn:
+        yield conn
+
+@contextmanager
+def write_transaction():
+    """Connection inside a transaction that commits on success and rolls back on error."""
+    with engine.begin() as conn:
+        yield conn
+
+def dispose_engines():
+    """Drops pooled connections, e.g. in a freshly forked worker."""
+    engine.dispose(close=False)
+    if read_engine is not engine:
+        read_engine.dispose(close=False)
 
-engine = create_engine(db_url)
 metadata = MetaData()
 
 # Define tables using SQLAlchemy Core for cross-db compatibility
@@ -18,6 +142,28 @@ airports_table = Table('airports', metadata,
     Column('name', String, nullable=False)
 )
 
+# Monotonic change counters, e.g. name='airports' is bumped by every airport write
+# so workers can tell their in-memory copy is stale with one primary-key read
+map_versions_table = Table('map_versions', metadata,
+    Column('name', String, primary_key=True),
+    Column('version', Integer, nullable=False)
+)
+
+# One row per airport write, tagged with the map version it produced; name is
+# NULL for a delete. Lets clients fetch only what changed since their version.
+airport_changes_table = Table('airport_changes', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('version', Integer, nullable=False, index=True),
+    Column('code', String, nullable=False),
+    Column('name', String)
+)
+
+# Codes that no source could resolve, so workers skip the slow online lookup
+airport_misses_table = Table('airport_misses', metadata,
+    Column('code', String, primary_key=True),
+    Column('checked_at', Float, nullable=False)
+)
+
 history_table = Table('history', metadata,
     Column('id', Integer, primary_key=True),
     Column('timestamp', String),
@@ -27,24 +173,67 @@ history_table = Table('history', metadata,
     Column('route_info', String)
 )
 
+# Covers the history list projection, so paging newest-first never touches
+# the large code/result columns (SQLite stores them before passenger_info)
+history_list_index = Index(
+    'ix_history_list',
+    history_table.c.id, history_table.c.timestamp,
+    history_table.c.passenger_info, history_table.c.route_info
+)
+
+# Rows per calendar day ("YYYY-MM-DD"), kept in step with history by the
+# insert/clear helpers so /stats never has to scan history
+daily_counts_table = Table('daily_counts', metadata,
+    Column('day', String, primary_key=True),
+    Column('count', Integer, nullable=False)
+)
+
+# Serialized /process results keyed by parse_cache.make_key (optional tier)
+parse_cache_table = Table('parse_cache', metadata,
+    Column('key', String, primary_key=True),
+    Column('value', String, nullable=False),
+    Column('created_at', Float, nullable=False)
+)
+
 def init_db():
+    """Creates missing tables and indexes. Entry points call this once at startup."""
     metadata.create_all(engine)
+    # create_all skips indexes on tables that already exist
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    backfill_daily_counts()
+
+def backfill_daily_counts():
+    """Fills daily_counts from history once, for databases that predate the table."""
+    try:
+        with write_transaction() as conn:
+            if conn.execute(text("SELECT 1 FROM daily_counts LIMIT 1")).first() is not None:
+                return
+            conn.execute(text('''
+                INSERT INTO daily_counts (day, count)
+                SELECT substr(timestamp, 1, 10), COUNT(*) FROM history
+                WHERE timestamp IS NOT NULL
+                GROUP BY substr(timestamp, 1, 10)
+                ON CONFLICT(day) DO NOTHING
+            '''))
+    except Exception as e:
+        log.error(f"Daily count backfill failed: {e}")
 
 def create_user(username, password_hash):
     try:
-        with engine.connect() as conn:
+        with write_transaction() as conn:
             conn.execute(
                 text("INSERT INTO users (username, password_hash) VALUES (:username, :password_hash)"),
                 {"username": username, "password_hash": password_hash}
             )
-            conn.commit()
             return True
     except Exception as e:
-        print(f"Create User Error: {e}")
+        log.error(f"Create User Error: {e}")
         return False
 
 def get_user_by_username(username):
-    with engine.connect() as conn:
+    with read_connection() as conn:
         result = conn.execute(
             text("SELECT * FROM users WHERE username = :username"),
             {"username": username}
@@ -54,7 +243,7 @@ def get_user_by_username(username):
         return None
 
 def get_user_by_id(user_id):
-    with engine.connect() as conn:
+    with read_connection() as conn:
         result = conn.execute(
             text("SELECT * FROM users WHERE id = :user_id"),
             {"user_id": user_id}
@@ -63,11 +252,102 @@ def get_user_by_id(user_id):
             return {"id": result.id, "username": result.username, "password_hash": result.password_hash}
         return None
 
+def _bump_version(conn, name):
+    """Increments a map version inside the caller's write transaction and returns it."""
+    conn.execute(
+        text('''
+            INSERT INTO map_versions (name, version) VALUES (:name, 1)
+            ON CONFLICT(name) DO UPDATE SET version = map_versions.version + 1
+        '''),
+        {"name": name}
+    )
+    return _read_version(conn, name)
+
+# Versions kept in airport_changes; a client further behind gets the full map
+AIRPORT_CHANGES_KEEP = int(os.getenv("BILLETE_AIRPORT_CHANGES_KEEP", "1000"))
+
+def _log_airport_changes(conn, changes):
+    """
+    Bumps the airport version and records changes ({code: name or None}) under
+    it. Changes older than the last AIRPORT_CHANGES_KEEP versions are dropped.
+    """
+    version = _bump_version(conn, "airports")
+    conn.execute(
+        text("INSERT INTO airport_changes (version, code, name) VALUES (:version, :code, :name)"),
+        [{"version": version, "code": code, "name": name} for code, name in changes.items()]
+    )
+    conn.execute(
+        text("DELETE FROM airport_changes WHERE version <= :cutoff"),
+        {"cutoff": version - AIRPORT_CHANGES_KEEP}
+    )
+    return version
+
+def _read_version(conn, name):
+    return conn.execute(
+        text("SELECT version FROM map_versions WHERE name = :name"),
+        {"name": name}
+    ).scalar() or 0
+
+def get_airport_version():
+    with read_connection() as conn:
+        return _read_version(conn, "airports")
+
 def get_all_airports():
-    with engine.connect() as conn:
+    with read_connection() as conn:
         result = conn.execute(text("SELECT code, name FROM airports"))
         return {row.code: row.name for row in result}
 
+def get_airport_snapshot():
+    """
+    Returns (version, {code: name}). The version is read first, so if a write
+    lands in between the map is newer than the version, never older.
+    """
+    with read_connection() as conn:
+        version = _read_version(conn, "airports")
+        result = conn.execute(text("SELECT code, name FROM airports"))
+        return version, {row.code: row.name for row in result}
+
+def get_airport_changes(since):
+    """
+    What changed in the airport map after version `since`:
+    {'version', 'full', 'upserts': {code: name}, 'deletes': [codes]}.
+    Returns the whole map with full=True when the log can't cover the gap
+    (since is 0, ahead of the database, or older than the oldest logged change).
+    """
+    with read_connection() as conn:
+        return _airport_changes(conn, since)
+
+def _airport_changes(conn, since):
+    version = _read_version(conn, "airports")
+    oldest = conn.execute(text("SELECT MIN(version) FROM airport_changes")).scalar()
+    if since <= 0 or since > version or oldest is None or since < oldest - 1:
+        result = conn.execute(text("SELECT code, name FROM airports"))
+        return {
+            "version": version,
+            "full": True,
+            "upserts": {row.code: row.name for row in result},
+            "deletes": []
+        }
+
+    # Later rows win, so a code upserted then deleted ends up deleted
+    latest = {}
+    result = conn.execute(
+        text('''
+            SELECT code, name FROM airport_changes
+            WHERE version > :since AND version <= :version
+            ORDER BY id
+        '''),
+        {"since": since, "version": version}
+    )
+    for row in result:
+        latest[row.code] = row.name
+    return {
+        "version": version,
+        "full": False,
+        "upserts": {code: name for code, name in latest.items() if name is not None},
+        "deletes": [code for code, name in latest.items() if name is None]
+    }
+
 def upsert_airport(code, name):
     # Compatible UPSERT syntax for SQLite and PostgreSQL
     # Both support ON CONFLICT(code) DO UPDATE SET name=excluded.name
@@ -80,44 +360,215 @@ def upsert_airport(code, name):
         INSERT INTO airports (code, name) VALUES (:code, :name)
         ON CONFLICT(code) DO UPDATE SET name=excluded.name
     ''')
-    with engine.connect() as conn:
+    with write_transaction() as conn:
         conn.execute(sql, {"code": code.upper(), "name": name})
-        conn.commit()
+        _log_airport_changes(conn, {code.upper(): name})
+
+def backfill_airport(code, name):
+    """
+    Stores a name taken from the offline index unless the code already has
+    one. Only the insert is logged as a change, so the version moves once
+    per new code rather than on every offline hit. Returns True if inserted.
+    """
+    sql = text('''
+        INSERT INTO airports (code, name) VALUES (:code, :name)
+        ON CONFLICT(code) DO NOTHING
+    ''')
+    with write_transaction() as conn:
+        inserted = conn.execute(sql, {"code": code.upper(), "name": name}).rowcount > 0
+        if inserted:
+            _log_airport_changes(conn, {code.upper(): name})
+    return inserted
+
+def bulk_upsert_airports(entries, chunk_size=500):
+    """
+    Upserts many airports in one transaction.
+    entries: dict of code -> name (codes already upper-cased).
+    Rows are compared against the table chunk by chunk, and only new or
+    changed names are written (executemany per chunk).
+    Returns {'inserted': {code: name}, 'updated': {code: name}, 'unchanged': [codes]}.
+    """
+    diff = {"inserted": {}, "updated": {}, "unchanged": []}
+    items = list(entries.items())
+    sql = text('''
+        INSERT INTO airports (code, name) VALUES (:code, :name)
+        ON CONFLICT(code) DO UPDATE SET name=excluded.name
+    ''')
+    with write_transaction() as conn:
+        for i in range(0, len(items), chunk_size):
+            chunk = items[i:i + chunk_size]
+            existing = {
+                row.code: row.name
+                for row in conn.execute(
+                    select(airports_table.c.code, airports_table.c.name)
+                    .where(airports_table.c.code.in_([code for code, _ in chunk]))
+                )
+            }
+            changed = []
+            for code, name in chunk:
+                old = existing.get(code)
+                if old is None:
+                    diff["inserted"][code] = name
+                elif old != name:
+                    diff["updated"][code] = name
+                else:
+                    diff["unchanged"].append(code)
+                    continue
+                changed.append({"code": code, "name": name})
+            if changed:
+                conn.execute(sql, changed)
+        if diff["inserted"] or diff["updated"]:
+            _log_airport_changes(conn, {**diff["inserted"], **diff["updated"]})
+    return diff
 
 def delete_airport(code):
     try:
-        with engine.connect() as conn:
+        with write_transaction() as conn:
             result = conn.execute(text("DELETE FROM airports WHERE code = :code"), {"code": code.upper()})
-            conn.commit()
-            return result.rowcount > 0
+            if result.rowcount > 0:
+                _log_airport_changes(conn, {code.upper(): None})
+                return True
+            return False
     except Exception as e:
-        print(f"Delete Error: {e}")
+        log.error(f"Delete Error: {e}")
         return False
 
-def get_history_entries(limit=100):
-    with engine.connect() as conn:
-        # Use text() for query, but result columns are accessible by name
-        result = conn.execute(
-            text("SELECT * FROM history ORDER BY id DESC LIMIT :limit"),
-            {"limit": limit}
-        )
-        history = []
-        for row in result:
-            # SQLAlchemy rows behave like named tuples
-            history.append({
-                "timestamp": row.timestamp,
-                "code": row.code,
-                "result": row.result,
-                "passenger_info": row.passenger_info,
-                "route_info": row.route_info
-            })
-        return history
+def get_airport_miss(code):
+    """Returns when code was last looked up without success (epoch seconds), or None."""
+    with read_connection() as conn:
+        return conn.execute(
+            text("SELECT checked_at FROM airport_misses WHERE code = :code"),
+            {"code": code.upper()}
+        ).scalar()
+
+def record_airport_miss(code, checked_at):
+    sql = text('''
+        INSERT INTO airport_misses (code, checked_at) VALUES (:code, :checked_at)
+        ON CONFLICT(code) DO UPDATE SET checked_at=excluded.checked_at
+    ''')
+    with write_transaction() as conn:
+        conn.execute(sql, {"code": code.upper(), "checked_at": checked_at})
+
+def delete_airport_miss(code):
+    with write_transaction() as conn:
+        conn.execute(text("DELETE FROM airport_misses WHERE code = :code"), {"code": code.upper()})
+
+def delete_airport_misses(codes):
+    if not codes:
+        return
+    with write_transaction() as conn:
+        conn.execute(airport_misses_table.delete().where(airport_misses_table.c.code.in_(list(codes))))
+
+def get_parse_cache_entry(key):
+    with read_connection() as conn:
+        return conn.execute(
+            text("SELECT value FROM parse_cache WHERE key = :key"),
+            {"key": key}
+        ).scalar()
+
+def put_parse_cache_entry(key, value, created_at):
+    # Keys are content hashes, so an existing row already holds the same value
+    sql = text('''
+        INSERT INTO parse_cache (key, value, created_at) VALUES (:key, :value, :created_at)
+        ON CONFLICT(key) DO NOTHING
+    ''')
+    with write_transaction() as conn:
+        conn.execute(sql, {"key": key, "value": value, "created_at": created_at})
+
+def prune_parse_cache(older_than):
+    with write_transaction() as conn:
+        conn.execute(text("DELETE FROM parse_cache WHERE created_at < :older_than"), {"older_than": older_than})
+
+def clear_parse_cache():
+    with write_transaction() as conn:
+        conn.execute(text("DELETE FROM parse_cache"))
+
+def get_history_entries(limit=100, before_id=None):
+    """
+    Newest-first page of history rows for the list view: id, timestamp,
+    passenger_info and route_info only. Pass the last id of a page as
+    before_id to get the next one.
+    """
+    with read_connection() as conn:
+        return _history_entries(conn, limit, before_id)
+
+def _history_entries(conn, limit, before_id):
+    sql = "SELECT id, timestamp, passenger_info, route_info FROM history"
+    params = {"limit": limit}
+    if before_id is not None:
+        sql += " WHERE id < :before_id"
+        params["before_id"] = before_id
+    sql += " ORDER BY id DESC LIMIT :limit"
+
+    result = conn.execute(text(sql), params)
+    return [
+        {
+            "id": row.id,
+            "timestamp": row.timestamp,
+            "passenger_info": row.passenger_info,
+            "route_info": row.route_info
+        }
+        for row in result
+    ]
+
+def get_history_codes(first_id, last_id, limit=100):
+    """(id, code, timestamp) of history rows with first_id <= id <= last_id, newest first."""
+    with read_connection() as conn:
+        return _history_codes(conn, first_id, last_id, limit)
+
+def _history_codes(conn, first_id, last_id, limit):
+    result = conn.execute(
+        text('''
+            SELECT id, code, timestamp FROM history
+            WHERE id >= :first_id AND id <= :last_id
+            ORDER BY id DESC LIMIT :limit
+        '''),
+        {"first_id": first_id, "last_id": last_id, "limit": limit}
+    )
+    return [(row.id, row.code, row.timestamp) for row in result]
+
+def get_history_entry(entry_id):
+    """Full history row including the raw code and result, or None."""
+    with read_connection() as conn:
+        return _history_entry(conn, entry_id)
+
+def _history_entry(conn, entry_id):
+    row = conn.execute(
+        text("SELECT * FROM history WHERE id = :id"),
+        {"id": entry_id}
+    ).fetchone()
+    if row is None:
+        return None
+    return {
+        "id": row.id,
+        "timestamp": row.timestamp,
+        "code": row.code,
+        "result": row.result,
+        "passenger_info": row.passenger_info,
+        "route_info": row.route_info
+    }
+
+def _bump_daily_counts(conn, timestamps):
+    per_day = {}
+    for ts in timestamps:
+        if ts:
+            per_day[ts[:10]] = per_day.get(ts[:10], 0) + 1
+    if not per_day:
+        return
+    conn.execute(
+        text('''
+            INSERT INTO daily_counts (day, count) VALUES (:day, :count)
+            ON CONFLICT(day) DO UPDATE SET count = daily_counts.count + excluded.count
+        '''),
+        [{"day": day, "count": n} for day, n in per_day.items()]
+    )
 
 def add_history_entry(code, result, passenger_info, route_info, timestamp=None):
     if not timestamp:
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-    with engine.connect() as conn:
+    with write_transaction() as conn:
+        _bump_daily_counts(conn, [timestamp])
         conn.execute(
             text('''
                 INSERT INTO history (timestamp, code, result, passenger_info, route_info)
@@ -131,22 +582,86 @@ def add_history_entry(code, result, passenger_info, route_info, timestamp=None):
                 "route_info": route_info
             }
         )
-        conn.commit()
+    _invalidate_today_count()
+
+def add_history_entries(entries):
+    """
+    Inserts many history rows in a single transaction.
+    entries: iterable of dicts with code, result, passenger_info, route_info
+    and an optional timestamp.
+    """
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = [
+        {
+            "timestamp": e.get("timestamp") or now,
+            "code": e.get("code"),
+            "result": e.get("result"),
+            "passenger_info": e.get("passenger_info"),
+            "route_info": e.get("route_info")
+        }
+        for e in entries
+    ]
+    if not rows:
+        return 0
+
+    with write_transaction() as conn:
+        conn.execute(
+            text('''
+                INSERT INTO history (timestamp, code, result, passenger_info, route_info)
+                VALUES (:timestamp, :code, :result, :passenger_info, :route_info)
+            '''),
+            rows
+        )
+        _bump_daily_counts(conn, [row["timestamp"] for row in rows])
+    _invalidate_today_count()
+    return len(rows)
 
 def clear_history_entries():
-    with engine.connect() as conn:
+    with write_transaction() as conn:
         conn.execute(text("DELETE FROM history"))
-        conn.commit()
+        conn.execute(text("DELETE FROM daily_counts"))
+        _bump_version(conn, "history")
+    _invalidate_today_count()
     return True
 
-def get_today_count():
-    today_prefix = datetime.datetime.now().strftime("%Y-%m-%d") + "%"
-    with engine.connect() as conn:
-        result = conn.execute(
-            text("SELECT COUNT(*) FROM history WHERE timestamp LIKE :prefix"),
-            {"prefix": today_prefix}
-        ).scalar()
-        return result
+def get_history_version():
+    """Moves on every clear_history_entries, in any worker."""
+    with read_connection() as conn:
+        return _read_version(conn, "history")
 
-# Initialize on import
-init_db()
+# Today's count is cached per process. Local inserts drop it right away;
+# the TTL bounds how stale it gets when other workers insert.
+TODAY_COUNT_TTL = float(os.getenv("BILLETE_TODAY_COUNT_TTL", "5"))
+_today_count_lock = threading.Lock()
+_today_count = {"day": None, "count": 0, "at": 0.0}
+
+def _invalidate_today_count():
+    with _today_count_lock:
+        _today_count["day"] = None
+
+def _cached_today_count():
+    """Returns (day, count or None when the cached value is stale or for another day)."""
+    today = datetime.datetime.now().strftime("%Y-%m-%d")
+    with _today_count_lock:
+        if _today_count["day"] == today and time.monotonic() - _today_count["at"] < TODAY_COUNT_TTL:
+            return today, _today_count["count"]
+    return today, None
+
+def _store_today_count(day, count):
+    with _today_count_lock:
+        _today_count.update(day=day, count=count, at=time.monotonic())
+
+def _daily_count(conn, day):
+    return conn.execute(
+        text("SELECT count FROM daily_counts WHERE day = :day"),
+        {"day": day}
+    ).scalar() or 0
+
+def get_today_count():
+    today, count = _cached_today_count()
+    if count is not None:
+        return count
+    with read_connection() as conn:
+        count = _daily_count(conn, today)
+    _store_today_count(today, count)
+    return count
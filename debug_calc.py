@@ -1,7 +1,7 @@
 
 import airportsdata
-import pytz
 import datetime
+from zoneinfo import ZoneInfo
 
 def test_calc():
     try:
@@ -26,8 +26,8 @@ def test_calc():
         else:
             print("PEK not found")
             
-        tz_origin = pytz.timezone(tz_origin_str)
-        tz_dest = pytz.timezone(tz_dest_str)
+        tz_origin = ZoneInfo(tz_origin_str)
+        tz_dest = ZoneInfo(tz_dest_str)
         
         start_time = "1310"
         end_time = "0600"
@@ -43,8 +43,8 @@ def test_calc():
         if next_day:
             dt_end_local += datetime.timedelta(days=1)
             
-        dt_start_aware = tz_origin.localize(dt_start_local)
-        dt_end_aware = tz_dest.localize(dt_end_local)
+        dt_start_aware = dt_start_local.replace(tzinfo=tz_origin)
+        dt_end_aware = dt_end_local.replace(tzinfo=tz_dest)
         
         dur = dt_end_aware - dt_start_aware
         print(f"Duration: {dur}")
@@ -0,0 +1,537 @@
+"""
+PDF and Word (DOCX) itinerary documents, and the itinerary card as a PNG
+(drawn by card_image.py).
+
+itinerary_data() reduces a parsed booking (passengers, flights, layovers,
+luggage) to the plain dict a document is rendered from. doc_key() hashes
+that dict together with the format, DOC_VERSION and the configured font and
+template, and the rendered file is kept on disk as <key>.<format> under
+BILLETE_DOCS_DIR, so one booking is only ever rendered once.
+
+Rendering is CPU-bound (reportlab lays out in pure Python), so DocJobs runs
+it in a process pool of BILLETE_DOCS_WORKERS processes, created on first
+use in each process (0 renders in the calling thread). A job id is the
+cache file name. While a job runs a <file>.job marker sits next to it and
+a failure leaves <file>.err, so every worker sharing the directory can
+answer for any job.
+
+Fonts, paragraph styles and the DOCX template are loaded once per process:
+  BILLETE_PDF_FONT        a .ttf/.ttc with CJK glyphs; default is
+                          reportlab's built-in STSong-Light CID font
+  BILLETE_DOCX_TEMPLATE   a .docx whose styles, header and footer every
+                          document starts from
+  BILLETE_DOCX_FONT       East Asian font name set on DOCX text (SimSun)
+"""
+import io
+import os
+import re
+import json
+import time
+import atexit
+import hashlib
+import zipfile
+import threading
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+import applog
+
+log = applog.get_logger("docgen")
+
+# Bump when the layout changes, so cached documents are rendered again
+DOC_VERSION = 1
+DOC_FORMATS = ('pdf', 'docx')
+FORMATS = DOC_FORMATS + ('png',)
+MIMETYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'png': 'image/png',
+}
+
+DOCS_DIR = os.getenv("BILLETE_DOCS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "docs_cache"))
+DOCS_WORKERS = int(os.getenv("BILLETE_DOCS_WORKERS", "2"))
+# Oldest documents beyond this many are deleted now and then
+DOCS_MAX_FILES = int(os.getenv("BILLETE_DOCS_MAX_FILES", "5000"))
+# A .job marker older than this belongs to a render that died
+JOB_TIMEOUT = float(os.getenv("BILLETE_DOCS_JOB_TIMEOUT", "300"))
+PDF_FONT = os.getenv("BILLETE_PDF_FONT", "")
+DOCX_TEMPLATE = os.getenv("BILLETE_DOCX_TEMPLATE", "")
+DOCX_FONT = os.getenv("BILLETE_DOCX_FONT", "SimSun")
+_PRUNE_EVERY = 100
+
+_JOB_ID = re.compile(r"^[0-9a-f]{64}\.(pdf|docx|png)$")
+LUGGAGE_FIELDS = ('hand_count', 'hand_weight', 'pack_count', 'pack_weight')
+LUGGAGE_DEFAULTS = {'hand_count': '1', 'hand_weight': '8', 'pack_count': '2', 'pack_weight': '23'}
+FLIGHT_FIELDS = ('id', 'origin', 'dest', 'year', 'month', 'day', 'start', 'end', 'duration', 'arrival_date')
+
+
+def itinerary_data(passengers, flights, layovers=(), luggage=None):
+    """
+    The fields a document shows, as plain JSON types. passengers are dicts
+    (name, passport, ticket) or bare names; flights and layovers are
+    Logic's records or their /process form.
+    """
+    luggage = luggage or {}
+    return {
+        'passengers': [
+            {'name': str(p.get('name', '')), 'passport': str(p.get('passport') or ''),
+             'ticket': str(p.get('ticket') or '')}
+            if isinstance(p, dict) else {'name': str(p), 'passport': '', 'ticket': ''}
+            for p in passengers
+        ],
+        'flights': [
+            {**{k: '' if f.get(k) is None else str(f.get(k)) for k in FLIGHT_FIELDS},
+             'next_day': bool(f.get('next_day'))}
+            for f in flights if isinstance(f, dict)
+        ],
+        'layovers': [
+            {'type': str(l.get('type', 'layover')), 'flight_index': l.get('flight_index'),
+             'place': str(l.get('place', '')), 'hours': int(l.get('hours', 0)), 'minutes': int(l.get('minutes', 0))}
+            for l in layovers if isinstance(l, dict)
+        ],
+        'luggage': {k: str(luggage.get(k) or LUGGAGE_DEFAULTS[k]) for k in LUGGAGE_FIELDS},
+    }
+
+
+def doc_key(data, fmt):
+    h = hashlib.sha256()
+    h.update(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    h.update(f"\0{fmt}\0{DOC_VERSION}\0{PDF_FONT}\0".encode("utf-8"))
+    if fmt == 'docx' and DOCX_TEMPLATE:
+        h.update(hashlib.sha256(_docx_template()).digest())
+    if fmt == 'png':
+        import card_image
+        h.update(f"{card_image.font_paths()}\0{card_image.SCALE}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def job_id_for(data, fmt):
+    return f"{doc_key(data, fmt)}.{fmt}"
+
+
+def document_name(data, fmt):
+    """A download file name: itinerary_<first passenger>_<first date>.<fmt>"""
+    parts = ['itinerary']
+    if data['passengers']:
+        parts.append(data['passengers'][0]['name'])
+    if data['flights']:
+        f = data['flights'][0]
+        parts.append(f"{f['year']}{f['month']}{f['day']}")
+    name = re.sub(r"[^\w-]+", "-", "_".join(parts)).strip("-")
+    return f"{name}.{fmt}"
+
+
+# --- Rendering ---
+
+def _rows(data):
+    """Table rows shared by both formats."""
+    passengers = [['#', '旅客姓名 Passenger', '护照号 Passport', '票号 Ticket']]
+    passengers += [[str(i), p['name'], p['passport'], p['ticket']] for i, p in enumerate(data['passengers'], 1)]
+
+    flights = [['航班 Flight', '日期 Date', '出发 From', '到达 To', '起飞 Dep', '降落 Arr', '飞行时间 Duration']]
+    for f in data['flights']:
+        date = f"{f['year']}-{f['month']}-{f['day']}" if f['year'] else f"{f['month']}-{f['day']}"
+        flights.append([f['id'], date, f['origin'], f['dest'], f['start'], f['end'], f['duration']])
+
+    notes = []
+    for l in data['layovers']:
+        if l['type'] == 'return_split':
+            notes.append(f"第{l['flight_index'] + 1}段起为回程 / Return trip from flight {l['flight_index'] + 1}")
+        else:
+            notes.append(f"在{l['place']}转机 {l['hours']}小时{l['minutes']}分钟 / Layover in {l['place']}: "
+                         f"{l['hours']}h {l['minutes']}m")
+    lug = data['luggage']
+    notes.append(f"托运行李 {lug['pack_count']} 件, 每件 {lug['pack_weight']} 公斤 / "
+                 f"Checked baggage: {lug['pack_count']} x {lug['pack_weight']} kg")
+    notes.append(f"手提行李 {lug['hand_count']} 件 {lug['hand_weight']} 公斤 / "
+                 f"Carry-on: {lug['hand_count']} x {lug['hand_weight']} kg")
+    return passengers, flights, notes
+
+
+TITLE = "电子客票行程单 / Flight Itinerary"
+
+
+@lru_cache(maxsize=None)
+def _pdf_font():
+    """Registers the CJK font with reportlab once per process. Returns its name."""
+    from reportlab.pdfbase import pdfmetrics
+    if PDF_FONT:
+        from reportlab.pdfbase.ttfonts import TTFont
+        pdfmetrics.registerFont(TTFont("BilleteCJK", PDF_FONT, subfontIndex=0))
+        return "BilleteCJK"
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+    pdfmetrics.registerFont(UnicodeCIDFont("STSong-Light"))
+    return "STSong-Light"
+
+
+@lru_cache(maxsize=None)
+def _pdf_styles():
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import TableStyle
+
+    font = _pdf_font()
+    base = getSampleStyleSheet()
+    return {
+        'title': ParagraphStyle('BilleteTitle', parent=base['Title'], fontName=font, fontSize=18, leading=24),
+        'heading': ParagraphStyle('BilleteHeading', parent=base['Heading3'], fontName=font, spaceBefore=10),
+        'body': ParagraphStyle('BilleteBody', parent=base['BodyText'], fontName=font, fontSize=10, leading=14),
+        'table': TableStyle([
+            ('FONTNAME', (0, 0), (-1, -1), font),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e8eef7')),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#9aa5b1')),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ]),
+    }
+
+
+def render_pdf(data):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
+    from xml.sax.saxutils import escape
+
+    styles = _pdf_styles()
+    passengers, flights, notes = _rows(data)
+    out = io.BytesIO()
+    doc = SimpleDocTemplate(out, pagesize=A4, leftMargin=15 * mm, rightMargin=15 * mm,
+                            topMargin=15 * mm, bottomMargin=15 * mm, title="Flight Itinerary")
+    story = [Paragraph(escape(TITLE), styles['title']), Spacer(1, 4 * mm)]
+    for heading, rows in (('旅客 Passengers', passengers), ('航班 Flights', flights)):
+        story.append(Paragraph(escape(heading), styles['heading']))
+        story.append(Table(rows, style=styles['table'], hAlign='LEFT', repeatRows=1))
+    story.append(Paragraph(escape('备注 Notes'), styles['heading']))
+    story += [Paragraph(escape(note), styles['body']) for note in notes]
+    doc.build(story)
+    return out.getvalue()
+
+
+@lru_cache(maxsize=None)
+def _docx_template():
+    """The template's bytes, read once; each document opens its own copy."""
+    if not DOCX_TEMPLATE:
+        return b""
+    with open(DOCX_TEMPLATE, "rb") as f:
+        return f.read()
+
+
+def render_docx(data):
+    from docx import Document
+    from docx.oxml.ns import qn
+
+    template = _docx_template()
+    document = Document(io.BytesIO(template)) if template else Document()
+    normal = document.styles['Normal']
+    normal.element.get_or_add_rPr().get_or_add_rFonts().set(qn('w:eastAsia'), DOCX_FONT)
+
+    passengers, flights, notes = _rows(data)
+    document.add_heading(TITLE, level=1)
+    for heading, rows in (('旅客 Passengers', passengers), ('航班 Flights', flights)):
+        document.add_heading(heading, level=2)
+        table = document.add_table(rows=len(rows), cols=len(rows[0]))
+        try:
+            table.style = 'Table Grid'
+        except (KeyError, ValueError):
+            pass  # a custom template without the style
+        for r, row in enumerate(rows):
+            for c, value in enumerate(row):
+                table.cell(r, c).text = value
+    document.add_heading('备注 Notes', level=2)
+    for note in notes:
+        document.add_paragraph(note)
+
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+def render_png(data):
+    import card_image
+    return card_image.render_png(data)
+
+
+RENDERERS = {'pdf': render_pdf, 'docx': render_docx, 'png': render_png}
+
+
+def render(data, fmt):
+    return RENDERERS[fmt](data)
+
+
+def _render_job(docs_dir, job_id, data, fmt):
+    """Renders one document into the cache directory (in a pool process). Returns its path."""
+    path = os.path.join(docs_dir, job_id)
+    try:
+        content = render(data, fmt)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except Exception as e:
+        with open(path + ".err", "w", encoding="utf-8") as f:
+            f.write(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        try:
+            os.remove(path + ".job")
+        except OSError:
+            pass
+    return path
+
+
+def preload():
+    """
+    Loads the fonts, PDF styles, DOCX template and card header so the first
+    document is as fast as the rest. Runs in every DocJobs pool process;
+    server.warmup calls it when documents render in-process (0 workers).
+    """
+    try:
+        _pdf_styles()
+        _docx_template()
+        import card_image
+        card_image.preload()
+    except Exception as e:
+        # Raising here would break the pool; the first render reports the problem
+        log.warning(f"Document preload failed: {e}")
+
+
+# --- Job queue ---
+
+class DocJobs:
+    """
+    Renders documents in the background, through the disk cache. submit()
+    returns a job id at once; status() and path() answer for any job in the
+    directory, wait() only for jobs this process submitted.
+    """
+
+    def __init__(self, docs_dir=DOCS_DIR, workers=DOCS_WORKERS):
+        self.docs_dir = docs_dir
+        self.workers = workers
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._finished = 0
+        self.rendered = 0
+        self.hits = 0
+        self.failed = 0
+        os.makedirs(docs_dir, exist_ok=True)
+
+    def _get_pool(self):
+        # A pool created before a fork (gunicorn preload) is unusable in the child.
+        # Its processes come from a forkserver (or spawn), not a fork of this
+        # threaded worker, which could copy a lock some other thread holds.
+        if self._pool is None or self._pid != os.getpid():
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=preload,
+                                             mp_context=multiprocessing.get_context(method))
+            self._pid = os.getpid()
+            atexit.register(self._pool.shutdown, wait=False, cancel_futures=True)
+        return self._pool
+
+    def _submit(self, *args):
+        # Caller holds _lock
+        try:
+            return self._get_pool().submit(_render_job, *args)
+        except BrokenProcessPool:
+            # A render process died (killed for memory, say); the pool won't take
+            # new work, so start another one
+            log.warning("Document render pool is broken; starting a new one", extra={"sample": "docgen_pool"})
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            return self._get_pool().submit(_render_job, *args)
+
+    def _path(self, job_id):
+        return os.path.join(self.docs_dir, job_id)
+
+    def submit(self, data, fmt):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt!r}")
+        job_id = job_id_for(data, fmt)
+        path = self._path(job_id)
+        with self._lock:
+            if os.path.exists(path):
+                self.hits += 1
+                return job_id
+            fut = self._futures.get(job_id)
+            if fut is not None and not fut.done():
+                return job_id  # already rendering here
+            if os.path.exists(path + ".err"):
+                os.remove(path + ".err")  # retry a failed render
+            # Written before submitting: the render process removes it when done
+            with open(path + ".job", "w") as f:
+                f.write(str(os.getpid()))
+            try:
+                if self.workers > 0:
+                    fut = self._submit(self.docs_dir, job_id, data, fmt)
+                else:
+                    fut = Future()  # rendered below, in this thread
+            except BaseException:
+                # Nothing will render it; don't report it pending until JOB_TIMEOUT
+                try:
+                    os.remove(path + ".job")
+                except OSError:
+                    pass
+                raise
+            self._futures[job_id] = fut
+        fut.add_done_callback(lambda f, job_id=job_id: self._done(job_id, f))
+        if self.workers <= 0:
+            try:
+                fut.set_result(_render_job(self.docs_dir, job_id, data, fmt))
+            except Exception as e:
+                fut.set_exception(e)
+        return job_id
+
+    def _done(self, job_id, fut):
+        with self._lock:
+            self._futures.pop(job_id, None)
+            if fut.cancelled() or fut.exception() is not None:
+                self.failed += 1
+                if fut.cancelled():
+                    try:
+                        os.remove(self._path(job_id) + ".job")
+                    except OSError:
+                        pass
+                else:
+                    log.warning(f"Rendering {job_id} failed: {fut.exception()}", extra={"sample": "docgen_error"})
+                    if isinstance(fut.exception(), BrokenProcessPool):
+                        # The render process died before it could record the failure
+                        path = self._path(job_id)
+                        with open(path + ".err", "w", encoding="utf-8") as f:
+                            f.write(f"BrokenProcessPool: {fut.exception()}")
+                        try:
+                            os.remove(path + ".job")
+                        except OSError:
+                            pass
+                return
+            self.rendered += 1
+            self._finished += 1
+            prune = self._finished % _PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def status(self, job_id):
+        """{'status': 'done' | 'pending' | 'failed' | 'unknown', ...} for a job id."""
+        if not _JOB_ID.match(job_id or ""):
+            return {'job_id': job_id, 'status': 'unknown'}
+        path = self._path(job_id)
+        if os.path.exists(path):
+            return {'job_id': job_id, 'status': 'done', 'size': os.path.getsize(path)}
+        try:
+            with open(path + ".err", encoding="utf-8") as f:
+                return {'job_id': job_id, 'status': 'failed', 'error': f.read()}
+        except OSError:
+            pass
+        try:
+            if time.time() - os.path.getmtime(path + ".job") < JOB_TIMEOUT:
+                return {'job_id': job_id, 'status': 'pending'}
+        except OSError:
+            pass
+        return {'job_id': job_id, 'status': 'unknown'}
+
+    def path(self, job_id):
+        """The finished document's path, or None."""
+        if not _JOB_ID.match(job_id or ""):
+            return None
+        path = self._path(job_id)
+        return path if os.path.exists(path) else None
+
+    def wait(self, job_id, timeout=None):
+        """Blocks until a job submitted by this process is done. Returns the path; raises if it failed."""
+        with self._lock:
+            fut = self._futures.get(job_id)
+        if fut is not None:
+            fut.result(timeout)
+        path = self.path(job_id)
+        if path is None:
+            raise RuntimeError(self.status(job_id).get('error') or f"Document {job_id} is not available")
+        return path
+
+    def render(self, data, fmt, timeout=None):
+        """submit() and wait(): the cached document's path."""
+        return self.wait(self.submit(data, fmt), timeout)
+
+    def prune(self, max_files=DOCS_MAX_FILES):
+        """Deletes the least recently written documents beyond max_files. Returns how many."""
+        try:
+            entries = [e for e in os.scandir(self.docs_dir) if _JOB_ID.match(e.name)]
+        except OSError:
+            return 0
+        if len(entries) <= max_files:
+            return 0
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        removed = 0
+        for entry in entries[:len(entries) - max_files]:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def depth(self):
+        with self._lock:
+            return len(self._futures)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._futures),
+                'rendered': self.rendered,
+                'cache_hits': self.hits,
+                'failed': self.failed,
+                'workers': self.workers,
+            }
+
+
+class _ZipBuffer:
+    """Write-only file for zipfile: keeps what was written until take()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(jobs, entries, timeout=None):
+    """
+    Streams a ZIP of (name, data, fmt) entries. Everything is submitted
+    first so the pool renders in parallel, then each document is added as
+    soon as it (in order) is ready. Documents that fail are listed in
+    errors.txt at the end instead.
+    """
+    submitted = []
+    for name, data, fmt in entries:
+        try:
+            submitted.append((name, jobs.submit(data, fmt), None))
+        except Exception as e:
+            submitted.append((name, None, str(e)))
+
+    buf = _ZipBuffer()
+    errors = []
+    # PDFs and DOCX files are compressed already
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        for name, job_id, error in submitted:
+            if job_id is not None:
+                try:
+                    zf.write(jobs.wait(job_id, timeout), name)
+                except Exception as e:
+                    error = str(e)
+            if error is not None:
+                errors.append(f"{name}: {error}")
+            yield buf.take()
+        if errors:
+            zf.writestr("errors.txt", "\n".join(errors) + "\n")
+    yield buf.take()
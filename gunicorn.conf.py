@@ -0,0 +1,44 @@
+"""
+gunicorn settings for production (picked up from the working directory, or
+pass -c gunicorn.conf.py).
+
+With preload_app the master imports server.py once: the schema check, the
+shared Logic with its airport map and index, and the warmup (see
+server.warmup) happen there, and the workers get all of it through fork,
+warm and copy-on-write. post_fork drops the database connections the master
+opened, since a connection must not be shared between processes.
+
+Workers and bind address follow gunicorn's own WEB_CONCURRENCY and PORT.
+BILLETE_PRELOAD=0 imports the app in each worker instead. With more than
+one worker, post_fork also shares the parse cache through the database so
+a parse_id resolves in whichever worker gets the follow-up request.
+"""
+import os
+import time
+
+# Loaded before the app, so this also covers the preload import
+_config_loaded = time.perf_counter()
+
+worker_class = "gthread"
+threads = int(os.getenv("BILLETE_THREADS", "4"))
+preload_app = os.getenv("BILLETE_PRELOAD", "1").strip().lower() in ("1", "true", "yes", "on")
+
+
+def when_ready(server):
+    elapsed = (time.perf_counter() - _config_loaded) * 1000
+    server.log.info("Master ready in %.0f ms (preload_app=%s)", elapsed, preload_app)
+
+
+def post_fork(server, worker):
+    worker.billete_forked = time.perf_counter()
+    if preload_app:
+        import database
+        database.dispose_engines()
+    if server.cfg.workers > 1:
+        import parse_cache
+        parse_cache.share_between_workers()
+
+
+def post_worker_init(worker):
+    elapsed = (time.perf_counter() - worker.billete_forked) * 1000
+    worker.log.info("Worker %s ready %.0f ms after fork", worker.pid, elapsed)
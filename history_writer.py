@@ -0,0 +1,304 @@
+"""
+Write-behind persistence for history rows.
+
+/process hands its history row to a HistoryWriter instead of inserting it
+inline. A background thread collects rows from a bounded queue and writes
+them with database.add_history_entries once BATCH_SIZE rows are waiting or
+FLUSH_SECONDS have passed.
+
+Rows that cannot be written (database down, queue full, process exiting
+with rows left) are appended to a JSON-lines spool file. The flush thread
+periodically claims the spool by renaming it, so only one worker replays
+each file, and puts back whatever still fails.
+"""
+import os
+import json
+import time
+import glob
+import queue
+import atexit
+import datetime
+import threading
+
+import database
+import applog
+
+log = applog.get_logger("history_writer")
+
+QUEUE_MAX = int(os.getenv("BILLETE_HISTORY_QUEUE_MAX", "1000"))
+BATCH_SIZE = int(os.getenv("BILLETE_HISTORY_BATCH", "100"))
+FLUSH_SECONDS = float(os.getenv("BILLETE_HISTORY_FLUSH_SECONDS", "1.0"))
+REPLAY_SECONDS = float(os.getenv("BILLETE_HISTORY_REPLAY_SECONDS", "30"))
+SPOOL_PATH = os.getenv(
+    "BILLETE_HISTORY_SPOOL",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "history_spool.jsonl")
+)
+# A claimed spool left behind by a crashed worker is picked up again after this long
+STALE_CLAIM_SECONDS = 600
+
+_STOP = object()
+# Ends the batch the flush thread is collecting, so it is written right away
+_WAKE = object()
+
+
+class HistoryWriter:
+    def __init__(self, max_queue=QUEUE_MAX, batch_size=BATCH_SIZE,
+                 flush_seconds=FLUSH_SECONDS, spool_path=SPOOL_PATH):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.spool_path = spool_path
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        # Notified whenever _pending drops
+        self._settled = threading.Condition(self._lock)
+        self._spool_lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._stopping = False
+        self._last_replay = 0.0
+        # Submitted but not yet written or spooled, including a batch being collected
+        self._pending = 0
+        self._stats = {
+            "written": 0,
+            "spooled": 0,
+            "replayed": 0,
+            "failed_batches": 0,
+            "flushes": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0
+        }
+
+    def _ensure_started(self):
+        # Threads don't survive fork, so each process starts its own
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, code, result, passenger_info="", route_info=""):
+        """
+        Queues one history row and returns it (without an id, which only the
+        database assigns). Never blocks; spools the row if the queue is full.
+        """
+        self._ensure_started()
+        entry = {
+            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "code": code,
+            "result": result,
+            "passenger_info": passenger_info,
+            "route_info": route_info
+        }
+        with self._lock:
+            self._pending += 1
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self._pending -= 1
+                self._settled.notify_all()
+            self._spool([entry])
+        return entry
+
+    def flush(self):
+        """
+        Writes everything queued so far from the calling thread, then waits
+        for the batch the flush thread may be holding, so no row submitted
+        before the call lands after it (e.g. after a history clear).
+        """
+        deadline = time.monotonic() + self.flush_seconds + 5
+        woken = False
+        while True:
+            batch = self._take(self.batch_size, wait=False)
+            if batch:
+                self._write(batch)
+                continue
+            with self._settled:
+                if self._pending <= 0:
+                    return
+            if not woken:
+                # What is still pending sits in the batch the flush thread is collecting
+                woken = True
+                try:
+                    self._queue.put_nowait(_WAKE)
+                except queue.Full:
+                    pass
+            with self._settled:
+                if self._pending <= 0:
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    log.warning(f"History flush gave up waiting for {self._pending} rows")
+                    return
+                self._settled.wait(min(remaining, 0.1))
+
+    def close(self):
+        """Stops the flush thread after its current batch and writes what is left."""
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                pass
+            thread.join(timeout=self.flush_seconds + 5)
+        self.flush()
+
+    def depth(self):
+        with self._lock:
+            return self._pending
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out["depth"] = self._pending
+        flushes = out.pop("total_flush_ms")
+        out["avg_flush_ms"] = round(flushes / out["flushes"], 2) if out["flushes"] else 0.0
+        out["capacity"] = self._queue.maxsize
+        try:
+            out["spool_bytes"] = os.path.getsize(self.spool_path)
+        except OSError:
+            out["spool_bytes"] = 0
+        return out
+
+    def _take(self, limit, wait):
+        batch = []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < limit:
+            try:
+                if wait:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    item = self._queue.get(timeout=timeout)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._stopping = True
+                break
+            if item is _WAKE:
+                if wait:
+                    break
+                continue
+            batch.append(item)
+        return batch
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        try:
+            database.add_history_entries(batch)
+            ok = True
+        except Exception as e:
+            log.warning(f"History flush failed, spooling {len(batch)} rows: {e}")
+            ok = False
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            s = self._stats
+            s["flushes"] += 1
+            s["last_flush_ms"] = round(elapsed_ms, 2)
+            s["max_flush_ms"] = max(s["max_flush_ms"], s["last_flush_ms"])
+            s["total_flush_ms"] += elapsed_ms
+            self._pending -= len(batch)
+            self._settled.notify_all()
+            if ok:
+                s["written"] += len(batch)
+            else:
+                s["failed_batches"] += 1
+        if not ok:
+            self._spool(batch)
+        return ok
+
+    def _spool(self, entries):
+        lines = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries)
+        try:
+            with self._spool_lock:
+                with open(self.spool_path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+            with self._lock:
+                self._stats["spooled"] += len(entries)
+        except Exception as e:
+            log.error(f"Failed to spool {len(entries)} history rows: {e}")
+
+    def _claim_spools(self):
+        """Renames spool files this process should replay and returns the new paths."""
+        claimed = []
+        candidates = [self.spool_path]
+        now = time.time()
+        for path in glob.glob(f"{glob.escape(self.spool_path)}.*.replay"):
+            try:
+                if now - os.path.getmtime(path) > STALE_CLAIM_SECONDS:
+                    candidates.append(path)
+            except OSError:
+                pass
+        for path in candidates:
+            target = f"{self.spool_path}.{os.getpid()}-{time.time_ns()}.replay"
+            try:
+                os.replace(path, target)
+            except OSError:
+                continue  # gone, or another worker claimed it first
+            try:
+                os.utime(target)  # the claim is fresh even if the rows are old
+            except OSError:
+                pass
+            claimed.append(target)
+        return claimed
+
+    def replay_spool(self):
+        """Re-inserts spooled rows. Returns how many were written."""
+        written = 0
+        with self._spool_lock:
+            claimed = self._claim_spools()
+        for path in claimed:
+            entries = []
+            try:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            entries.append(json.loads(line))
+                        except ValueError:
+                            log.warning(f"Skipping unreadable spooled history row in {path}")
+            except OSError as e:
+                log.error(f"Failed to read history spool {path}: {e}")
+                continue
+
+            done = 0
+            try:
+                for i in range(0, len(entries), self.batch_size):
+                    chunk = entries[i:i + self.batch_size]
+                    database.add_history_entries(chunk)
+                    done += len(chunk)
+            except Exception as e:
+                log.warning(f"History replay failed, keeping {len(entries) - done} rows spooled: {e}")
+                self._spool(entries[done:])
+            written += done
+            os.remove(path)
+
+        if written:
+            with self._lock:
+                self._stats["replayed"] += written
+        return written
+
+    def _run(self):
+        while True:
+            batch = self._take(self.batch_size, wait=True)
+            if batch:
+                self._write(batch)
+            if self._stopping:
+                return
+            now = time.monotonic()
+            if now - self._last_replay >= REPLAY_SECONDS:
+                self._last_replay = now
+                try:
+                    self.replay_spool()
+                except Exception as e:
+                    log.error(f"History replay error: {e}")
@@ -3,107 +3,269 @@ import os
 import datetime
 import json
 import time
-import requests
-import airportsdata
-from bs4 import BeautifulSoup
+import threading
+import logging
+from collections import deque
+from dataclasses import dataclass
 import database
+import pnr_lexer
+import metrics
+from airport_cache import ResolutionCache
+import airport_index
+from tz_service import TimezoneService
+import applog
+
+logger = applog.get_logger("logic")
+
+# How often a Logic checks the database for airport edits made by other workers
+AIRPORT_SYNC_SECONDS = float(os.getenv("BILLETE_AIRPORT_SYNC_SECONDS", "2"))
+# Online airport source; {code} is replaced (point it at a local stub for load tests)
+AIRPORT_LOOKUP_URL = os.getenv("BILLETE_AIRPORT_LOOKUP_URL", "http://airport.supfree.net/search.asp?s={code}")
+AIRPORT_LOOKUP_TIMEOUT = float(os.getenv("BILLETE_AIRPORT_LOOKUP_TIMEOUT", "2"))
+AIRPORT_LOOKUP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+# Messages kept per parse for the "Debug Logs" fallback; older ones are dropped
+PARSE_LOG_LIMIT = int(os.getenv("BILLETE_PARSE_LOG_LIMIT", "200"))
+
+# First and last lines of every calendar from Logic.iter_ics
+ICS_BEGIN = "BEGIN:VCALENDAR\nVERSION:2.0\nPRODID:-//Billete//Flight Itinerary//EN\n"
+ICS_END = "END:VCALENDAR\n"
+
+@dataclass(frozen=True)
+class Itinerary:
+    """Immutable result of one Logic.parse() call."""
+    text: str
+    passengers: tuple = ()
+    flights: tuple = ()
+    layovers: tuple = ()
+    logs: tuple = ()
+    # Codes shown unresolved while a background lookup runs
+    pending_airports: tuple = ()
+
+
+class ParseState:
+    """Per-call scratch state, so one Logic can parse from many threads."""
+
+    def __init__(self, base_year, lookups=True):
+        self.logs = deque(maxlen=PARSE_LOG_LIMIT)
+        self.passengers = []
+        self.flights = []
+        self.layovers = []
+        self.pending_airports = []
+        self.base_year = base_year
+        self.current_year = base_year
+        self.last_month = None
+        # False: unknown codes stay as they are, with no online lookup
+        self.lookups = lookups
+        # Seconds per stage, reported to metrics once the parse is done
+        self.timings = {}
+
+    def log(self, msg, level=logging.DEBUG, sample=None):
+        self.logs.append(str(msg))
+        if logger.isEnabledFor(level):
+            logger.log(level, msg, extra={"sample": sample} if sample else None)
+
+    def add_time(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
 
 class Logic:
     def __init__(self):
+        # Results of the last process() call, kept for the desktop UI.
+        # Concurrent callers should use parse() and read the Itinerary instead.
         self.logs = []
         self.passengers = []
         self.flights = []
         self.layovers = []
         self.base_year = datetime.datetime.now().year
-        self.current_year = self.base_year
-        self.last_month = None
-        self.airports_db = {}
+        # Guards writes to airport_map; readers only do single dict lookups.
+        self._airport_lock = threading.RLock()
+        self.resolution_cache = ResolutionCache()
+        # Set to an airport_lookup.LookupQueue to take online lookups off the parse path
+        self.lookup_queue = None
+        # Set to a history_writer.HistoryWriter to batch history inserts in the background
+        self.history_writer = None
         
-        try:
-             self.airports_db = airportsdata.load('IATA')
-        except Exception as e:
-            self.log(f"Failed to load airportsdata: {e}")
-            self.airports_db = {}
+        # Shared, lazily mapped code -> city/name/tz index (see airport_index.py)
+        self.airports_db = airport_index.get_index()
+        self.timezones = TimezoneService(self.airports_db)
         
         # Initialize map from DB
+        # airport_map_version is the database's airport version this map reflects
+        self._airport_checked_at = time.monotonic()
         try:
-             self.airport_map = database.get_all_airports()
+             self.airport_map_version, self.airport_map = database.get_airport_snapshot()
         except Exception as e:
-             self.log(f"Failed to load DB airports: {e}")
-             self.airport_map = {}
-
-    def log(self, msg):
-        # Store log in memory to display in result if needed
-        self.logs.append(str(msg))
-        print(msg)
+             self.log(f"Failed to load DB airports: {e}", level=logging.ERROR)
+             self.airport_map_version, self.airport_map = 0, {}
+
+    def log(self, msg, state=None, level=logging.INFO, sample=None):
+        # Per-parse messages are also kept on the caller's state; the rest only go
+        # to the logger so a long-lived shared instance doesn't accumulate them
+        if state is not None:
+            state.log(msg, level, sample)
+            return
+        if logger.isEnabledFor(level):
+            logger.log(level, msg, extra={"sample": sample} if sample else None)
 
     def load_airport_map(self):
         return database.get_all_airports()
 
     def reload_airport_map(self):
-        self.airport_map = database.get_all_airports()
+        version, airport_map = database.get_airport_snapshot()
+        with self._airport_lock:
+            self.airport_map = airport_map
+            self.airport_map_version = version
+            self._airport_checked_at = time.monotonic()
+
+    def sync_airport_map(self, force=False):
+        """
+        Reloads airport_map if the database version moved, e.g. after an edit
+        in another worker. Checks at most every AIRPORT_SYNC_SECONDS unless
+        force is set. Returns the version the map now reflects.
+        """
+        now = time.monotonic()
+        if not force and now - self._airport_checked_at < AIRPORT_SYNC_SECONDS:
+            return self.airport_map_version
+        self._airport_checked_at = now
+        try:
+            if database.get_airport_version() != self.airport_map_version:
+                self.reload_airport_map()
+        except Exception as e:
+            self.log(f"Airport map sync failed: {e}", level=logging.WARNING)
+        return self.airport_map_version
+
+    def _apply_airport_write(self, apply):
+        """
+        Applies our own committed write to airport_map. If the database version
+        moved by more than that write, someone else changed the map as well
+        and it is reloaded instead.
+        """
+        try:
+            version = database.get_airport_version()
+        except Exception as e:
+            self.log(f"Airport version check failed: {e}", level=logging.WARNING, sample="airport_version")
+            version = None
+        with self._airport_lock:
+            if version is not None and version - self.airport_map_version in (0, 1):
+                apply(self.airport_map)
+                self.airport_map_version = version
+                return
+        try:
+            self.reload_airport_map()
+        except Exception as e:
+            self.log(f"Airport map reload failed: {e}", level=logging.WARNING)
+            with self._airport_lock:
+                apply(self.airport_map)
 
     def save_airport_map(self):
         pass
 
     def update_airport(self, code, name):
+        code = code.upper()
         database.upsert_airport(code, name)
-        self.airport_map[code] = name
+        self._apply_airport_write(lambda m: m.__setitem__(code, name))
+        self.resolution_cache.forget(code)
+
+    def backfill_airport(self, code, name):
+        """Saves an offline-index name the database doesn't have yet (see database.backfill_airport)."""
+        code = code.upper()
+        try:
+            if database.backfill_airport(code, name):
+                self._apply_airport_write(lambda m: m.setdefault(code, name))
+                return
+        except Exception as e:
+            self.log(f"Airport backfill failed for {code}: {e}", level=logging.WARNING, sample="airport_backfill")
+        # Another worker stored it first; its version bump reaches us on the next sync
+        with self._airport_lock:
+            self.airport_map.setdefault(code, name)
+
+    def import_airports(self, entries):
+        """Bulk upsert of {code: name}. Returns the diff from database.bulk_upsert_airports."""
+        diff = database.bulk_upsert_airports(entries)
+        changed = {**diff["inserted"], **diff["updated"]}
+        self._apply_airport_write(lambda m: m.update(changed))
+        self.resolution_cache.forget_many(list(changed))
+        return diff
 
     def delete_airport(self, code):
         """Removes an airport from the database and local map."""
+        code = code.upper()
         if database.delete_airport(code):
-            if code in self.airport_map:
-                del self.airport_map[code]
+            self._apply_airport_write(lambda m: m.pop(code, None))
             return True
         return False
 
-    def fetch_online_airport_name(self, code):
+    def fetch_online_airport_name(self, code, state=None):
         """
         Fallback to online search using a Chinese source.
         Target: airport.supfree.net
         """
         try:
-            url = f"http://airport.supfree.net/search.asp?s={code}"
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
+            # Only needed on this fallback, so kept out of startup
+            import requests
+
+            url = AIRPORT_LOOKUP_URL.format(code=code)
             # Timeout is important - Reduced to 2s to prevent hanging
-            resp = requests.get(url, headers=headers, timeout=2)
+            resp = requests.get(url, headers=AIRPORT_LOOKUP_HEADERS, timeout=AIRPORT_LOOKUP_TIMEOUT)
             # This site uses legacy encoding
             resp.encoding = 'gbk'
 
             if resp.status_code == 200:
-                soup = BeautifulSoup(resp.text, 'html.parser')
-                rows = soup.find_all('tr')
-                for row in rows:
-                    cols = row.find_all('td')
-                    if len(cols) >= 4:
-                        txts = [c.get_text().strip() for c in cols]
-                        if code in txts:
-                            possible_name = txts[1]
-                            if possible_name == code:
-                                possible_name = txts[2]
-                            if possible_name and possible_name != code:
-                                return possible_name
+                return self.extract_online_airport_name(resp.text, code)
+
+        except Exception as e:
+            self.log(f"Chinese lookup failed for {code}: {e}", state, logging.WARNING, "airport_online_failed")
 
+        return None
+
+    async def fetch_online_airport_name_async(self, client, code):
+        """fetch_online_airport_name on a shared httpx.AsyncClient, for the ASGI app."""
+        try:
+            resp = await client.get(AIRPORT_LOOKUP_URL.format(code=code), headers=AIRPORT_LOOKUP_HEADERS,
+                                    timeout=AIRPORT_LOOKUP_TIMEOUT)
+            if resp.status_code == 200:
+                return self.extract_online_airport_name(resp.content.decode('gbk', errors='replace'), code)
         except Exception as e:
-            self.log(f"Chinese lookup failed for {code}: {e}")
+            self.log(f"Chinese lookup failed for {code}: {e}", level=logging.WARNING, sample="airport_online_failed")
+        return None
 
+    def extract_online_airport_name(self, html, code):
+        """Finds code's row in the results table of the online source."""
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html, 'html.parser')
+        rows = soup.find_all('tr')
+        for row in rows:
+            cols = row.find_all('td')
+            if len(cols) >= 4:
+                txts = [c.get_text().strip() for c in cols]
+                if code in txts:
+                    possible_name = txts[1]
+                    if possible_name == code:
+                        possible_name = txts[2]
+                    if possible_name and possible_name != code:
+                        return possible_name
         return None
 
-    def resolve_airport(self, code):
+    def resolve_airport(self, code, state=None):
         """
         Resolve airport code to name using 3 levels:
         1. Local fly.txt (Priority)
         2. Offline airportsdata DB (Fast, English)
         3. Online Scraping (Slow, Fallback for Chinese)
+        Codes that failed level 3 are remembered for resolution_cache.ttl seconds.
+        With a lookup_queue, level 3 runs in the background and the code is returned as-is.
         """
         code = code.upper()
+        cache = self.resolution_cache
 
         # 1. Local
-        if code in self.airport_map:
-            return self.airport_map[code]
+        local_name = self.airport_map.get(code)
+        if local_name is not None:
+            cache.hit("map")
+            return local_name
 
         # 2. Offline DB (English Fallback) - MOVED UP for performance
         if code in self.airports_db:
@@ -112,84 +274,99 @@ class Logic:
              name = data.get('name', '')
              final_name = city if city else name
 
-             self.log(f"Found offline (English): {code} -> {final_name}")
-             self.update_airport(code, final_name)
+             self.log(f"Found offline (English): {code} -> {final_name}", state, logging.DEBUG, "airport_offline")
+             cache.hit("offline")
+             self.backfill_airport(code, final_name)
              return final_name
 
         # 3. Online Chinese Fallback (Preferred for Language but SLOW)
         # Only reached if not in local map AND not in offline DB
-        online_name = self.fetch_online_airport_name(code)
+        if cache.is_known_miss(code):
+            return code
+
+        if state is not None and not state.lookups:
+            return code
+
+        if self.lookup_queue is not None:
+            self.lookup_queue.submit(code)
+            if state is not None and code not in state.pending_airports:
+                state.pending_airports.append(code)
+            return code
+
+        return self.resolve_online(code, state) or code
+
+    def resolve_online(self, code, state=None):
+        """Level 3 of resolve_airport. Returns the name, or None after recording a miss."""
+        return self.store_online_result(code, self.fetch_online_airport_name(code, state), state)
+
+    def store_online_result(self, code, online_name, state=None):
+        """Saves the name an online lookup found, or records the miss if it found none."""
         if online_name:
-             self.log(f"Found online (Chinese): {code} -> {online_name}")
+             self.log(f"Found online (Chinese): {code} -> {online_name}", state, sample="airport_online")
+             self.resolution_cache.hit("online")
              self.update_airport(code, online_name)
              return online_name
 
         # Not found
-        return code
+        self.resolution_cache.record_miss(code)
+        return None
 
-    def get_history(self):
-        return database.get_history_entries(limit=50)
+    def get_history(self, limit=50, before_id=None):
+        return database.get_history_entries(limit=limit, before_id=before_id)
+
+    def get_history_entry(self, entry_id):
+        return database.get_history_entry(entry_id)
 
     def clear_history(self):
+        if self.history_writer is not None:
+            # Rows queued before the clear should be cleared too
+            self.history_writer.flush()
         return database.clear_history_entries()
 
     def get_today_count(self):
         return database.get_today_count()
 
+    def get_history_version(self):
+        return database.get_history_version()
+
     def save_to_history(self, code, result, passenger_info="", route_info=""):
+        """Returns the queued row when a history_writer is set (it may not be in the database yet)."""
+        if self.history_writer is not None:
+            return self.history_writer.submit(code, result, passenger_info, route_info)
         try:
             database.add_history_entry(code, result, passenger_info, route_info)
         except Exception as e:
-            self.log(f"Error saving history: {e}")
+            self.log(f"Error saving history: {e}", level=logging.ERROR)
 
-    def merge_lines_without_sequence_number(self, text):
-        lines = text.split("\n")
-        output = []
-        previous_line = None
+    def save_many_to_history(self, entries):
+        """Saves a list of history dicts in one transaction. Returns the row count."""
+        try:
+            return database.add_history_entries(entries)
+        except Exception as e:
+            self.log(f"Error saving history batch: {e}", level=logging.ERROR)
+            return 0
 
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Check if line starts with a number (e.g., "1.", "1 ", "14")
-            if re.match(r'^\d+.*', line):
-                if previous_line is not None:
-                    output.append(previous_line)
-                previous_line = line
-            else:
-                if previous_line is not None:
-                    previous_line += " " + line
-                else:
-                    previous_line = line
-        
-        if previous_line is not None:
-            output.append(previous_line)
-            
-        return "\n".join(output)
+    def merge_lines_without_sequence_number(self, text):
+        return "\n".join(pnr_lexer.merge_lines(text))
 
     def replace_number(self, text):
         return re.sub(r'\d+', '', text)
 
     def contain_month(self, text):
-        months = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
-        return any(m in text for m in months)
+        return pnr_lexer.contain_month(text)
 
     def get_month_num(self, month_str):
-        months = {
-            "JAN": "01", "FEB": "02", "MAR": "03", "APR": "04", "MAY": "05", "JUN": "06",
-            "JUL": "07", "AUG": "08", "SEP": "09", "OCT": "10", "NOV": "11", "DEC": "12"
-        }
-        return months.get(month_str, "-1")
-
-    def parse_passengers(self, line, scanner):
-        parts = line.split(".")
-        for i in range(1, len(parts)):
-            p_name = self.replace_number(parts[i]).strip()
-            if p_name:
-                self.passengers.append({"name": p_name, "id": f"P{len(self.passengers)+1}", "passport": "", "ticket": ""})
-
-    def parse_ssr_docs(self, line_parts):
+        num = pnr_lexer.MONTH_NUMS.get(month_str)
+        return f"{num:02d}" if num else "-1"
+
+    def parse_passengers(self, line, state):
+        self.add_passengers(pnr_lexer.split_names(line), state)
+
+    def add_passengers(self, names, state):
+        for p_name in names:
+            state.passengers.append({"name": p_name, "id": f"P{len(state.passengers)+1}", "passport": "", "ticket": ""})
+
+    def parse_ssr_docs(self, line_parts, state):
         try:
             data_part = None
             for part in line_parts:
@@ -208,12 +385,12 @@ class Logic:
                  split_data = data_part.split("/")
                  if len(split_data) >= 3:
                      passport = split_data[2]
-                     if len(self.passengers) == 1:
-                         self.passengers[0]["passport"] = passport
+                     if len(state.passengers) == 1:
+                         state.passengers[0]["passport"] = passport
         except Exception as e:
-            self.log(f"Error parsing SSR DOCS: {e}")
+            state.log(f"Error parsing SSR DOCS: {e}", logging.WARNING, "parse_ssr_docs")
 
-    def parse_fa_pax(self, line_parts):
+    def parse_fa_pax(self, line_parts, state):
         try:
             ticket_part = None
             for part in line_parts:
@@ -226,205 +403,172 @@ class Logic:
             if ticket_part:
                  ticket_data = ticket_part.split("/")
                  ticket_num = ticket_data[0]
-                 if len(self.passengers) == 1:
-                     self.passengers[0]["ticket"] = ticket_num
+                 if len(state.passengers) == 1:
+                     state.passengers[0]["ticket"] = ticket_num
         except Exception as e:
-            self.log(f"Error parsing FA PAX: {e}")
+            state.log(f"Error parsing FA PAX: {e}", logging.WARNING, "parse_fa_pax")
 
-    def parse_flight(self, line_parts):
+    def parse_flight(self, line_parts, state):
         try:
-            date_idx = -1
-            for i, part in enumerate(line_parts):
-                if self.contain_month(part):
-                    date_idx = i
-                    break
-            
-            if date_idx != -1:
-                flight_id = line_parts[1] + line_parts[2]
-                date_str = line_parts[date_idx]
-                
-                ori_des_idx = date_idx + 2
-                if ori_des_idx >= len(line_parts):
-                     return
+            segment = pnr_lexer.parse_segment(line_parts)
+            if segment:
+                self.add_flight(segment, state)
+        except Exception as e:
+            state.log(f"Error parsing flight: {e}", logging.WARNING, "parse_flight")
+
+    def add_flight(self, segment, state):
+        """Resolves airports and times for a lexed Segment and appends the flight."""
+        try:
+            ori = segment.origin
+            des = segment.dest
+            t0 = time.perf_counter()
+            ori_name = self.resolve_airport(ori, state)
+            des_name = self.resolve_airport(des, state)
+            state.add_time("airport", time.perf_counter() - t0)
+
+            start_time = segment.start
+            end_time = segment.end
+            next_day = segment.next_day
+
+            start_time_fmt = f"{start_time[:2]}:{start_time[2:]}"
+            end_time_fmt = f"{end_time[:2]}:{end_time[2:]}"
+            if next_day:
+                end_time_fmt += "+1"
+
+            flight_id = segment.flight_id
+            day = segment.day
+            month = segment.month
 
-                ori_des = line_parts[ori_des_idx]
-                ori = ori_des[:3]
-                des = ori_des[3:]
+            duration_fmt = ""
+            arrival_date_fmt = ""
+
+            try:
+                month_int = int(month)
+                day_int = int(day)
+                if state.last_month is None:
+                    state.last_month = month_int
+                    year_to_use = state.current_year
+                else:
+                    if month_int < state.last_month:
+                        state.current_year += 1
+                    state.last_month = month_int
+                    year_to_use = state.current_year
                 
-                ori_name = self.resolve_airport(ori)
-                des_name = self.resolve_airport(des)
+                start_h = int(start_time[:2])
+                start_m = int(start_time[2:])
+                end_h = int(end_time[:2])
+                end_m = int(end_time[2:])
                 
-                time_idx = -1
-                for i in range(ori_des_idx + 1, len(line_parts)):
-                    if re.match(r'^\d{4}$', line_parts[i]) or re.match(r'^\d{4}\+\d$', line_parts[i]):
-                        time_idx = i
-                        break
+                dt_start_local = datetime.datetime(year_to_use, month_int, day_int, start_h, start_m)
+                dt_end_local = datetime.datetime(year_to_use, month_int, day_int, end_h, end_m)
                 
-                if time_idx != -1:
-                    start_time = line_parts[time_idx]
-                    end_time = line_parts[time_idx+1]
-                    
-                    next_day = False
-                    if "+" in end_time:
-                        next_day = True
-                        end_time = end_time.split("+")[0]
-                    
-                    start_time_fmt = f"{start_time[:2]}:{start_time[2:]}"
-                    end_time_fmt = f"{end_time[:2]}:{end_time[2:]}"
-                    if next_day:
-                        end_time_fmt += "+1"
-                    
-                    day = date_str[:2]
-                    month_str = date_str[2:]
-                    month = self.get_month_num(month_str)
+                if next_day:
+                    dt_end_local += datetime.timedelta(days=1)
+                
+                t0 = time.perf_counter()
+                dt_start_utc = self.timezones.airport_to_utc(ori, dt_start_local)
+                dt_end_utc = self.timezones.airport_to_utc(des, dt_end_local)
+                state.add_time("timezone", time.perf_counter() - t0)
+                
+                dur = dt_end_utc - dt_start_utc
+                dur_min = int(dur.total_seconds() / 60)
+                dur_h = dur_min // 60
+                dur_m = dur_min % 60
+                duration_fmt = f"{dur_h}小时 {dur_m}m"
+                
+                arr_month = dt_end_local.month
+                arr_day = dt_end_local.day
+                arrival_date_fmt = f"{arr_month:02d}-{arr_day:02d}"
+                
+            except Exception as e:
+                state.log(f"Timezone calc failed: {e}", logging.WARNING, "parse_timezone")
+                duration_fmt = "--"
+                arrival_date_fmt = f"{month}-{day}"
+
+            state.flights.append({
+                "id": flight_id,
+                "origin": ori_name,
+                "dest": des_name,
+                "start": start_time_fmt,
+                "end": end_time_fmt,
+                "month": month,
+                "day": day,
+                "year": year_to_use if 'year_to_use' in locals() else state.current_year,
+                "next_day": next_day,
+                "raw_start": start_time,
+                "raw_end": end_time,
+                "duration": duration_fmt,
+                "arrival_date": arrival_date_fmt,
+                "utc_start": dt_start_utc.strftime('%Y%m%dT%H%M%SZ') if 'dt_start_utc' in locals() else "",
+                "utc_end": dt_end_utc.strftime('%Y%m%dT%H%M%SZ') if 'dt_end_utc' in locals() else "",
+                # Aware UTC instants, reused by calculate_layovers
+                "departure_at": dt_start_utc if 'dt_start_utc' in locals() else None,
+                "arrival_at": dt_end_utc if 'dt_end_utc' in locals() else None
+            })
 
-                    duration_fmt = ""
-                    arrival_date_fmt = ""
-                    
-                    try:
-                        import pytz
-                        
-                        tz_origin_str = 'UTC'
-                        tz_dest_str = 'UTC'
-                        
-                        if ori in self.airports_db:
-                            tz_origin_str = self.airports_db[ori]['tz']
-                        if des in self.airports_db:
-                            tz_dest_str = self.airports_db[des]['tz']
-                            
-                        tz_origin = pytz.timezone(tz_origin_str)
-                        tz_dest = pytz.timezone(tz_dest_str)
-                        
-                        month_int = int(month)
-                        day_int = int(day)
-                        if self.last_month is None:
-                            self.last_month = month_int
-                            year_to_use = self.current_year
-                        else:
-                            if month_int < self.last_month:
-                                self.current_year += 1
-                            self.last_month = month_int
-                            year_to_use = self.current_year
-                        
-                        start_h = int(start_time[:2])
-                        start_m = int(start_time[2:])
-                        end_h = int(end_time[:2])
-                        end_m = int(end_time[2:])
-                        
-                        dt_start_local = datetime.datetime(year_to_use, month_int, day_int, start_h, start_m)
-                        dt_end_local = datetime.datetime(year_to_use, month_int, day_int, end_h, end_m)
-                        
-                        if next_day:
-                            dt_end_local += datetime.timedelta(days=1)
-                        
-                        dt_start_aware = tz_origin.localize(dt_start_local)
-                        dt_end_aware = tz_dest.localize(dt_end_local)
-                        
-                        dur = dt_end_aware - dt_start_aware
-                        dur_min = int(dur.total_seconds() / 60)
-                        dur_h = dur_min // 60
-                        dur_m = dur_min % 60
-                        duration_fmt = f"{dur_h}小时 {dur_m}m"
-                        
-                        arr_month = dt_end_local.month
-                        arr_day = dt_end_local.day
-                        arrival_date_fmt = f"{arr_month:02d}-{arr_day:02d}"
-                        
-                    except Exception as e:
-                        self.log(f"Timezone calc failed: {e}")
-                        duration_fmt = "--"
-                        arrival_date_fmt = f"{month}-{day}"
-                    
-                    self.flights.append({
-                        "id": flight_id,
-                        "origin": ori_name,
-                        "dest": des_name,
-                        "start": start_time_fmt,
-                        "end": end_time_fmt,
-                        "month": month,
-                        "day": day,
-                        "year": year_to_use if 'year_to_use' in locals() else self.current_year,
-                        "next_day": next_day,
-                        "raw_start": start_time,
-                        "raw_end": end_time,
-                        "duration": duration_fmt,
-                        "arrival_date": arrival_date_fmt,
-                        "utc_start": dt_start_aware.strftime('%Y%m%dT%H%M%SZ') if 'dt_start_aware' in locals() else "",
-                        "utc_end": dt_end_aware.strftime('%Y%m%dT%H%M%SZ') if 'dt_end_aware' in locals() else ""
-                    })
-                    
         except Exception as e:
-            self.log(f"Error parsing flight: {e}")
-
-    def generate_ics(self):
-        """Generates ICS content for all flights."""
-        if not self.flights:
-            return ""
+            state.log(f"Error parsing flight: {e}", logging.WARNING, "parse_flight")
 
-        content = [
-            "BEGIN:VCALENDAR",
-            "VERSION:2.0",
-            "PRODID:-//Billete//Flight Itinerary//EN"
-        ]
-
-        for f in self.flights:
+    def iter_ics(self, flight_lists):
+        """
+        Yields one VCALENDAR in small chunks, with an event for every flight in
+        every list of flight_lists (which may be a lazy iterable). Flights
+        without UTC times are skipped.
+        """
+        yield ICS_BEGIN
+        for flights in flight_lists:
+            yield from self.iter_ics_events(flights)
+        yield ICS_END
+
+    def iter_ics_events(self, flights):
+        """The VEVENT lines for one list of flights."""
+        for f in flights:
             if not f.get("utc_start") or not f.get("utc_end"):
                 continue
 
-            content.append("BEGIN:VEVENT")
-            content.append(f"SUMMARY:Flight {f['id']} {f['origin']}-{f['dest']}")
-            content.append(f"DTSTART:{f['utc_start']}")
-            content.append(f"DTEND:{f['utc_end']}")
-            content.append(f"DESCRIPTION:Flight {f['id']} from {f['origin']} to {f['dest']}")
-            content.append(f"LOCATION:{f['origin']}")
-            content.append(f"UID:{f['id']}-{f['utc_start']}@billete.local")
-            content.append("END:VEVENT")
-
-        content.append("END:VCALENDAR")
-        return "\n".join(content)
+            yield "BEGIN:VEVENT\n"
+            yield f"SUMMARY:Flight {f['id']} {f['origin']}-{f['dest']}\n"
+            yield f"DTSTART:{f['utc_start']}\n"
+            yield f"DTEND:{f['utc_end']}\n"
+            yield f"DESCRIPTION:Flight {f['id']} from {f['origin']} to {f['dest']}\n"
+            yield f"LOCATION:{f['origin']}\n"
+            yield f"UID:{f['id']}-{f['utc_start']}@billete.local\n"
+            yield "END:VEVENT\n"
+
+    def generate_ics(self, flights=None):
+        """Generates ICS content for all flights (defaults to the last process() call)."""
+        if flights is None:
+            flights = self.flights
+        if not flights:
+            return ""
+        return "".join(self.iter_ics([flights]))
 
 
-    def calculate_layovers(self):
-        self.layovers = []
-        if len(self.flights) < 2:
+    def calculate_layovers(self, state):
+        state.layovers = []
+        if len(state.flights) < 2:
             return
 
-        for i in range(1, len(self.flights)):
-            prev = self.flights[i-1]
-            curr = self.flights[i]
+        for i in range(1, len(state.flights)):
+            prev = state.flights[i-1]
+            curr = state.flights[i]
             
             try:
-                prev_year = int(prev.get("year", self.base_year))
-                prev_month = int(prev["month"])
-                prev_day = int(prev["day"])
-                prev_hour = int(prev["raw_end"][:2])
-                prev_min = int(prev["raw_end"][2:])
-                
-                dt_prev = datetime.datetime(prev_year, prev_month, prev_day, prev_hour, prev_min)
-                if prev["next_day"]:
-                    dt_prev += datetime.timedelta(days=1)
-                
-                curr_year = int(curr.get("year", prev_year))
-                curr_month = int(curr["month"])
-                curr_day = int(curr["day"])
-                curr_hour = int(curr["raw_start"][:2])
-                curr_min = int(curr["raw_start"][2:])
-                
-                dt_curr = datetime.datetime(curr_year, curr_month, curr_day, curr_hour, curr_min)
-                
-                diff = dt_curr - dt_prev
+                if prev.get("arrival_at") is None or curr.get("departure_at") is None:
+                    raise ValueError(f"no times for {prev['id']} -> {curr['id']}")
+                diff = curr["departure_at"] - prev["arrival_at"]
                 total_minutes = int(diff.total_seconds() / 60)
                 hours = total_minutes // 60
                 minutes = total_minutes % 60
                 
                 if hours >= 72:
                     curr["is_return"] = True
-                    self.layovers.append({
+                    state.layovers.append({
                         "type": "return_split",
                         "flight_index": i
                     })
                 else:
-                    self.layovers.append({
+                    state.layovers.append({
                         "type": "layover",
                         "place": prev["dest"],
                         "version": "new",
@@ -434,87 +578,107 @@ class Logic:
                     })
                     
             except Exception as e:
-                self.log(f"Error calculating layover: {e}")
+                state.log(f"Error calculating layover: {e}", logging.WARNING, "parse_layover")
 
     def process(self, raw_code):
-        # Reset logs at start of process
-        self.logs = []
-        self.passengers = []
-        self.flights = []
-        self.layovers = []
-        
+        """Parses raw_code and keeps the results on the instance (desktop UI helper)."""
+        itinerary = self.parse(raw_code)
+        self.logs = list(itinerary.logs)
+        self.passengers = list(itinerary.passengers)
+        self.flights = list(itinerary.flights)
+        self.layovers = list(itinerary.layovers)
+        return itinerary.text
+
+    def parse(self, raw_code, today=None, lookups=True):
+        """
+        Parses raw_code without touching instance state and returns an Itinerary.
+        Safe to call from several threads on one shared Logic.
+        today (a datetime, default now) is the date the flight years are guessed
+        from; pass the booking's date when re-parsing an old PNR. lookups=False
+        leaves codes that need an online lookup unresolved.
+        """
+        # Cheap unless the throttle window has passed; picks up other workers' edits
+        started = time.perf_counter()
+        self.sync_airport_map()
+        current_real_date = today or datetime.datetime.now()
+        state = ParseState(current_real_date.year, lookups)
+
         # Determine year context before parsing flights
-        # Check all months in the raw code first
         try:
-            cleaned_code = self.merge_lines_without_sequence_number(raw_code)
-            lines = cleaned_code.split("\n")
-            
-            # Extract all months in sequence
-            months_found = []
-            for line in lines:
-                if self.contain_month(line) and not "SSR" in line and not "FA" in line:
-                    parts = line.split()
-                    for part in parts:
-                        if self.contain_month(part):
-                            for m_str in ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]:
-                                if m_str in part:
-                                    months_found.append(self.get_month_num(m_str))
-                                    break
+            # One pass over the text classifies every line
+            t0 = time.perf_counter()
+            records = list(pnr_lexer.tokenize(raw_code))
+            state.add_time("tokenize", time.perf_counter() - t0)
+            first_flight_month = next((r.month for r in records if r.month), None)
             
             # Logic to determine base year
             # If we see a sequence like JAN after DEC (current month is DEC), it's next year.
             # If current real month is e.g. DEC, and the first flight is JAN, it's definitely next year.
             
-            current_real_date = datetime.datetime.now()
             current_real_month = current_real_date.month
             current_real_year = current_real_date.year
             
-            self.current_year = current_real_year
-            self.last_month = None
+            state.current_year = current_real_year
+            state.last_month = None
             
             # If the first flight month is significantly earlier than current month (e.g. Current=Dec, Flight=Jan),
             # assume the whole itinerary starts next year.
-            if months_found:
-                first_flight_month = int(months_found[0])
+            if first_flight_month:
                 # Heuristic: if current is Oct/Nov/Dec and flight is Jan/Feb, it's next year
                 if current_real_month >= 9 and first_flight_month <= 4:
-                    self.current_year += 1
-            
-            passenger_mode = True
+                    state.current_year += 1
             
-            for line in lines:
-                parts = line.split()
-                if not parts:
-                    continue
-                    
-                if "." in line and passenger_mode and not "SSR" in line and not "FA" in line:
-                    if "." in parts[0]: 
-                        self.parse_passengers(line, None)
-                        continue
-                    else:
-                        passenger_mode = False 
-                
-                if "SSR" in line and "DOCS" in line:
-                    self.parse_ssr_docs(parts)
-                elif "FA" in line and "PAX" in line:
-                    self.parse_fa_pax(parts)
-                elif self.contain_month(line) and not "SSR" in line and not "FA" in line:
-                    self.parse_flight(parts)
-
-            self.calculate_layovers()
-            return self.generate_text()
+            for rec in records:
+                if rec.kind == pnr_lexer.NAME:
+                    self.add_passengers(rec.payload, state)
+                elif rec.kind == pnr_lexer.SSR_DOCS:
+                    self.parse_ssr_docs(rec.parts, state)
+                elif rec.kind == pnr_lexer.FA_PAX:
+                    self.parse_fa_pax(rec.parts, state)
+                elif rec.kind == pnr_lexer.SEGMENT:
+                    if rec.error:
+                        state.log(f"Error parsing flight: {rec.error}", logging.WARNING, "parse_flight")
+                    elif rec.payload:
+                        self.add_flight(rec.payload, state)
+
+            t0 = time.perf_counter()
+            self.calculate_layovers(state)
+            t1 = time.perf_counter()
+            text = self.generate_text(state.passengers, state.flights, state.layovers)
+            state.add_time("layovers", t1 - t0)
+            state.add_time("render", time.perf_counter() - t1)
             
         except Exception as e:
-            self.log(f"Critical error in process: {e}")
-            return f"Error processing: {e}"
+            state.log(f"Critical error in process: {e}", logging.ERROR)
+            text = f"Error processing: {e}"
+
+        state.add_time("parse", time.perf_counter() - started)
+        metrics.record_stages(state.timings)
+
+        return Itinerary(
+            text=text,
+            passengers=tuple(state.passengers),
+            flights=tuple(state.flights),
+            layovers=tuple(state.layovers),
+            logs=tuple(state.logs),
+            pending_airports=tuple(state.pending_airports),
+        )
+
+    def generate_text(self, passengers=None, flights=None, layovers=None):
+        """Renders the itinerary text (defaults to the last process() call)."""
+        if passengers is None:
+            passengers = self.passengers
+        if flights is None:
+            flights = self.flights
+        if layovers is None:
+            layovers = self.layovers
 
-    def generate_text(self):
         res = ""
-        for i, p in enumerate(self.passengers):
+        for i, p in enumerate(passengers):
             res += f"乘客{i+1}: {p['name']}\n"
         
         is_return = False
-        for i, f in enumerate(self.flights):
+        for i, f in enumerate(flights):
             if f.get("is_return"):
                 res += "---------<回程>---------\n"
                 is_return = True
@@ -522,7 +686,7 @@ class Logic:
             if i == 0 or f.get("is_return"):
                 res += f"【{f['year']}年{f['month']}月{f['day']}日】\n"
             
-            layover = next((l for l in self.layovers if l["flight_index"] == i), None)
+            layover = next((l for l in layovers if l["flight_index"] == i), None)
             if layover and layover.get('type', 'layover') == 'layover' and layover['hours'] >= 0:
                  res += f"{layover.get('place', '')}停留时间: {layover['hours']}小时{layover['minutes']}分\n"
             
@@ -0,0 +1,162 @@
+"""
+In-process timings and counters, exported in Prometheus text format.
+
+Logic.parse collects its per-stage times on the ParseState and hands them
+over once per parse (record_stages), and database.py reports every query
+(record_query), so the hot paths only add a few perf_counter() calls and
+one lock round-trip each. Stages recorded while a request is active
+(begin_request/end_request) are also summed per request, which server.py
+turns into a Server-Timing header.
+
+Values are per process: each gunicorn worker exposes its own.
+"""
+import bisect
+import threading
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+STAGE_HELP = "Time spent per stage of request handling and PNR parsing"
+QUERY_HELP = "Database statement execution time"
+REQUEST_HELP = "HTTP request duration by endpoint"
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> [bucket counts..., count, sum]
+_counters = {}    # (name, labels) -> value
+_help = {
+    "billete_stage_seconds": STAGE_HELP,
+    "billete_db_query_seconds": QUERY_HELP,
+    "billete_request_seconds": REQUEST_HELP,
+    "billete_requests_total": "HTTP requests by endpoint and status",
+}
+_local = threading.local()
+
+
+def _observe(name, labels, seconds):
+    # Caller holds _lock
+    data = _histograms.get((name, labels))
+    if data is None:
+        data = _histograms[(name, labels)] = [0] * (len(BUCKETS) + 2) + [0.0]
+    data[bisect.bisect_left(BUCKETS, seconds)] += 1
+    data[-2] += 1
+    data[-1] += seconds
+
+
+def _add_to_request(timings):
+    current = getattr(_local, "timings", None)
+    if current is None:
+        return
+    for stage, seconds in timings.items():
+        current[stage] = current.get(stage, 0.0) + seconds
+
+
+_stage_data = {}  # stage -> its billete_stage_seconds histogram list, to skip the key building
+
+
+def record_stages(timings):
+    """Records {stage: seconds} from one unit of work (e.g. one parse)."""
+    with _lock:
+        for stage, seconds in timings.items():
+            data = _stage_data.get(stage)
+            if data is None:
+                _observe("billete_stage_seconds", (("stage", stage),), seconds)
+                _stage_data[stage] = _histograms[("billete_stage_seconds", (("stage", stage),))]
+                continue
+            data[bisect.bisect_left(BUCKETS, seconds)] += 1
+            data[-2] += 1
+            data[-1] += seconds
+    if getattr(_local, "timings", None) is not None:
+        _add_to_request(timings)
+
+
+def record_stage(stage, seconds):
+    record_stages({stage: seconds})
+
+
+def record_query(seconds):
+    with _lock:
+        _observe("billete_db_query_seconds", (), seconds)
+    _add_to_request({"db": seconds})
+
+
+def record_request(endpoint, status, seconds):
+    with _lock:
+        _observe("billete_request_seconds", (("endpoint", endpoint),), seconds)
+        key = ("billete_requests_total", (("endpoint", endpoint), ("status", str(status))))
+        _counters[key] = _counters.get(key, 0) + 1
+
+
+def begin_request():
+    _local.timings = {}
+
+
+def end_request():
+    """Returns {stage: seconds} summed over the current request and stops collecting."""
+    timings = getattr(_local, "timings", None) or {}
+    _local.timings = None
+    return timings
+
+
+def server_timing(timings):
+    """Formats timings as a Server-Timing header value (durations in ms)."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
+
+
+def reset():
+    """Forgets everything recorded so far (e.g. warmup work that isn't traffic)."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _stage_data.clear()
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def render(extra=()):
+    """
+    Prometheus text exposition of everything recorded, plus `extra` values
+    read at scrape time: an iterable of (name, type, help, {label: value}, value)
+    where type is "gauge" or "counter".
+    """
+    with _lock:
+        histograms = {key: list(data) for key, data in _histograms.items()}
+        counters = dict(_counters)
+        help_texts = dict(_help)
+
+    lines = []
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# HELP {name} {help_texts.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for (hname, labels), data in sorted(histograms.items()):
+            if hname != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, data):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, [('le', repr(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {data[-2]}")
+            lines.append(f"{name}_sum{_labels(labels)} {data[-1]}")
+            lines.append(f"{name}_count{_labels(labels)} {data[-2]}")
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# HELP {name} {help_texts.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for (cname, labels), value in sorted(counters.items()):
+            if cname == name:
+                lines.append(f"{name}{_labels(labels)} {value}")
+
+    seen = set()
+    for name, kind, help_text, labels, value in extra:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name}{_labels(sorted(labels.items()))} {value}")
+
+    return "\n".join(lines) + "\n"
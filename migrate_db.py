@@ -4,6 +4,7 @@ import database
 
 def migrate():
     print("Starting migration to SQLite...")
+    database.init_db()
     
     # 1. Migrate Airports (fly.txt)
     fly_path = "fly.txt"
@@ -0,0 +1,187 @@
+"""
+Content-addressed cache of /process results.
+
+The key is a SHA-256 over the normalized PNR text, the luggage fields, the
+month the parse ran in (the year heuristic depends on it) and
+Logic.airport_map_version, so editing the airport map never serves a stale
+result. Results live in an in-memory LRU and in the parse_cache table
+shared by all workers, so a parse_id from one worker resolves in the
+others. The table is used when BILLETE_PARSE_CACHE_DB=1 and, unless it is
+set to 0, whenever the app runs more than one worker (WEB_CONCURRENCY, or
+gunicorn's worker count via share_between_workers). Concurrent requests
+for the same key wait for one computation.
+"""
+import os
+import json
+import time
+import hashlib
+import datetime
+import threading
+from collections import OrderedDict
+
+import database
+import applog
+
+log = applog.get_logger("parse_cache")
+
+MAX_ENTRIES = int(os.getenv("BILLETE_PARSE_CACHE_SIZE", "512"))
+_PERSIST_SETTING = os.getenv("BILLETE_PARSE_CACHE_DB", "").strip().lower()
+if _PERSIST_SETTING:
+    PERSIST = _PERSIST_SETTING in ("1", "true", "yes", "on")
+else:
+    PERSIST = int(os.getenv("WEB_CONCURRENCY", "1") or 1) > 1
+# Persisted rows older than this are pruned now and then
+PERSIST_MAX_AGE = float(os.getenv("BILLETE_PARSE_CACHE_DB_MAX_AGE", str(31 * 24 * 3600)))
+_PRUNE_EVERY = 500
+
+
+def share_between_workers():
+    """
+    Turns the database tier on for caches that follow PERSIST, unless
+    BILLETE_PARSE_CACHE_DB chose otherwise. For servers whose worker count
+    isn't in the environment (gunicorn -w).
+    """
+    global PERSIST
+    if not _PERSIST_SETTING:
+        PERSIST = True
+
+
+LUGGAGE_FIELDS = ('hand_count', 'hand_weight', 'pack_count', 'pack_weight')
+
+
+def normalize_pnr(code):
+    """Drops blank lines and surrounding whitespace, so re-pastes of one PNR hash alike."""
+    lines = (line.strip() for line in code.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def make_key(code, params, airport_version):
+    h = hashlib.sha256()
+    h.update(normalize_pnr(code).encode("utf-8"))
+    for field in LUGGAGE_FIELDS:
+        h.update(b"\x00" + str(params.get(field, "")).encode("utf-8"))
+    h.update(b"\x00" + datetime.datetime.now().strftime("%Y-%m").encode("ascii"))
+    h.update(b"\x00" + str(airport_version).encode("utf-8"))
+    return h.hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ParseCache:
+    def __init__(self, max_entries=MAX_ENTRIES, persist=None):
+        self.max_entries = max_entries
+        # None follows the module's PERSIST, which share_between_workers may turn on later
+        self._persist = persist
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "shared": 0}
+
+    def get(self, key):
+        """Cached value for key, or None. Checks memory, then the database tier."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return value
+        if not self.persist:
+            return None
+        try:
+            stored = database.get_parse_cache_entry(key)
+        except Exception as e:
+            log.warning(f"Parse cache lookup failed: {e}", extra={"sample": "parse_cache_db"})
+            return None
+        if stored is None:
+            return None
+        value = json.loads(stored)
+        with self._lock:
+            self._stats["db_hits"] += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+            self._puts += 1
+            prune = self._puts % _PRUNE_EVERY == 0
+        if not self.persist:
+            return
+        try:
+            now = time.time()
+            database.put_parse_cache_entry(key, json.dumps(value, ensure_ascii=False), now)
+            if prune:
+                database.prune_parse_cache(now - PERSIST_MAX_AGE)
+        except Exception as e:
+            log.warning(f"Parse cache write failed: {e}", extra={"sample": "parse_cache_db"})
+
+    @property
+    def persist(self):
+        return PERSIST if self._persist is None else self._persist
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns (value, hit). On a miss, compute() returns (value, cacheable);
+        callers arriving while it runs get the same value with hit=True.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value, True
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self._stats["misses"] += 1
+            else:
+                self._stats["shared"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, True
+
+        try:
+            value, cacheable = compute()
+            if cacheable:
+                self.put(key, value)
+            flight.value = value
+            return value, False
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.persist:
+            try:
+                database.clear_parse_cache()
+            except Exception as e:
+                log.warning(f"Parse cache clear failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out["entries"] = len(self._entries)
+        out["capacity"] = self.max_entries
+        out["persist"] = self.persist
+        return out
@@ -0,0 +1,163 @@
+"""
+Single-pass tokenizer for Amadeus PNR text.
+
+tokenize() walks the raw input once. It joins continuation lines onto their
+numbered line and classifies every logical line as it completes, so Logic
+never has to re-scan the text. All patterns are compiled at import time.
+"""
+import re
+from collections import namedtuple
+
+# Record kinds
+NAME = "name"
+SEGMENT = "segment"
+SSR_DOCS = "ssr_docs"
+FA_PAX = "fa_pax"
+OTHER = "other"
+
+MONTHS = ("JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC")
+MONTH_NUMS = {m: i + 1 for i, m in enumerate(MONTHS)}
+
+_SEQUENCE_RE = re.compile(r'\d')
+_MONTH_RE = re.compile("|".join(MONTHS))
+_TIME_RE = re.compile(r'\d{4}(?:\+\d)?$')
+_DIGITS_RE = re.compile(r'\d+')
+
+# kind: one of the constants above
+# line: the merged logical line; parts: line.split()
+# month: first month number on a flight-like line (used to pick the base year)
+# payload: tuple of names (NAME) or a Segment (SEGMENT, None if incomplete)
+# error: why a SEGMENT line could not be read
+Record = namedtuple("Record", "kind line parts month payload error", defaults=(None, None, None))
+
+Segment = namedtuple("Segment", "flight_id date_str day month origin dest start end next_day")
+
+
+def merge_lines(text):
+    """Yields logical lines: numbered lines with their continuation lines appended."""
+    pending = None
+    for raw in text.split("\n"):
+        line = raw.strip()
+        if not line:
+            continue
+        if _SEQUENCE_RE.match(line):
+            if pending is not None:
+                yield " ".join(pending)
+            pending = [line]
+        elif pending is not None:
+            pending.append(line)
+        else:
+            pending = [line]
+    if pending is not None:
+        yield " ".join(pending)
+
+
+def contain_month(text):
+    return _MONTH_RE.search(text) is not None
+
+
+def split_names(line):
+    """Passenger names from a name line such as '1.DOE/JOHN MR 2.DOE/JANE'."""
+    names = []
+    for part in line.split(".")[1:]:
+        name = _DIGITS_RE.sub('', part).strip()
+        if name:
+            names.append(name)
+    return tuple(names)
+
+
+def _token_month(token):
+    # Calendar order wins when a token holds more than one month name
+    for m in MONTHS:
+        if m in token:
+            return MONTH_NUMS[m]
+    return None
+
+
+def parse_segment(parts):
+    """
+    Reads an itinerary segment from a split line, e.g.
+    ['2', 'CA', '908', 'L', '10APR', '3', 'ULNPEK', 'HK1', '1', '1310', '0600+1'].
+    Returns a Segment, or None when the line has no route or times.
+    Raises ValueError for lines that look like segments but are truncated.
+    """
+    date_idx = -1
+    for i, part in enumerate(parts):
+        if _MONTH_RE.search(part):
+            date_idx = i
+            break
+    if date_idx == -1:
+        return None
+    if len(parts) < 3:
+        raise ValueError("segment has no flight number")
+
+    ori_des_idx = date_idx + 2
+    if ori_des_idx >= len(parts):
+        return None
+
+    time_idx = -1
+    for i in range(ori_des_idx + 1, len(parts)):
+        if _TIME_RE.match(parts[i]):
+            time_idx = i
+            break
+    if time_idx == -1:
+        return None
+    if time_idx + 1 >= len(parts):
+        raise ValueError("segment has no arrival time")
+
+    date_str = parts[date_idx]
+    ori_des = parts[ori_des_idx]
+    end = parts[time_idx + 1]
+    next_day = "+" in end
+    if next_day:
+        end = end.split("+")[0]
+
+    month_num = MONTH_NUMS.get(date_str[2:])
+    return Segment(
+        flight_id=parts[1] + parts[2],
+        date_str=date_str,
+        day=date_str[:2],
+        month=f"{month_num:02d}" if month_num else "-1",
+        origin=ori_des[:3],
+        dest=ori_des[3:],
+        start=parts[time_idx],
+        end=end,
+        next_day=next_day,
+    )
+
+
+def tokenize(text):
+    """Yields one Record per logical line of text, in input order."""
+    passenger_mode = True
+    for line in merge_lines(text):
+        parts = line.split()
+        has_ssr = "SSR" in line
+        has_fa = "FA" in line
+
+        month = None
+        month_match = None
+        if not has_ssr and not has_fa:
+            month_match = _MONTH_RE.search(line)
+            if month_match:
+                for part in parts:
+                    if _MONTH_RE.search(part):
+                        month = _token_month(part)
+                        break
+
+        if passenger_mode and "." in line and not has_ssr and not has_fa:
+            if "." in parts[0]:
+                yield Record(NAME, line, parts, month, split_names(line))
+                continue
+            passenger_mode = False
+
+        if has_ssr and "DOCS" in line:
+            yield Record(SSR_DOCS, line, parts, month)
+        elif has_fa and "PAX" in line:
+            yield Record(FA_PAX, line, parts, month)
+        elif month_match:
+            try:
+                yield Record(SEGMENT, line, parts, month, parse_segment(parts))
+            except ValueError as e:
+                yield Record(SEGMENT, line, parts, month, None, str(e))
+        else:
+            yield Record(OTHER, line, parts, month)
@@ -1,31 +1,141 @@
-from flask import Flask, render_template, request, jsonify
-import importlib.util
-from pyngrok import ngrok
+import time
+# Startup phases below are measured from here
+_started = time.perf_counter()
+
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g, send_file
 import sys
+import io
 import os
+import re
+import json
 import datetime
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 load_dotenv()
 
+import database  # reads DATABASE_URL, so import after load_dotenv()
+from airport_lookup import LookupQueue, LOOKUP_WORKERS
+from history_writer import HistoryWriter
+import parse_cache
+from batch_worker import build_process_result, public_flight
+import batch_worker
+import metrics
+import applog
+
+log = applog.get_logger("server")
+
+# Fill the caches before serving (see warmup()); BILLETE_WARMUP=0 skips it
+WARMUP = os.getenv("BILLETE_WARMUP", "1").strip().lower() in ("1", "true", "yes", "on")
+# Startup phase -> milliseconds, reported by /ready and /metrics
+startup = {}
+_ready = False
+
+def _mark(phase, since):
+    now = time.perf_counter()
+    startup[phase] = round((now - since) * 1000, 1)
+    return now
+
 app = Flask(__name__, template_folder=os.path.join(os.path.dirname(__file__), 'templates'))
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 app.jinja_env.auto_reload = True
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
-# Force-load local logic.py to avoid importing an unrelated module named 'logic'
-_logic_path = os.path.join(os.path.dirname(__file__), "logic.py")
-_spec = importlib.util.spec_from_file_location("billete_logic", _logic_path)
-_mod = importlib.util.module_from_spec(_spec)
-_spec.loader.exec_module(_mod)
+_t = _mark("imports", _started)
+
+database.init_db()
+_t = _mark("init_db", _t)
+
+import logic as _mod
+# Refuse an unrelated module named 'logic' that shadows ours on sys.path
+_logic_path = os.path.abspath(_mod.__file__)
+if os.path.dirname(_logic_path) != os.path.dirname(os.path.abspath(__file__)):
+    raise ImportError(f"'logic' resolved to {_logic_path}, not the one next to server.py")
 Logic = _mod.Logic
 logic = Logic()
-print(f" * Logic loaded from: {_logic_path}")
-print(f" * Logic module name: {_mod.__name__}")
+# Online airport lookups run in the background so /process never waits on the network
+# (BILLETE_LOOKUP_WORKERS=0 resolves them inline instead)
+if LOOKUP_WORKERS > 0:
+    logic.lookup_queue = LookupQueue(logic)
+# History rows from /process are written in batches off the request path
+logic.history_writer = HistoryWriter()
+# Repeated PNRs (re-pastes, history restores) are served from here
+result_cache = parse_cache.ParseCache()
+_mark("logic", _t)
+log.info(f"Logic loaded from: {_logic_path} (module {_mod.__name__})")
+
+@app.before_request
+def _start_timing():
+    g.request_started = time.perf_counter()
+    metrics.begin_request()
+
+@app.after_request
+def _finish_timing(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    metrics.record_request(request.endpoint or 'unmatched', response.status_code, elapsed)
+    timings = metrics.end_request()
+    if request.endpoint == 'process':
+        timings['total'] = elapsed
+        response.headers['Server-Timing'] = metrics.server_timing(timings)
+    return response
 
 @app.route('/')
 def home():
     return render_template('index.html')
 
+def process_code(code, data):
+    """
+    Parses code with the luggage fields in data, through the result cache.
+    Returns (cached, hit, parse_id); cached has body, pax_str and route_str.
+    """
+    def compute():
+        # Parse without touching shared state so concurrent requests don't mix
+        itinerary = logic.parse(code)
+        body, pax_str, route_str = build_process_result(itinerary, data)
+        # Results still waiting on airport lookups will change; don't keep them
+        cacheable = not body['pending_airports']
+        cached = {'body': body, 'pax_str': pax_str, 'route_str': route_str}
+        if data.get('record_history', True):
+            # /process writes its history row next; stored with the result so a
+            # hit in any worker (database tier) knows it has one
+            cached['history_version'] = logic.get_history_version()
+        return cached, cacheable
+
+    version = logic.sync_airport_map()
+    parse_id = parse_cache.make_key(code, data, version)
+    cached, hit = result_cache.get_or_compute(parse_id, compute)
+    if not hit and logic.airport_map_version != version and not cached['body']['pending_airports']:
+        # The parse stored airport names itself, so the next request for this
+        # PNR computes its key from the new version; keep the result there
+        parse_id = parse_cache.make_key(code, data, logic.airport_map_version)
+        result_cache.put(parse_id, cached)
+    return cached, hit, parse_id
+
+def record_history(code, cached, hit=False):
+    """
+    Queues the history row for a /process result. A cache hit already has its
+    row unless history was cleared since (by any worker), so it is skipped.
+    The writer may not flush the row before the page reloads its list, so
+    this returns the response fields that let the page show it right away:
+    the row's list fields and today's count including the rows still queued
+    in this worker. Timed as the request's "history" stage.
+    """
+    t0 = time.perf_counter()
+    fields = {}
+    history_version = logic.get_history_version()
+    if not hit or cached.get('history_version') != history_version:
+        entry = logic.save_to_history(code, cached['body']['result'], cached['pax_str'], cached['route_str'])
+        cached['history_version'] = history_version
+        if entry is not None:
+            fields['history'] = {k: entry[k] for k in ('timestamp', 'passenger_info', 'route_info')}
+    fields['today_count'] = logic.get_today_count() + logic.history_writer.depth()
+    metrics.record_stage('history', time.perf_counter() - t0)
+    return fields
+
 @app.route('/process', methods=['POST'])
 def process():
     try:
@@ -33,64 +143,146 @@ def process():
         code = data.get('code', '')
         if not code:
             return jsonify({'error': 'No code provided'}), 400
-            
-        # Use logic to process (source text)
-        # logic.process() returns the formatted text string
-        result_text = logic.process(code)
-        
-        # Append Luggage
-        hand_count = data.get('hand_count', '1')
-        hand_weight = data.get('hand_weight', '8')
-        pack_count = data.get('pack_count', '2')
-        pack_weight = data.get('pack_weight', '23')
-        
-        luggage_info = f"\n经济舱往返 欧\n托运行李{pack_count} 件,每件{pack_weight}公斤\n手提行李{hand_count}件{hand_weight} 公斤\n"
-        final_result = result_text + luggage_info
-        
-        # If result is suspiciously empty (only luggage), append debug logs
-        if not result_text.strip() and logic.logs:
-             final_result += "\n\n[Debug Logs (Render Fix)]:\n" + "\n".join(logic.logs)
-        
-        # Construct route string for history
-        route_str = ""
-        if logic.flights:
-            if len(logic.flights) == 1:
-                route_str = f"{logic.flights[0]['origin']}-{logic.flights[0]['dest']}"
-            else:
-                full_path = [logic.flights[0]['origin']]
-                for f in logic.flights:
-                    full_path.append(f['dest'])
-                route_str = "-".join(full_path)
 
-        # Extract passengers string for history
-        pax_names = [p['name'] for p in logic.passengers]
-        pax_str = ", ".join(pax_names)
+        cached, hit, parse_id = process_code(code, data)
+        body = cached['body']
 
-        # Save to history
-        logic.save_to_history(code, final_result, pax_str, route_str)
-        
-        return jsonify({
-            'result': final_result,
-            'structured': {
-                'passengers': [p['name'] for p in logic.passengers],
-                'flights': logic.flights,
-                'layovers': logic.layovers,
-                'luggage': {
-                    'hand_count': hand_count,
-                    'hand_weight': hand_weight,
-                    'pack_count': pack_count,
-                    'pack_weight': pack_weight
-                }
-            }
-        })
+        response = {**body, 'parse_id': parse_id, 'cached': hit}
+        # Save to history (skipped when the client re-renders after airport lookups)
+        if data.get('record_history', True):
+            response.update(record_history(code, cached, hit))
+
+        return jsonify(response)
 
     except Exception as e:
-        print(f"Error in process: {e}")
+        log.exception(f"Error in process: {e}", extra={"sample": "process_error"})
         return jsonify({'error': str(e)}), 500
 
+# --- Batch processing ---
+# Items are parsed in batch_worker processes, each with its own Logic. They
+# are started by a forkserver (spawn where that isn't available), never
+# forked from this threaded worker: a fork taken while another thread holds
+# a metrics, logging or pool lock would leave that lock held forever in the
+# child.
+BATCH_MAX_ITEMS = int(os.getenv("BILLETE_BATCH_MAX_ITEMS", "1000"))
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+
+def pool_context():
+    """The multiprocessing context for process pools created after startup."""
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+def get_batch_pool():
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            workers = int(os.getenv("BILLETE_BATCH_WORKERS", "0")) or None
+            # Lookups for pending codes go on this worker's queue, or run in the pool without one
+            _batch_pool = ProcessPoolExecutor(max_workers=workers, initializer=batch_worker.init,
+                                              initargs=(logic.lookup_queue is not None,),
+                                              mp_context=pool_context())
+        return _batch_pool
+
+@app.route('/process/batch', methods=['POST'])
+def process_batch():
+    """
+    Accepts {"items": [<code> | {"code": ..., "hand_count": ...}, ...]} with
+    optional top-level luggage defaults, and streams one NDJSON line per item
+    as it finishes, followed by a summary line. History rows are collected
+    as items finish and written in one transaction when the stream ends,
+    also when the client disconnects early.
+    """
+    data = request.json or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'No items provided'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Too many items (max {BATCH_MAX_ITEMS})'}), 413
+
+    defaults = {k: data[k] for k in ('hand_count', 'hand_weight', 'pack_count', 'pack_weight') if k in data}
+    jobs = []
+    for item in items:
+        if isinstance(item, str):
+            item = {'code': item}
+        elif not isinstance(item, dict):
+            item = {}
+        jobs.append({**defaults, **item})
+
+    def generate():
+        pool = get_batch_pool()
+        futures = {}
+        rows = []
+        failed = 0
+        airport_version = logic.sync_airport_map()
+        history_version = logic.get_history_version()
+        try:
+            for index, job in enumerate(jobs):
+                if not job.get('code'):
+                    failed += 1
+                    yield json.dumps({'index': index, 'error': 'No code provided'}, ensure_ascii=False) + "\n"
+                    continue
+                futures[pool.submit(batch_worker.process_item, job)] = index
+
+            for fut in as_completed(futures):
+                index = futures[fut]
+                try:
+                    body, pax_str, route_str = fut.result()
+                except Exception as e:
+                    failed += 1
+                    yield json.dumps({'index': index, 'error': str(e)}, ensure_ascii=False) + "\n"
+                    continue
+
+                # Cached here so the batch's parse_ids work with /download_ics
+                parse_id = parse_cache.make_key(jobs[index]['code'], jobs[index], airport_version)
+                if not body['pending_airports']:
+                    # With its history row, so re-pasting the PNR into /process doesn't add another
+                    result_cache.put(parse_id, {'body': body, 'pax_str': pax_str, 'route_str': route_str,
+                                                'history_version': history_version})
+
+                if logic.lookup_queue is not None:
+                    for code in body['pending_airports']:
+                        logic.lookup_queue.submit(code)
+                rows.append({'code': jobs[index]['code'], 'result': body['result'],
+                             'passenger_info': pax_str, 'route_info': route_str})
+                yield json.dumps({'index': index, 'parse_id': parse_id, **body}, ensure_ascii=False) + "\n"
+        finally:
+            # Client went away: don't keep the pool busy with queued items
+            for fut in futures:
+                fut.cancel()
+            saved = logic.save_many_to_history(rows)
+
+        yield json.dumps({'done': True, 'total': len(jobs), 'failed': failed, 'saved': saved}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+HISTORY_PAGE_MAX = 200
+
 @app.route('/history', methods=['GET'])
 def get_history():
-    return jsonify(logic.get_history())
+    """
+    One page of the history list, newest first, without code/result bodies.
+    ?limit=N (default 50) and ?before_id=<next_before_id from the previous page>.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), HISTORY_PAGE_MAX)
+        before_id = request.args.get('before_id')
+        before_id = int(before_id) if before_id else None
+    except ValueError:
+        return jsonify({'error': 'limit and before_id must be integers'}), 400
+
+    items = logic.get_history(limit=limit, before_id=before_id)
+    return jsonify({
+        'items': items,
+        'next_before_id': items[-1]['id'] if len(items) == limit else None
+    })
+
+@app.route('/history/<int:entry_id>', methods=['GET'])
+def get_history_entry(entry_id):
+    entry = logic.get_history_entry(entry_id)
+    if entry is None:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(entry)
 
 @app.route('/history', methods=['DELETE'])
 def clear_history():
@@ -100,11 +292,71 @@ def clear_history():
     else:
         return jsonify({'error': 'Failed to clear history'}), 500
 
+def metrics_extra():
+    """Values read at scrape time for metrics.render (also used by asgi.py)."""
+    extra = []
+    resolution = logic.resolution_cache.stats()
+    for tier, hits in resolution['hits'].items():
+        extra.append(('billete_airport_resolutions_total', 'counter',
+                      'Airport codes resolved, by tier', {'tier': tier}, hits))
+    extra.append(('billete_airport_resolutions_total', 'counter',
+                  'Airport codes resolved, by tier', {'tier': 'negative_cache'}, resolution['negative_hits']))
+    extra.append(('billete_airport_resolutions_total', 'counter',
+                  'Airport codes resolved, by tier', {'tier': 'unresolved'}, resolution['misses']))
+
+    for key, value in result_cache.stats().items():
+        if key in ('memory_hits', 'db_hits', 'misses', 'shared'):
+            extra.append(('billete_parse_cache_total', 'counter',
+                          'Parse cache lookups by outcome', {'outcome': key}, value))
+    extra.append(('billete_parse_cache_entries', 'gauge', 'Entries in the in-memory parse cache',
+                  {}, result_cache.stats()['entries']))
+
+    writer = logic.history_writer.stats()
+    extra.append(('billete_history_queue_depth', 'gauge', 'History rows waiting to be written', {}, writer['depth']))
+    extra.append(('billete_history_spool_bytes', 'gauge', 'Size of the history spool file', {}, writer['spool_bytes']))
+    extra.append(('billete_history_last_flush_ms', 'gauge', 'Duration of the last history flush', {}, writer['last_flush_ms']))
+    for key in ('written', 'spooled', 'replayed', 'failed_batches'):
+        extra.append(('billete_history_rows_total', 'counter',
+                      'History writer rows and batches by outcome', {'outcome': key}, writer[key]))
+
+    for phase, ms in startup.items():
+        extra.append(('billete_startup_seconds', 'gauge', 'Time spent starting the app, by phase',
+                      {'phase': phase}, ms / 1000))
+
+    # The render pool is only started by the first /docs or /card request
+    docs = _doc_jobs.stats() if _doc_jobs is not None else {'pending': 0, 'rendered': 0, 'cache_hits': 0, 'failed': 0}
+    extra.append(('billete_docs_pending', 'gauge', 'Documents being rendered by this worker', {}, docs['pending']))
+    for key in ('rendered', 'cache_hits', 'failed'):
+        extra.append(('billete_docs_total', 'counter', 'Document requests by outcome', {'outcome': key}, docs[key]))
+
+    logging_stats = applog.stats()
+    extra.append(('billete_log_records_lost_total', 'counter', 'Log records not written, by reason',
+                  {'reason': 'queue_full'}, logging_stats['dropped']))
+    extra.append(('billete_log_records_lost_total', 'counter', 'Log records not written, by reason',
+                  {'reason': 'sampled'}, logging_stats['suppressed']))
+    return extra
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text format; values are for the worker that answers."""
+    return Response(metrics.render(metrics_extra()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/process/cache', methods=['GET'])
+def process_cache_stats():
+    """Hit/miss counters of the parse result cache."""
+    return jsonify(result_cache.stats())
+
+@app.route('/history/writer', methods=['GET'])
+def history_writer_stats():
+    """Queue depth, flush latency and spool size of the write-behind history writer."""
+    return jsonify(logic.history_writer.stats())
+
 @app.route('/stats', methods=['GET'])
 def get_stats():
     try:
         count = logic.get_today_count()
-        response = jsonify({'today_count': count})
+        # Rows still waiting in the write-behind queue aren't in today_count yet
+        response = jsonify({'today_count': count, 'history_pending': logic.history_writer.depth()})
         response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
         return response
     except Exception as e:
@@ -113,7 +365,17 @@ def get_stats():
 @app.route('/airports', methods=['GET', 'POST', 'DELETE'])
 def manage_airports():
     if request.method == 'GET':
-        return jsonify(logic.load_airport_map())
+        # The ETag is the database airport version, so an unchanged map costs
+        # one primary-key read and a 304
+        version = logic.sync_airport_map(force=True)
+        etag = f"airports-{version}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify(dict(logic.airport_map))
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
     
     if request.method == 'POST':
         data = request.json
@@ -136,48 +398,87 @@ def manage_airports():
         else:
              return jsonify({'error': 'Failed to delete'}), 500
 
+@app.route('/airports/changes', methods=['GET'])
+def airport_changes():
+    """Upserts and deletes since ?since=<version>, for clients that cache the map."""
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'since must be an integer'}), 400
+    return jsonify(database.get_airport_changes(since))
+
+@app.route('/airports/lookups', methods=['GET'])
+def airport_lookups():
+    """Status of background lookups, e.g. /airports/lookups?codes=ULN,XYZ"""
+    codes = [c.strip() for c in request.args.get('codes', '').split(',') if c.strip()]
+    if not codes:
+        return jsonify({'error': 'No codes provided'}), 400
+    if logic.lookup_queue is None:
+        # Inline lookups: nothing is ever pending, but another worker may have stored the name
+        logic.sync_airport_map(force=True)
+        return jsonify({
+            code.upper(): {'status': 'resolved', 'name': logic.airport_map[code.upper()]}
+            if code.upper() in logic.airport_map else {'status': 'unresolved'}
+            for code in codes
+        })
+    return jsonify(logic.lookup_queue.status(codes))
+
+@app.route('/airports/cache', methods=['GET'])
+def airport_cache_stats():
+    # Resolution counters for this worker
+    return jsonify(logic.resolution_cache.stats())
+
 @app.route('/airports/import', methods=['POST'])
 def import_airports():
+    """
+    Imports a CODE:Name text file in one transaction. The upload is read
+    line by line; the response carries a summary and the diff, not the map.
+    """
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file uploaded'}), 400
         
         file = request.files['file']
-        content = file.read().decode('utf-8', errors='ignore')
+        stream = io.TextIOWrapper(file.stream, encoding='utf-8-sig', errors='ignore')
         
         total = 0
-        inserted = 0
+        entries = {}
         skipped = []
         
-        for raw_line in content.splitlines():
+        for raw_line in stream:
             line = raw_line.strip()
             if not line:
                 continue
+            total += 1
             if ":" not in line:
-                skipped.append(f"Invalid format: {raw_line}")
+                skipped.append(f"Invalid format: {line}")
                 continue
             code, name = line.split(":", 1)
             code = code.strip().upper()
             name = name.strip()
             if not code or not name:
-                skipped.append(f"Missing code or name: {raw_line}")
+                skipped.append(f"Missing code or name: {line}")
                 continue
-            try:
-                logic.update_airport(code, name)
-                inserted += 1
-            except Exception as e:
-                skipped.append(f"DB error for {code}: {e}")
-            finally:
-                total += 1
+            # Later lines win when a code repeats
+            entries[code] = name
         
-        latest_map = logic.load_airport_map()
+        diff = logic.import_airports(entries)
         
         return jsonify({
             'success': True,
             'total': total,
-            'inserted': inserted,
-            'skipped': skipped,
-            'map': latest_map
+            'summary': {
+                'inserted': len(diff['inserted']),
+                'updated': len(diff['updated']),
+                'unchanged': len(diff['unchanged']),
+                'skipped': len(skipped)
+            },
+            'diff': {
+                'inserted': diff['inserted'],
+                'updated': diff['updated'],
+                'unchanged': diff['unchanged'],
+                'skipped': skipped
+            }
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -195,7 +496,6 @@ def export_airports():
         content = "\n".join(lines)
         
         # Create a response with the content
-        from flask import Response
         return Response(
             content,
             mimetype="text/plain",
@@ -204,29 +504,314 @@ def export_airports():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/download_ics', methods=['GET'])
+ICS_MAX_HISTORY = int(os.getenv("BILLETE_ICS_MAX_HISTORY", "1000"))
+
+def history_entry_flights(code, timestamp):
+    """
+    The public flights of a stored PNR. Years are guessed from the day the row
+    was saved, not today, and the parse skips the result cache and online
+    lookups: one export can touch many old rows.
+    """
+    try:
+        saved = datetime.datetime.strptime(str(timestamp)[:19], "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        saved = None
+    itinerary = logic.parse(code, today=saved, lookups=False)
+    return [public_flight(f) for f in itinerary.flights]
+
+def _history_flights(first_id, last_id):
+    """Re-parses history rows in [first_id, last_id] (at most ICS_MAX_HISTORY), yielding flight lists."""
+    remaining = ICS_MAX_HISTORY
+    while remaining > 0:
+        rows = database.get_history_codes(first_id, last_id, limit=min(100, remaining))
+        if not rows:
+            return
+        for _, code, timestamp in rows:
+            try:
+                flights = history_entry_flights(code, timestamp)
+            except Exception as e:
+                log.warning(f"ICS: failed to parse history entry: {e}", extra={"sample": "ics_history"})
+                continue
+            yield flights
+        remaining -= len(rows)
+        last_id = rows[-1][0] - 1
+
+_ICS_TIME = re.compile(r'^\d{8}T\d{6}Z$')
+
+def ics_flight(flight):
+    """
+    A posted flight reduced to the fields a calendar event uses. Raises
+    ValueError unless id, origin and dest are single-line text and
+    utc_start/utc_end are empty (no event) or UTC stamps like 20270410T051000Z.
+    """
+    if not isinstance(flight, dict):
+        raise ValueError('each flight must be an object')
+    out = {}
+    for key in ('id', 'origin', 'dest'):
+        value = flight.get(key)
+        if isinstance(value, bool) or not isinstance(value, (str, int)) \
+                or not str(value).strip() or '\n' in str(value) or '\r' in str(value):
+            raise ValueError(f'flight {key} must be a non-empty single line')
+        out[key] = str(value)
+    for key in ('utc_start', 'utc_end'):
+        value = flight.get(key) or ''
+        if not isinstance(value, str) or (value and not _ICS_TIME.match(value)):
+            raise ValueError(f'flight {key} must look like 20270410T051000Z')
+        out[key] = value
+    return out
+
+def posted_ics_flights(data):
+    """The flight lists posted to /download_ics as {flights} or {itineraries}, checked by ics_flight."""
+    posted = []
+    if isinstance(data.get('flights'), list):
+        posted.append(data['flights'])
+    for itinerary in data.get('itineraries') or []:
+        if isinstance(itinerary, dict) and isinstance(itinerary.get('flights'), list):
+            posted.append(itinerary['flights'])
+    return [[ics_flight(f) for f in flights] for flights in posted]
+
+@app.route('/download_ics', methods=['GET', 'POST'])
 def download_ics():
+    """
+    Streams one calendar built from any mix of:
+      parse_id                    ids from /process or /process/batch (repeat or comma-separate)
+      history_from, history_to    an inclusive range of history ids, re-parsed
+      POST JSON                   {"flights": [...]}, {"itineraries": [{"flights": [...]}, ...]}
+                                  and/or {"parse_ids": [...]}
+    """
+    data = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+
+    parse_ids = [p.strip() for arg in request.args.getlist('parse_id') for p in arg.split(',') if p.strip()]
+    parse_ids += [p for p in data.get('parse_ids') or [] if isinstance(p, str)]
+
+    flight_lists = []
+    missing = []
+    for parse_id in parse_ids:
+        cached = result_cache.get(parse_id)
+        if cached is None:
+            missing.append(parse_id)
+        else:
+            flight_lists.append(cached['body']['structured']['flights'])
+    if missing:
+        return jsonify({'error': 'Unknown or expired parse_id', 'parse_ids': missing}), 404
+
+    # Checked before the response starts, so a bad flight can't cut the stream short
     try:
-        ics_content = logic.generate_ics()
-        if not ics_content:
-             return jsonify({'error': 'No flight data to generate ICS'}), 400
-             
-        from flask import Response
-        return Response(
-            ics_content,
-            mimetype="text/calendar",
-            headers={"Content-disposition": "attachment; filename=itinerary.ics"}
-        )
+        flight_lists += posted_ics_flights(data)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid flight: {e}'}), 400
+
+    history = None
+    if 'history_from' in request.args or 'history_to' in request.args:
+        try:
+            first_id = int(request.args.get('history_from', 1))
+            last_id = int(request.args['history_to']) if 'history_to' in request.args else 2 ** 62
+        except ValueError:
+            return jsonify({'error': 'history_from/history_to must be integers'}), 400
+        history = _history_flights(first_id, last_id)
+    elif not any(f.get('utc_start') and f.get('utc_end') for flights in flight_lists for f in flights):
+        return jsonify({'error': 'No flight data to generate ICS'}), 400
+
+    def sources():
+        yield from flight_lists
+        if history is not None:
+            yield from history
+
+    return Response(
+        stream_with_context(logic.iter_ics(sources())),
+        mimetype="text/calendar",
+        headers={"Content-disposition": "attachment; filename=itinerary.ics"}
+    )
+
+# --- Itinerary documents (PDF / Word) ---
+# docgen and card_image (Pillow, reportlab, python-docx) are imported on first
+# use, so a worker that only parses doesn't load them
+_doc_jobs = None
+_doc_jobs_lock = threading.Lock()
+
+def get_doc_jobs():
+    global _doc_jobs
+    with _doc_jobs_lock:
+        if _doc_jobs is None:
+            import docgen
+            _doc_jobs = docgen.DocJobs()
+        return _doc_jobs
+# docgen's BILLETE_DOCS_WORKERS=0, read here so warmup needn't import docgen
+DOCS_IN_PROCESS = os.getenv("BILLETE_DOCS_WORKERS", "2").strip() == "0"
+DOCS_BATCH_MAX_ITEMS = int(os.getenv("BILLETE_DOCS_BATCH_MAX_ITEMS", "200"))
+
+def _doc_data(item):
+    """
+    The docgen.itinerary_data for one request item, which is one of
+      {"parse_id": ...}                      a result from /process or /process/batch
+      {"code": ..., "hand_count": ...}       a PNR, parsed here
+      {"passengers": [...], "flights": [...], "layovers": [...], "luggage": {...}}
+    "passengers" (names or {name, passport, ticket}) also replaces the
+    parsed passengers of the first two forms. Raises LookupError for an
+    unknown parse_id and ValueError for anything else unusable.
+    """
+    import docgen
+    if not isinstance(item, dict):
+        raise ValueError('Each item must be an object')
+    if item.get('parse_id'):
+        cached = result_cache.get(item['parse_id'])
+        if cached is None:
+            raise LookupError(item['parse_id'])
+        source = cached['body']['structured']
+        passengers = source['passengers']
+        flights, layovers, luggage = source['flights'], source['layovers'], source['luggage']
+    elif item.get('code'):
+        itinerary = logic.parse(item['code'])
+        passengers, flights, layovers = itinerary.passengers, itinerary.flights, itinerary.layovers
+        luggage = item
+    else:
+        passengers = item.get('passengers') or []
+        flights, layovers = item.get('flights') or [], item.get('layovers') or []
+        luggage = item.get('luggage') or {}
+    if isinstance(item.get('passengers'), list):
+        passengers = item['passengers']
+    if not isinstance(flights, (list, tuple)) or not flights:
+        raise ValueError('No flight data to generate a document')
+    return docgen.itinerary_data(passengers, flights, layovers, luggage)
+
+def _doc_job(job_id):
+    status = get_doc_jobs().status(job_id)
+    status['status_url'] = f"/docs/{job_id}"
+    if status['status'] == 'done':
+        status['download_url'] = f"/docs/{job_id}/download"
+    return status
+
+@app.route('/docs', methods=['POST'])
+def submit_doc():
+    """
+    Queues one itinerary document; takes a /docs item (see _doc_data) plus
+    "format": "pdf" (default), "docx" or "png". Answers 200 when the document is
+    already cached, else 202; poll status_url until it is done.
+    """
+    import docgen
+    data = request.get_json(silent=True) or {}
+    fmt = data.get('format', 'pdf')
+    if fmt not in docgen.FORMATS:
+        return jsonify({'error': f'format must be one of {", ".join(docgen.FORMATS)}'}), 400
+    try:
+        doc = _doc_data(data)
+    except LookupError as e:
+        return jsonify({'error': 'Unknown or expired parse_id', 'parse_ids': [str(e.args[0])]}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    job = _doc_job(get_doc_jobs().submit(doc, fmt))
+    job['filename'] = docgen.document_name(doc, fmt)
+    return jsonify(job), 200 if job['status'] == 'done' else 202
+
+@app.route('/docs/<job_id>', methods=['GET'])
+def doc_status(job_id):
+    job = _doc_job(job_id)
+    return jsonify(job), 404 if job['status'] == 'unknown' else 200
+
+@app.route('/docs/<job_id>/download', methods=['GET'])
+def download_doc(job_id):
+    """The finished document; ?name= sets the file name offered to the browser."""
+    import docgen
+    path = get_doc_jobs().path(job_id)
+    if path is None:
+        job = _doc_job(job_id)
+        return jsonify(job), 409 if job['status'] == 'pending' else 404
+    fmt = job_id.rsplit('.', 1)[1]
+    name = os.path.basename(request.args.get('name', '')) or f"itinerary.{fmt}"
+    return send_file(path, mimetype=docgen.MIMETYPES[fmt], as_attachment=True,
+                     download_name=name, max_age=31536000)
+
+CARD_TIMEOUT = float(os.getenv("BILLETE_CARD_TIMEOUT", "30"))
+
+def render_card(item):
+    """
+    Draws (or finds in the docgen cache) the PNG card for a /docs item.
+    Returns (path, file name); raises like _doc_data. Cards show the date,
+    so each itinerary is drawn once a day. Also used by asgi.py.
+    """
+    import docgen
+    doc = _doc_data(item)
+    doc['date'] = datetime.date.today().isoformat()
+    t0 = time.perf_counter()
+    path = get_doc_jobs().render(doc, 'png', timeout=CARD_TIMEOUT)
+    metrics.record_stage('card', time.perf_counter() - t0)
+    return path, docgen.document_name(doc, 'png')
+
+@app.route('/card', methods=['GET', 'POST'])
+def itinerary_card():
+    """The itinerary card as a PNG: GET ?parse_id=..., or POST a /docs item such as /process's "structured"."""
+    item = request.get_json(silent=True) if request.method == 'POST' else {'parse_id': request.args.get('parse_id')}
+    try:
+        path, name = render_card(item)
+    except LookupError as e:
+        return jsonify({'error': 'Unknown or expired parse_id', 'parse_ids': [str(e.args[0])]}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
+        log.exception(f"Error rendering card: {e}", extra={"sample": "card_error"})
         return jsonify({'error': str(e)}), 500
+    return send_file(path, mimetype='image/png', max_age=3600, download_name=name)
+
+@app.route('/docs/batch', methods=['POST'])
+def download_docs_batch():
+    """
+    Streams a ZIP of documents for {"items": [<item>, ...], "format": "pdf" |
+    "docx" | "both"}. All items are queued at once and the ZIP is written in
+    item order as they finish; documents that fail are listed in errors.txt.
+    """
+    import docgen
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'No items provided'}), 400
+    if len(items) > DOCS_BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Too many items (max {DOCS_BATCH_MAX_ITEMS})'}), 413
+    fmt = data.get('format', 'pdf')
+    formats = docgen.DOC_FORMATS if fmt == 'both' else (fmt,)
+    if not set(formats) <= set(docgen.FORMATS):
+        return jsonify({'error': 'format must be pdf, docx or both'}), 400
+
+    entries = []
+    missing = []
+    for index, item in enumerate(items):
+        try:
+            doc = _doc_data(item)
+        except LookupError as e:
+            missing.append(str(e.args[0]))
+            continue
+        except ValueError as e:
+            return jsonify({'error': f'Item {index}: {e}'}), 400
+        for f in formats:
+            entries.append((f"{index + 1:03d}_{docgen.document_name(doc, f)}", doc, f))
+    if missing:
+        return jsonify({'error': 'Unknown or expired parse_id', 'parse_ids': missing}), 404
+
+    return Response(
+        stream_with_context(docgen.iter_zip(get_doc_jobs(), entries)),
+        mimetype="application/zip",
+        headers={"Content-disposition": "attachment; filename=itineraries.zip"}
+    )
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 503 until warmup is done or while the database is unreachable."""
+    if not _ready:
+        return jsonify({'ready': False}), 503
+    try:
+        database.get_airport_version()
+    except Exception as e:
+        return jsonify({'ready': False, 'error': str(e)}), 503
+    return jsonify({'ready': True, 'pid': os.getpid(), 'startup_ms': startup})
 
 @app.route('/version', methods=['GET'])
 def version():
     # Simple health/version info
     return jsonify({
         "module": _mod.__name__,
-        "path": _logic_path,
-        "has_year_field": any('year' in f for f in logic.flights) if logic.flights else False
+        "path": _logic_path
     })
 
 @app.route('/template_info', methods=['GET'])
@@ -239,12 +824,55 @@ def template_info():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# A typical two-segment PNR on codes the offline index knows, so warmup
+# never waits on (or queues) an online lookup
+_WARMUP_PNR = """1.LI/MEI
+  2  CA 908 L 15AUG 5 MADPEK HK1       1  1200 0530+1
+  3  MU 5101 L 16AUG 1 PEKSHA HK1       1  0900 1115
+"""
+
+def warmup():
+    """
+    Does once what the first requests would otherwise pay for: maps the airport
+    index, loads time zones and compiles the parse and render paths, renders the
+    page template and reads today's count. Under gunicorn with preload_app it
+    runs in the master, so every forked worker starts warm.
+    """
+    global _ready
+    t0 = time.perf_counter()
+    try:
+        itinerary = logic.parse(_WARMUP_PNR)
+        build_process_result(itinerary, {})
+        with app.test_request_context('/'):
+            render_template('index.html')
+        logic.get_today_count()
+        # Render pool processes load fonts and styles themselves (docgen.preload);
+        # only in-process rendering needs them here
+        if DOCS_IN_PROCESS:
+            import docgen
+            docgen.preload()
+    except Exception as e:
+        log.warning(f"Warmup failed: {e}")
+    # The warmup parse isn't traffic
+    metrics.reset()
+    _mark("warmup", t0)
+    _ready = True
+
+if WARMUP:
+    warmup()
+else:
+    _ready = True
+startup["total"] = round((time.perf_counter() - _started) * 1000, 1)
+log.info(f"Startup took {startup['total']} ms: {startup}")
+
 if __name__ == '__main__':
     # Optional: Open ngrok tunnel if command line argument provided
     use_ngrok = len(sys.argv) > 1 and sys.argv[1] == '--public'
     
     if use_ngrok:
         try:
+            # Only needed for --public, so not imported at startup
+            from pyngrok import ngrok
             # Set your authtoken if you haven't already (optional but recommended)
             token = os.getenv("NGROK_AUTH_TOKEN")
             if token:
@@ -0,0 +1,400 @@
+"""
+The PNR parser as it was before pnr_lexer: a trimmed copy of the old
+Logic, kept only so test_pnr_lexer can compare against it.
+
+Airport names come from the in-memory map and airportsdata (no database,
+no online lookups); everything from merge_lines_without_sequence_number
+down is the old code unchanged, except that durations use zoneinfo instead
+of pytz, which is no longer a requirement.
+"""
+import re
+import datetime
+from zoneinfo import ZoneInfo
+
+import airportsdata
+
+
+class LegacyLogic:
+    def __init__(self):
+        self.logs = []
+        self.passengers = []
+        self.flights = []
+        self.layovers = []
+        self.base_year = datetime.datetime.now().year
+        self.current_year = self.base_year
+        self.last_month = None
+        self.airports_db = airportsdata.load('IATA')
+        self.airport_map = {}
+
+    def log(self, msg):
+        self.logs.append(str(msg))
+
+    def resolve_airport(self, code):
+        code = code.upper()
+        if code in self.airport_map:
+            return self.airport_map[code]
+        if code in self.airports_db:
+            data = self.airports_db[code]
+            final_name = data.get('city', '') or data.get('name', '')
+            self.airport_map[code] = final_name
+            return final_name
+        return code
+
+    def merge_lines_without_sequence_number(self, text):
+        lines = text.split("\n")
+        output = []
+        previous_line = None
+
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+                
+            # Check if line starts with a number (e.g., "1.", "1 ", "14")
+            if re.match(r'^\d+.*', line):
+                if previous_line is not None:
+                    output.append(previous_line)
+                previous_line = line
+            else:
+                if previous_line is not None:
+                    previous_line += " " + line
+                else:
+                    previous_line = line
+        
+        if previous_line is not None:
+            output.append(previous_line)
+            
+        return "\n".join(output)
+
+    def replace_number(self, text):
+        return re.sub(r'\d+', '', text)
+
+    def contain_month(self, text):
+        months = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
+        return any(m in text for m in months)
+
+    def get_month_num(self, month_str):
+        months = {
+            "JAN": "01", "FEB": "02", "MAR": "03", "APR": "04", "MAY": "05", "JUN": "06",
+            "JUL": "07", "AUG": "08", "SEP": "09", "OCT": "10", "NOV": "11", "DEC": "12"
+        }
+        return months.get(month_str, "-1")
+
+    def parse_passengers(self, line, scanner):
+        parts = line.split(".")
+        for i in range(1, len(parts)):
+            p_name = self.replace_number(parts[i]).strip()
+            if p_name:
+                self.passengers.append({"name": p_name, "id": f"P{len(self.passengers)+1}", "passport": "", "ticket": ""})
+
+    def parse_ssr_docs(self, line_parts):
+        try:
+            data_part = None
+            for part in line_parts:
+                if part.startswith("P/"):
+                    data_part = part
+                    break
+            
+            if not data_part:
+                for part in line_parts:
+                    if "P/" in part and "/" in part:
+                         data_part = part
+                         break
+            
+            if data_part:
+                 data_part = data_part.replace(" ", "")
+                 split_data = data_part.split("/")
+                 if len(split_data) >= 3:
+                     passport = split_data[2]
+                     if len(self.passengers) == 1:
+                         self.passengers[0]["passport"] = passport
+        except Exception as e:
+            self.log(f"Error parsing SSR DOCS: {e}")
+
+    def parse_fa_pax(self, line_parts):
+        try:
+            ticket_part = None
+            for part in line_parts:
+                if "FA" in part or "PAX" in part:
+                    continue
+                if "-" in part and "/" in part:
+                    ticket_part = part
+                    break
+            
+            if ticket_part:
+                 ticket_data = ticket_part.split("/")
+                 ticket_num = ticket_data[0]
+                 if len(self.passengers) == 1:
+                     self.passengers[0]["ticket"] = ticket_num
+        except Exception as e:
+            self.log(f"Error parsing FA PAX: {e}")
+
+    def parse_flight(self, line_parts):
+        try:
+            date_idx = -1
+            for i, part in enumerate(line_parts):
+                if self.contain_month(part):
+                    date_idx = i
+                    break
+            
+            if date_idx != -1:
+                flight_id = line_parts[1] + line_parts[2]
+                date_str = line_parts[date_idx]
+                
+                ori_des_idx = date_idx + 2
+                if ori_des_idx >= len(line_parts):
+                     return
+
+                ori_des = line_parts[ori_des_idx]
+                ori = ori_des[:3]
+                des = ori_des[3:]
+                
+                ori_name = self.resolve_airport(ori)
+                des_name = self.resolve_airport(des)
+                
+                time_idx = -1
+                for i in range(ori_des_idx + 1, len(line_parts)):
+                    if re.match(r'^\d{4}$', line_parts[i]) or re.match(r'^\d{4}\+\d$', line_parts[i]):
+                        time_idx = i
+                        break
+                
+                if time_idx != -1:
+                    start_time = line_parts[time_idx]
+                    end_time = line_parts[time_idx+1]
+                    
+                    next_day = False
+                    if "+" in end_time:
+                        next_day = True
+                        end_time = end_time.split("+")[0]
+                    
+                    start_time_fmt = f"{start_time[:2]}:{start_time[2:]}"
+                    end_time_fmt = f"{end_time[:2]}:{end_time[2:]}"
+                    if next_day:
+                        end_time_fmt += "+1"
+                    
+                    day = date_str[:2]
+                    month_str = date_str[2:]
+                    month = self.get_month_num(month_str)
+
+                    duration_fmt = ""
+                    arrival_date_fmt = ""
+                    
+                    try:
+                        tz_origin_str = 'UTC'
+                        tz_dest_str = 'UTC'
+                        
+                        if ori in self.airports_db:
+                            tz_origin_str = self.airports_db[ori]['tz']
+                        if des in self.airports_db:
+                            tz_dest_str = self.airports_db[des]['tz']
+                            
+                        tz_origin = ZoneInfo(tz_origin_str)
+                        tz_dest = ZoneInfo(tz_dest_str)
+                        
+                        month_int = int(month)
+                        day_int = int(day)
+                        if self.last_month is None:
+                            self.last_month = month_int
+                            year_to_use = self.current_year
+                        else:
+                            if month_int < self.last_month:
+                                self.current_year += 1
+                            self.last_month = month_int
+                            year_to_use = self.current_year
+                        
+                        start_h = int(start_time[:2])
+                        start_m = int(start_time[2:])
+                        end_h = int(end_time[:2])
+                        end_m = int(end_time[2:])
+                        
+                        dt_start_local = datetime.datetime(year_to_use, month_int, day_int, start_h, start_m)
+                        dt_end_local = datetime.datetime(year_to_use, month_int, day_int, end_h, end_m)
+                        
+                        if next_day:
+                            dt_end_local += datetime.timedelta(days=1)
+                        
+                        # Compared in UTC: aware datetimes sharing one ZoneInfo subtract as wall times
+                        dt_start_aware = dt_start_local.replace(tzinfo=tz_origin).astimezone(datetime.timezone.utc)
+                        dt_end_aware = dt_end_local.replace(tzinfo=tz_dest).astimezone(datetime.timezone.utc)
+                        
+                        dur = dt_end_aware - dt_start_aware
+                        dur_min = int(dur.total_seconds() / 60)
+                        dur_h = dur_min // 60
+                        dur_m = dur_min % 60
+                        duration_fmt = f"{dur_h}小时 {dur_m}m"
+                        
+                        arr_month = dt_end_local.month
+                        arr_day = dt_end_local.day
+                        arrival_date_fmt = f"{arr_month:02d}-{arr_day:02d}"
+                        
+                    except Exception as e:
+                        self.log(f"Timezone calc failed: {e}")
+                        duration_fmt = "--"
+                        arrival_date_fmt = f"{month}-{day}"
+                    
+                    self.flights.append({
+                        "id": flight_id,
+                        "origin": ori_name,
+                        "dest": des_name,
+                        "start": start_time_fmt,
+                        "end": end_time_fmt,
+                        "month": month,
+                        "day": day,
+                        "year": year_to_use if 'year_to_use' in locals() else self.current_year,
+                        "next_day": next_day,
+                        "raw_start": start_time,
+                        "raw_end": end_time,
+                        "duration": duration_fmt,
+                        "arrival_date": arrival_date_fmt,
+                        "utc_start": dt_start_aware.strftime('%Y%m%dT%H%M%SZ') if 'dt_start_aware' in locals() else "",
+                        "utc_end": dt_end_aware.strftime('%Y%m%dT%H%M%SZ') if 'dt_end_aware' in locals() else ""
+                    })
+                    
+        except Exception as e:
+            self.log(f"Error parsing flight: {e}")
+
+    def calculate_layovers(self):
+        self.layovers = []
+        if len(self.flights) < 2:
+            return
+
+        for i in range(1, len(self.flights)):
+            prev = self.flights[i-1]
+            curr = self.flights[i]
+            
+            try:
+                prev_year = int(prev.get("year", self.base_year))
+                prev_month = int(prev["month"])
+                prev_day = int(prev["day"])
+                prev_hour = int(prev["raw_end"][:2])
+                prev_min = int(prev["raw_end"][2:])
+                
+                dt_prev = datetime.datetime(prev_year, prev_month, prev_day, prev_hour, prev_min)
+                if prev["next_day"]:
+                    dt_prev += datetime.timedelta(days=1)
+                
+                curr_year = int(curr.get("year", prev_year))
+                curr_month = int(curr["month"])
+                curr_day = int(curr["day"])
+                curr_hour = int(curr["raw_start"][:2])
+                curr_min = int(curr["raw_start"][2:])
+                
+                dt_curr = datetime.datetime(curr_year, curr_month, curr_day, curr_hour, curr_min)
+                
+                diff = dt_curr - dt_prev
+                total_minutes = int(diff.total_seconds() / 60)
+                hours = total_minutes // 60
+                minutes = total_minutes % 60
+                
+                if hours >= 72:
+                    curr["is_return"] = True
+                    self.layovers.append({
+                        "type": "return_split",
+                        "flight_index": i
+                    })
+                else:
+                    self.layovers.append({
+                        "type": "layover",
+                        "place": prev["dest"],
+                        "version": "new",
+                        "hours": hours,
+                        "minutes": minutes,
+                        "flight_index": i
+                    })
+                    
+            except Exception as e:
+                self.log(f"Error calculating layover: {e}")
+
+    def process(self, raw_code):
+        # Reset logs at start of process
+        self.logs = []
+        self.passengers = []
+        self.flights = []
+        self.layovers = []
+        
+        # Determine year context before parsing flights
+        # Check all months in the raw code first
+        try:
+            cleaned_code = self.merge_lines_without_sequence_number(raw_code)
+            lines = cleaned_code.split("\n")
+            
+            # Extract all months in sequence
+            months_found = []
+            for line in lines:
+                if self.contain_month(line) and not "SSR" in line and not "FA" in line:
+                    parts = line.split()
+                    for part in parts:
+                        if self.contain_month(part):
+                            for m_str in ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]:
+                                if m_str in part:
+                                    months_found.append(self.get_month_num(m_str))
+                                    break
+            
+            # Logic to determine base year
+            # If we see a sequence like JAN after DEC (current month is DEC), it's next year.
+            # If current real month is e.g. DEC, and the first flight is JAN, it's definitely next year.
+            
+            current_real_date = datetime.datetime.now()
+            current_real_month = current_real_date.month
+            current_real_year = current_real_date.year
+            
+            self.current_year = current_real_year
+            self.last_month = None
+            
+            # If the first flight month is significantly earlier than current month (e.g. Current=Dec, Flight=Jan),
+            # assume the whole itinerary starts next year.
+            if months_found:
+                first_flight_month = int(months_found[0])
+                # Heuristic: if current is Oct/Nov/Dec and flight is Jan/Feb, it's next year
+                if current_real_month >= 9 and first_flight_month <= 4:
+                    self.current_year += 1
+            
+            passenger_mode = True
+            
+            for line in lines:
+                parts = line.split()
+                if not parts:
+                    continue
+                    
+                if "." in line and passenger_mode and not "SSR" in line and not "FA" in line:
+                    if "." in parts[0]: 
+                        self.parse_passengers(line, None)
+                        continue
+                    else:
+                        passenger_mode = False 
+                
+                if "SSR" in line and "DOCS" in line:
+                    self.parse_ssr_docs(parts)
+                elif "FA" in line and "PAX" in line:
+                    self.parse_fa_pax(parts)
+                elif self.contain_month(line) and not "SSR" in line and not "FA" in line:
+                    self.parse_flight(parts)
+
+            self.calculate_layovers()
+            return self.generate_text()
+            
+        except Exception as e:
+            self.log(f"Critical error in process: {e}")
+            return f"Error processing: {e}"
+
+    def generate_text(self):
+        res = ""
+        for i, p in enumerate(self.passengers):
+            res += f"乘客{i+1}: {p['name']}\n"
+        
+        is_return = False
+        for i, f in enumerate(self.flights):
+            if f.get("is_return"):
+                res += "---------<回程>---------\n"
+                is_return = True
+            
+            if i == 0 or f.get("is_return"):
+                res += f"【{f['year']}年{f['month']}月{f['day']}日】\n"
+            
+            layover = next((l for l in self.layovers if l["flight_index"] == i), None)
+            if layover and layover.get('type', 'layover') == 'layover' and layover['hours'] >= 0:
+                 res += f"{layover.get('place', '')}停留时间: {layover['hours']}小时{layover['minutes']}分\n"
+            
+            res += f"{f['origin']}-{f['dest']}-->{f['start']}-{f['end']}\n"
+        
+        return res
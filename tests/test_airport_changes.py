@@ -0,0 +1,91 @@
+"""
+The airport change log behind GET /airports/changes: deltas since a
+version, the full map when the log can't cover the gap, pruning to the
+last AIRPORT_CHANGES_KEEP versions, and offline-index backfills.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database reads DATABASE_URL on import; keep the tests off billete.db
+_db_dir = tempfile.mkdtemp(prefix="billete-test-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_db_dir, "test.db")
+
+import database  # noqa: E402
+
+
+class AirportChangesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        database.init_db()
+
+    def setUp(self):
+        self.since = database.get_airport_version()
+
+    def test_delta_lists_upserts_and_deletes_since_a_version(self):
+        database.upsert_airport("zzA", "Alpha")
+        database.bulk_upsert_airports({"ZZB": "Bravo", "ZZC": "Charlie"})
+        database.delete_airport("ZZA")
+        database.upsert_airport("ZZB", "Bravo 2")
+
+        changes = database.get_airport_changes(self.since)
+        self.assertFalse(changes["full"])
+        self.assertEqual(changes["version"], self.since + 4)
+        self.assertEqual(changes["upserts"], {"ZZB": "Bravo 2", "ZZC": "Charlie"})
+        self.assertEqual(changes["deletes"], ["ZZA"])
+
+        latest = database.get_airport_changes(changes["version"])
+        self.assertEqual((latest["full"], latest["upserts"], latest["deletes"]), (False, {}, []))
+
+    def test_unchanged_bulk_upsert_does_not_move_the_version(self):
+        database.bulk_upsert_airports({"ZZD": "Delta"})
+        version = database.get_airport_version()
+        diff = database.bulk_upsert_airports({"ZZD": "Delta"})
+        self.assertEqual(diff["unchanged"], ["ZZD"])
+        self.assertEqual(database.get_airport_version(), version)
+
+    def test_full_map_when_the_log_cannot_cover_the_gap(self):
+        database.upsert_airport("ZZE", "Echo")
+        version = database.get_airport_version()
+        for since in (0, version + 1):
+            with self.subTest(since=since):
+                changes = database.get_airport_changes(since)
+                self.assertTrue(changes["full"])
+                self.assertEqual(changes["upserts"], database.get_all_airports())
+
+    def test_log_is_pruned_to_the_last_versions(self):
+        with mock.patch.object(database, "AIRPORT_CHANGES_KEEP", 3):
+            for i in range(6):
+                database.upsert_airport("ZZF", f"Foxtrot {i}")
+        version = database.get_airport_version()
+        with database.read_connection() as conn:
+            oldest = conn.execute(text("SELECT MIN(version) FROM airport_changes")).scalar()
+        self.assertEqual(oldest, version - 2)
+
+        self.assertFalse(database.get_airport_changes(version - 3)["full"])
+        behind = database.get_airport_changes(version - 4)
+        self.assertTrue(behind["full"])
+        self.assertEqual(behind["upserts"]["ZZF"], "Foxtrot 5")
+
+    def test_backfill_logs_only_a_new_code(self):
+        self.assertTrue(database.backfill_airport("zzg", "Golf"))
+        self.assertEqual(database.get_airport_changes(self.since)["upserts"], {"ZZG": "Golf"})
+
+        version = database.get_airport_version()
+        self.assertFalse(database.backfill_airport("ZZG", "Other name"))
+        self.assertEqual(database.get_airport_version(), version)
+        self.assertEqual(database.get_all_airports()["ZZG"], "Golf")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Keyset pages of the history list: newest first, light rows, and
+next_before_id walking every row exactly once (GET /history), with the
+full row behind GET /history/<id>.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database reads DATABASE_URL on import; keep the tests off billete.db
+_db_dir = tempfile.mkdtemp(prefix="billete-test-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_db_dir, "test.db")
+os.environ.setdefault("BILLETE_WARMUP", "0")
+
+import database  # noqa: E402
+
+ROWS = 23
+
+
+class HistoryPagesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import server
+        cls.server = server
+        cls.client = server.app.test_client()
+
+    def setUp(self):
+        self.client.delete('/history')
+        database.add_history_entries([
+            {"code": f"CODE{i}", "result": f"result {i}", "passenger_info": f"PAX{i}", "route_info": "MAD-PEK",
+             "timestamp": f"2026-01-01 00:00:{i:02d}"}
+            for i in range(ROWS)
+        ])
+
+    def test_pages_walk_every_row_newest_first(self):
+        ids = []
+        before_id = None
+        pages = 0
+        while True:
+            url = '/history?limit=5' + (f'&before_id={before_id}' if before_id else '')
+            page = self.client.get(url).json
+            pages += 1
+            ids += [item['id'] for item in page['items']]
+            before_id = page['next_before_id']
+            if before_id is None:
+                break
+        self.assertEqual(pages, 5)
+        self.assertEqual(len(ids), ROWS)
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_list_rows_leave_out_code_and_result(self):
+        item = database.get_history_entries(limit=1)[0]
+        self.assertEqual(set(item), {"id", "timestamp", "passenger_info", "route_info"})
+        self.assertEqual(item["passenger_info"], f"PAX{ROWS - 1}")
+
+        entry = self.client.get(f"/history/{item['id']}").json
+        self.assertEqual((entry['code'], entry['result']), (f"CODE{ROWS - 1}", f"result {ROWS - 1}"))
+        self.assertEqual(self.client.get('/history/999999').status_code, 404)
+
+    def test_full_last_page_ends_with_an_empty_page(self):
+        page = self.client.get(f'/history?limit={ROWS}').json
+        self.assertEqual(len(page['items']), ROWS)
+        last = self.client.get(f"/history?limit={ROWS}&before_id={page['next_before_id']}").json
+        self.assertEqual(last, {'items': [], 'next_before_id': None})
+
+    def test_limit_is_clamped_and_checked(self):
+        self.assertEqual(len(self.client.get('/history?limit=0').json['items']), 1)
+        self.assertEqual(len(self.client.get('/history?limit=100000').json['items']), ROWS)
+        self.assertEqual(self.client.get('/history?before_id=abc').status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+HistoryWriter writes queued rows in batches, spools what the database
+refuses and puts the spool back once the database is reachable again.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database reads DATABASE_URL on import; keep the tests off billete.db
+_db_dir = tempfile.mkdtemp(prefix="billete-test-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_db_dir, "test.db")
+
+import database  # noqa: E402
+from history_writer import HistoryWriter  # noqa: E402
+
+
+def history_codes():
+    return sorted(database.get_history_entry(row["id"])["code"]
+                  for row in database.get_history_entries(limit=1000))
+
+
+def spooled_lines(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [line for line in f if line.strip()]
+    except OSError:
+        return []
+
+
+class HistoryWriterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        database.init_db()
+
+    def setUp(self):
+        database.clear_history_entries()
+        self.spool = os.path.join(tempfile.mkdtemp(prefix="billete-spool-"), "spool.jsonl")
+        self.writer = HistoryWriter(batch_size=3, flush_seconds=0.05, spool_path=self.spool)
+
+    def tearDown(self):
+        self.writer.close()
+
+    def test_close_writes_every_submitted_row(self):
+        entries = [self.writer.submit(f"CODE{i}", f"result {i}", "PAX", "PEK-MAD") for i in range(7)]
+        self.writer.close()
+        self.assertEqual(history_codes(), sorted(f"CODE{i}" for i in range(7)))
+        self.assertEqual(self.writer.depth(), 0)
+        self.assertEqual(self.writer.stats()["written"], 7)
+        self.assertEqual(entries[0]["passenger_info"], "PAX")
+        self.assertNotIn("id", entries[0])
+
+    def test_flush_waits_for_the_batch_being_collected(self):
+        writer = HistoryWriter(batch_size=100, flush_seconds=2.0, spool_path=self.spool)
+        try:
+            for i in range(3):
+                writer.submit(f"HELD{i}", "result")
+            time.sleep(0.1)  # the flush thread now holds the rows, waiting for more
+            started = time.monotonic()
+            writer.flush()
+            self.assertLess(time.monotonic() - started, 1.0)
+            self.assertEqual(history_codes(), [f"HELD{i}" for i in range(3)])
+            self.assertEqual(writer.depth(), 0)
+        finally:
+            writer.close()
+
+    def test_failed_flush_spools_rows_and_replay_writes_them(self):
+        with mock.patch.object(database, "add_history_entries", side_effect=RuntimeError("database is down")):
+            for i in range(4):
+                self.writer.submit(f"DOWN{i}", "result")
+            self.writer.close()
+        self.assertEqual(history_codes(), [])
+        self.assertEqual(len(spooled_lines(self.spool)), 4)
+        self.assertEqual(self.writer.depth(), 0)
+
+        self.assertEqual(self.writer.replay_spool(), 4)
+        self.assertEqual(history_codes(), [f"DOWN{i}" for i in range(4)])
+        self.assertFalse(os.path.exists(self.spool))
+        self.assertEqual(self.writer.replay_spool(), 0)
+
+    def test_failed_replay_keeps_rows_spooled(self):
+        self.writer._spool([{"code": "KEPT", "result": "result"}])
+        with mock.patch.object(database, "add_history_entries", side_effect=RuntimeError("database is down")):
+            self.assertEqual(self.writer.replay_spool(), 0)
+        self.assertEqual(len(spooled_lines(self.spool)), 1)
+        self.assertEqual(self.writer.replay_spool(), 1)
+        self.assertEqual(history_codes(), ["KEPT"])
+
+    def test_unreadable_spool_lines_are_skipped(self):
+        with open(self.spool, "w", encoding="utf-8") as f:
+            f.write('{"code": "GOOD", "result": "r"}\nnot json\n\n')
+        self.assertEqual(self.writer.replay_spool(), 1)
+        self.assertEqual(history_codes(), ["GOOD"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+/download_ics: posted flights are checked by server.ics_flight before the
+calendar starts streaming, and parse ids from /process resolve to their
+flights.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database reads DATABASE_URL on import; keep the tests off billete.db
+_db_dir = tempfile.mkdtemp(prefix="billete-test-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_db_dir, "test.db")
+os.environ.setdefault("BILLETE_WARMUP", "0")
+
+import server  # noqa: E402
+
+FLIGHT = {"id": "CA908", "origin": "Madrid", "dest": "Beijing",
+          "utc_start": "20270410T100000Z", "utc_end": "20270410T213000Z", "seat": "ignored"}
+
+PNR = """1.LI/MEI
+  2  CA 908 L 15AUG 5 MADPEK HK1       1  1200 0530+1
+  3  MU 5101 L 16AUG 1 PEKSHA HK1       1  0900 1115
+"""
+
+
+class IcsFlightTest(unittest.TestCase):
+    def test_keeps_only_the_event_fields(self):
+        fields = ("id", "origin", "dest", "utc_start", "utc_end")
+        self.assertEqual(server.ics_flight(FLIGHT), {k: FLIGHT[k] for k in fields})
+        self.assertEqual(server.ics_flight({"id": 908, "origin": "MAD", "dest": "PEK"}),
+                         {"id": "908", "origin": "MAD", "dest": "PEK", "utc_start": "", "utc_end": ""})
+
+    def test_rejects_unusable_flights(self):
+        bad = [
+            "CA908",
+            {**FLIGHT, "id": ""},
+            {**FLIGHT, "id": True},
+            {**FLIGHT, "origin": None},
+            {**FLIGHT, "dest": "Beijing\r\nBEGIN:VEVENT"},
+            {**FLIGHT, "utc_start": "2027-04-10 10:00"},
+            {**FLIGHT, "utc_end": 20270410},
+        ]
+        for flight in bad:
+            with self.subTest(flight=flight):
+                with self.assertRaises(ValueError):
+                    server.ics_flight(flight)
+
+
+class DownloadIcsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        server.logic.fetch_online_airport_name = lambda code, session=None: None
+        cls.client = server.app.test_client()
+
+    def test_posted_flights_become_events(self):
+        r = self.client.post('/download_ics', json={"itineraries": [{"flights": [FLIGHT]}, {"flights": [FLIGHT]}]})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.mimetype, "text/calendar")
+        body = r.get_data(as_text=True)
+        self.assertEqual(body.count("BEGIN:VEVENT"), 2)
+        self.assertIn("DTSTART:20270410T100000Z", body)
+
+    def test_invalid_bodies_are_rejected_before_streaming(self):
+        cases = [
+            {"flights": [{**FLIGHT, "utc_start": "tomorrow"}]},
+            {"itineraries": [{"flights": [FLIGHT, "CA908"]}]},
+            [FLIGHT],
+            {"flights": [{**FLIGHT, "utc_start": "", "utc_end": ""}]},
+        ]
+        for data in cases:
+            with self.subTest(data=data):
+                self.assertEqual(self.client.post('/download_ics', json=data).status_code, 400)
+
+    def test_parse_ids_resolve_to_their_flights(self):
+        parse_id = self.client.post('/process', json={'code': PNR, 'record_history': False}).json['parse_id']
+        r = self.client.get(f'/download_ics?parse_id={parse_id}')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.get_data(as_text=True).count("BEGIN:VEVENT"), 2)
+
+        missing = self.client.get('/download_ics?parse_id=nope')
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(missing.json['parse_ids'], ['nope'])
+
+
+if __name__ == "__main__":
+    unittest.main()
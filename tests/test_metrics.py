@@ -0,0 +1,76 @@
+"""
+Per-stage timings: metrics collects them per request and per thread, and
+/process reports them in Server-Timing while /metrics exposes the totals.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database reads DATABASE_URL on import; keep the tests off billete.db
+_db_dir = tempfile.mkdtemp(prefix="billete-test-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_db_dir, "test.db")
+os.environ.setdefault("BILLETE_WARMUP", "0")
+
+import metrics  # noqa: E402
+
+PNR = """1.LI/MEI
+  2  CA 908 L 15AUG 5 MADPEK HK1       1  1200 0530+1
+  3  MU 5101 L 16AUG 1 PEKSHA HK1       1  0900 1115
+"""
+
+
+class RequestTimingsTest(unittest.TestCase):
+    def test_stages_add_up_within_a_request(self):
+        metrics.begin_request()
+        metrics.record_stage("parse", 0.002)
+        metrics.record_stages({"parse": 0.001, "render": 0.0005})
+        timings = metrics.end_request()
+        self.assertAlmostEqual(timings["parse"], 0.003)
+        self.assertEqual(metrics.server_timing(timings), "parse;dur=3.00, render;dur=0.50")
+        self.assertEqual(metrics.end_request(), {})
+
+    def test_other_threads_do_not_leak_into_a_request(self):
+        metrics.begin_request()
+        thread = threading.Thread(target=metrics.record_stage, args=("elsewhere", 1.0))
+        thread.start()
+        thread.join()
+        self.assertNotIn("elsewhere", metrics.end_request())
+
+
+class ProcessMetricsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import server
+        server.logic.fetch_online_airport_name = lambda code, session=None: None
+        cls.server = server
+        cls.client = server.app.test_client()
+
+    def test_process_reports_its_stages_in_server_timing(self):
+        self.server.result_cache.clear()
+        r = self.client.post('/process', json={'code': PNR})
+        stages = [part.split(';')[0] for part in r.headers['Server-Timing'].split(', ')]
+        for stage in ('tokenize', 'parse', 'history', 'total'):
+            self.assertIn(stage, stages)
+
+        hit = self.client.post('/process', json={'code': PNR, 'record_history': False})
+        self.assertNotIn('parse;', hit.headers['Server-Timing'])
+        self.assertIn('total;', hit.headers['Server-Timing'])
+
+    def test_metrics_endpoint_exposes_stage_and_request_totals(self):
+        self.client.post('/process', json={'code': PNR})
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('billete_stage_seconds_count{stage="parse"}', text)
+        self.assertIn('billete_requests_total{endpoint="process",status="200"}', text)
+        self.assertIn('billete_history_queue_depth', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
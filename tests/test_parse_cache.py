@@ -0,0 +1,158 @@
+"""
+ParseCache keys, single-flight computation and invalidation, and the
+/process rule that a cached result only gets a new history row after
+history was cleared.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database reads DATABASE_URL on import; keep the tests off billete.db
+_db_dir = tempfile.mkdtemp(prefix="billete-test-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_db_dir, "test.db")
+os.environ.setdefault("BILLETE_WARMUP", "0")
+
+import database  # noqa: E402
+import parse_cache  # noqa: E402
+
+PNR = """1.LI/MEI
+  2  CA 908 L 15AUG 5 MADPEK HK1       1  1200 0530+1
+  3  MU 5101 L 16AUG 1 PEKSHA HK1       1  0900 1115
+"""
+
+
+class MakeKeyTest(unittest.TestCase):
+    def test_whitespace_and_blank_lines_do_not_change_the_key(self):
+        messy = "\n\n" + "\n\n".join(line.strip() + "  " for line in PNR.splitlines()) + "\n"
+        self.assertEqual(parse_cache.make_key(PNR, {}, 1), parse_cache.make_key(messy, {}, 1))
+
+    def test_luggage_and_airport_version_change_the_key(self):
+        key = parse_cache.make_key(PNR, {}, 1)
+        self.assertNotEqual(key, parse_cache.make_key(PNR, {"pack_count": "1"}, 1))
+        self.assertNotEqual(key, parse_cache.make_key(PNR, {}, 2))
+        self.assertEqual(key, parse_cache.make_key(PNR, {"unrelated": "x"}, 1))
+
+
+class ParseCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        database.init_db()
+
+    def test_concurrent_misses_share_one_computation(self):
+        cache = parse_cache.ParseCache(persist=False)
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return {"body": "parsed"}, True
+
+        results = []
+
+        def request():
+            results.append(cache.get_or_compute("k", compute))
+
+        threads = [threading.Thread(target=request) for _ in range(5)]
+        for t in threads:
+            t.start()
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(value == {"body": "parsed"} for value, _ in results))
+        self.assertEqual(sorted(hit for _, hit in results), [False, True, True, True, True])
+        self.assertEqual(cache.stats()["shared"], 4)
+        self.assertEqual(cache.get_or_compute("k", compute), ({"body": "parsed"}, True))
+
+    def test_uncacheable_results_and_errors_are_not_kept(self):
+        cache = parse_cache.ParseCache(persist=False)
+        self.assertEqual(cache.get_or_compute("pending", lambda: ("partial", False)), ("partial", False))
+        self.assertIsNone(cache.get("pending"))
+
+        def fail():
+            raise ValueError("bad PNR")
+
+        with self.assertRaises(ValueError):
+            cache.get_or_compute("bad", fail)
+        self.assertIsNone(cache.get("bad"))
+        self.assertEqual(cache.get_or_compute("bad", lambda: ("ok", True)), ("ok", False))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = parse_cache.ParseCache(max_entries=2, persist=False)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+
+    def test_database_tier_is_shared_and_cleared(self):
+        first = parse_cache.ParseCache(persist=True)
+        other_worker = parse_cache.ParseCache(persist=True)
+        first.put("shared", {"body": {"result": "text"}})
+        self.assertEqual(other_worker.get("shared"), {"body": {"result": "text"}})
+        self.assertEqual(other_worker.stats()["db_hits"], 1)
+
+        first.clear()
+        self.assertIsNone(first.get("shared"))
+        self.assertIsNone(parse_cache.ParseCache(persist=True).get("shared"))
+
+
+class ProcessHistoryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import server
+        cls.server = server
+        server.logic.fetch_online_airport_name = lambda code, session=None: None
+        cls.client = server.app.test_client()
+
+    def setUp(self):
+        self.client.delete('/history')
+        self.server.result_cache.clear()
+
+    def history_rows(self):
+        self.server.logic.history_writer.close()
+        return database.get_history_entries(limit=100)
+
+    def test_the_sample_resolves_offline(self):
+        # Results waiting on online lookups are never cached
+        self.assertEqual(self.client.post('/process', json={'code': PNR}).json['pending_airports'], [])
+
+    def test_a_cache_hit_adds_no_history_row(self):
+        first = self.client.post('/process', json={'code': PNR}).json
+        again = self.client.post('/process', json={'code': PNR}).json
+        self.assertFalse(first['cached'])
+        self.assertTrue(again['cached'])
+        self.assertIn('history', first)
+        self.assertNotIn('history', again)
+        self.assertEqual(len(self.history_rows()), 1)
+
+    def test_a_cache_hit_is_recorded_again_after_history_is_cleared(self):
+        self.client.post('/process', json={'code': PNR})
+        self.history_rows()
+        self.client.delete('/history')
+        after = self.client.post('/process', json={'code': PNR}).json
+        self.assertTrue(after['cached'])
+        self.assertIn('history', after)
+        self.assertEqual(len(self.history_rows()), 1)
+
+    def test_record_history_false_skips_the_row(self):
+        self.client.post('/process', json={'code': PNR, 'record_history': False})
+        self.assertEqual(self.history_rows(), [])
+        self.assertIn('history', self.client.post('/process', json={'code': PNR}).json)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+pnr_lexer and Logic.parse must read PNRs exactly as the old multi-scan
+parser did (tests/legacy_logic.py): same line classification, same
+passengers, flights, layovers and text. Runs on the history.json samples
+and on synthetic group bookings from benchmarks.samples.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database reads DATABASE_URL on import; keep the tests off billete.db
+_db_dir = tempfile.mkdtemp(prefix="billete-test-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_db_dir, "test.db")
+
+import database  # noqa: E402
+import pnr_lexer  # noqa: E402
+from logic import Logic  # noqa: E402
+from benchmarks.bench_lexer import legacy_scan  # noqa: E402
+from benchmarks.samples import group_pnr  # noqa: E402
+from tests.legacy_logic import LegacyLogic  # noqa: E402
+
+# Instants are datetimes in the new records and strings in the old ones
+TIME_FIELDS = ("utc_start", "utc_end", "departure_at", "arrival_at")
+
+
+def sample_pnrs():
+    with open(os.path.join(ROOT, "history.json"), encoding="utf-8") as f:
+        samples = [entry["code"] for entry in json.load(f)]
+    for seed, (pax, segs) in enumerate([(1, 1), (1, 2), (2, 4), (3, 3), (5, 6), (9, 16), (30, 16), (99, 16)] * 4):
+        samples.append(group_pnr(pax, segs, seed=seed))
+    return samples
+
+
+def _flights(flights):
+    return [{k: v for k, v in f.items() if k not in TIME_FIELDS} for f in flights]
+
+
+class LexerMatchesLegacyTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        database.init_db()
+        cls.samples = sample_pnrs()
+
+    def test_tokenize_classifies_lines_like_legacy_scan(self):
+        # legacy_scan leaves out the lines the old parser ignored; the lexer marks them OTHER
+        for code in self.samples:
+            with self.subTest(code=code[:40]):
+                kinds = [t.kind for t in pnr_lexer.tokenize(code) if t.kind != pnr_lexer.OTHER]
+                self.assertEqual(kinds, legacy_scan(code))
+
+    def test_merge_lines_matches_legacy(self):
+        legacy = LegacyLogic()
+        for code in self.samples:
+            with self.subTest(code=code[:40]):
+                self.assertEqual("\n".join(pnr_lexer.merge_lines(code)),
+                                 legacy.merge_lines_without_sequence_number(code))
+
+    def test_parse_matches_legacy(self):
+        logic = Logic()
+        logic.fetch_online_airport_name = lambda code, session=None: None
+        legacy = LegacyLogic()
+        for code in self.samples:
+            with self.subTest(code=code[:40]):
+                itinerary = logic.parse(code)
+                text = legacy.process(code)
+                self.assertEqual(itinerary.text, text)
+                self.assertEqual(list(itinerary.passengers), legacy.passengers)
+                self.assertEqual(_flights(itinerary.flights), _flights(legacy.flights))
+                self.assertEqual(list(itinerary.layovers), legacy.layovers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+Timezone helpers for flight times, built on the stdlib zoneinfo.
+
+ZoneInfo objects and per-day UTC offsets are memoized, so converting a
+segment's local departure/arrival to UTC is usually a dict hit and a
+subtraction. Days that contain a DST transition are not cached and are
+converted exactly.
+"""
+import datetime
+import threading
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+import applog
+
+log = applog.get_logger("tz_service")
+
+UTC = datetime.timezone.utc
+_MIDNIGHT = datetime.time(0, 0)
+_END_OF_DAY = datetime.time(23, 59, 59)
+
+
+@lru_cache(maxsize=None)
+def get_zone(tz_id):
+    return ZoneInfo(tz_id)
+
+
+@lru_cache(maxsize=8192)
+def day_offset(tz_id, date):
+    """UTC offset of tz_id for the whole of date, or None if it changes that day."""
+    zone = get_zone(tz_id)
+    start = datetime.datetime.combine(date, _MIDNIGHT, tzinfo=zone).utcoffset()
+    end = datetime.datetime.combine(date, _END_OF_DAY, tzinfo=zone).utcoffset()
+    return start if start == end else None
+
+
+def to_utc(tz_id, local):
+    """Converts a naive local datetime in tz_id to an aware UTC datetime."""
+    offset = day_offset(tz_id, local.date())
+    if offset is not None:
+        return (local - offset).replace(tzinfo=UTC)
+    return local.replace(tzinfo=get_zone(tz_id)).astimezone(UTC)
+
+
+class TimezoneService:
+    """Resolves each airport's zone once and converts local times at that airport."""
+
+    def __init__(self, airports_db):
+        self.airports_db = airports_db
+        self._zones = {}
+        self._lock = threading.Lock()
+
+    def zone_for_airport(self, code):
+        tz_id = self._zones.get(code)
+        if tz_id is not None:
+            return tz_id
+
+        tz_id = 'UTC'
+        data = self.airports_db.get(code)
+        if data and data.get('tz'):
+            try:
+                get_zone(data['tz'])
+                tz_id = data['tz']
+            except Exception as e:
+                log.warning(f"Unknown timezone {data['tz']} for {code}: {e}")
+        with self._lock:
+            self._zones[code] = tz_id
+        return tz_id
+
+    def airport_to_utc(self, code, local):
+        return to_utc(self.zone_for_airport(code), local)
@@ -1,10 +1,45 @@
+import os
+import time
+import queue
+import shutil
+import threading
 import tkinter as tk
-from tkinter import scrolledtext, messagebox
-from logic import Logic
+from tkinter import scrolledtext, messagebox, filedialog, ttk
+import docgen
+
+# How often the Tk thread picks up results from the worker threads (ms)
+POLL_MS = 50
+
+
+def luggage_text(luggage):
+    return (f"\n经济舱往返 欧\n托运行李{luggage['pack_count']} 件,每件{luggage['pack_weight']}公斤\n"
+            f"手提行李{luggage['hand_count']}件{luggage['hand_weight']} 公斤\n")
+
 
 class BilleteApp:
+    """
+    Tk client. Tk may only be touched from the thread running mainloop, so
+    loading and parsing run on worker threads that put their results on a
+    queue, which _poll_results drains every POLL_MS with after().
+
+    The database, Logic and the airport data are loaded on a worker thread
+    after the window first paints. Cancel can't stop a thread that is
+    waiting on an online airport lookup, so it drops the job's result and
+    frees the window at once.
+    """
+
     def __init__(self, root):
-        self.logic = Logic()
+        self.logic = None
+        self._logic_lock = threading.Lock()
+        # In-session results by PNR and luggage, like the web app's parse cache
+        self.results = None
+        self.itinerary = None
+        self.doc_jobs = None
+        self._results_queue = queue.Queue()
+        # Id of the job whose result is still wanted; cancel() bumps it
+        self._job = 0
+        self._busy_since = None
+        self._busy_text = ""
         self.root = root
         self.root.title("LULI专属 (Python Version)")
         self.root.geometry("500x700")
@@ -81,6 +116,16 @@ class BilleteApp:
         self.pdf_btn = tk.Button(self.btn_frame, text="生成PDF/Word", command=self.generate_docs, state="disabled", width=20)
         self.pdf_btn.pack(pady=2)
 
+        # Progress
+        self.progress_frame = tk.Frame(root)
+        self.progress_frame.pack(fill="x", padx=10)
+        self.progress = ttk.Progressbar(self.progress_frame, mode="indeterminate", length=300)
+        self.progress.pack(side="left", padx=(0, 5))
+        self.cancel_btn = tk.Button(self.progress_frame, text="取消 (Cancel)", command=self.cancel, state="disabled")
+        self.cancel_btn.pack(side="left")
+        self.status_var = tk.StringVar(value="")
+        tk.Label(root, textvariable=self.status_var, fg="#6B7280").pack()
+
         # Output Area (Salida)
         tk.Label(root, text="输出结果 (Output):").pack(pady=(10, 0))
         self.output_text = scrolledtext.ScrolledText(root, width=55, height=10)
@@ -89,58 +134,150 @@ class BilleteApp:
         # Initial Topmost setting
         self.root.attributes('-topmost', True)
 
+        self.root.after(POLL_MS, self._poll_results)
+        # Once the window is up, load the data in the background; a conversion
+        # started meanwhile waits for it on its own thread
+        self.status_var.set("正在加载机场数据... (Loading)")
+        self.progress.start(10)
+        self.root.after_idle(self._run_in_background, "load", None, self.get_logic)
+
+    def get_logic(self):
+        """The shared Logic, created on first use (worker threads only: it opens the database)."""
+        with self._logic_lock:
+            if self.logic is None:
+                # Imported here: SQLAlchemy alone takes a noticeable part of startup
+                import database
+                import parse_cache
+                from logic import Logic
+                database.init_db()
+                logic = Logic()
+                # Maps the airport index (or loads airportsdata) now, not on the first conversion
+                logic.airports_db.get("PEK")
+                self.results = parse_cache.ParseCache(persist=False)
+                self.logic = logic
+            return self.logic
+
+    def _run_in_background(self, kind, job, fn, *args):
+        def work():
+            try:
+                result, error = fn(*args), None
+            except Exception as e:
+                result, error = None, e
+            self._results_queue.put((kind, job, result, error))
+        threading.Thread(target=work, name=f"billete-{kind}", daemon=True).start()
+
+    def _poll_results(self):
+        while True:
+            try:
+                kind, job, result, error = self._results_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "load":
+                self._on_loaded(error)
+            elif job == self._job:  # else cancelled
+                self._on_processed(result, error)
+        if self._busy_since is not None:
+            self.status_var.set(f"{self._busy_text} {time.monotonic() - self._busy_since:.1f}s")
+        self.root.after(POLL_MS, self._poll_results)
+
+    def _set_busy(self, text):
+        self._busy_since = time.monotonic()
+        self._busy_text = text
+        self.status_var.set(text)
+        self.progress.start(10)
+        self.cancel_btn.config(state="normal")
+        self.process_btn.config(state="disabled")
+        self.pdf_btn.config(state="disabled")
+
+    def _set_idle(self, text=""):
+        self._busy_since = None
+        self.status_var.set(text)
+        self.progress.stop()
+        self.cancel_btn.config(state="disabled")
+        self.process_btn.config(state="normal")
+        self.pdf_btn.config(state="normal" if self.pdf_var.get() else "disabled", text="生成PDF/Word")
+
+    def cancel(self):
+        self._job += 1
+        self._set_idle("已取消 (Cancelled)")
+
+    def _on_loaded(self, error):
+        if self._busy_since is not None:
+            return  # a conversion is running and reports for itself
+        self.progress.stop()
+        # On failure get_logic tries again on the next conversion
+        self.status_var.set(f"加载失败 (Load failed): {error}" if error is not None else "就绪 (Ready)")
+
     def toggle_pdf_fields(self):
         state = "normal" if self.pdf_var.get() else "disabled"
         self.passport_entry.config(state=state)
         self.name_entry.config(state=state)
-        self.pdf_btn.config(state=state)
+        if self._busy_since is None:
+            self.pdf_btn.config(state=state)
 
     def toggle_top(self):
         self.root.attributes('-topmost', self.top_var.get())
 
+    def luggage(self):
+        return {
+            'hand_count': self.hand_entry.get(), 'hand_weight': self.hand_weight_entry.get(),
+            'pack_count': self.pack_entry.get(), 'pack_weight': self.pack_weight_entry.get(),
+        }
+
     def process_data(self):
         code = self.input_text.get("1.0", tk.END).strip()
         if not code:
             messagebox.showwarning("Warning", "请输入代码！！")
             return
-        
-        try:
-            # Parse logic
-            result_text = self.logic.process(code)
-            
-            # Append Luggage Info
-            pack_count = self.pack_entry.get()
-            pack_weight = self.pack_weight_entry.get()
-            hand_count = self.hand_entry.get()
-            hand_weight = self.hand_weight_entry.get()
-            
-            luggage_info = f"\n经济舱往返 欧\n托运行李{pack_count} 件,每件{pack_weight}公斤\n手提行李{hand_count}件{hand_weight} 公斤\n"
-            final_result = result_text + luggage_info
-            
-            self.output_text.delete("1.0", tk.END)
-            self.output_text.insert(tk.END, final_result)
-            
-            # Update Passenger Info fields for PDF if found
-            if self.logic.passengers:
-                p = self.logic.passengers[0]
-                self.name_entry.config(state="normal")
-                self.name_entry.delete(0, tk.END)
-                self.name_entry.insert(0, p['name'])
-                
-                self.passport_entry.config(state="normal")
-                self.passport_entry.delete(0, tk.END)
-                self.passport_entry.insert(0, p['passport'])
-                
-                # Re-disable if checkbox not checked? 
-                # Keep normal for now as we populated it.
-            
-            # Copy to clipboard
-            self.root.clipboard_clear()
-            self.root.clipboard_append(final_result)
-            messagebox.showinfo("Success", "结果已经成功复制到粘贴板！")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {e}")
+
+        self._job += 1
+        self._set_busy("解析中... (Processing)")
+        self._run_in_background("process", self._job, self._parse, code, self.luggage())
+
+    def _parse(self, code, luggage):
+        """Worker thread: (Itinerary, result text), from the session cache when possible."""
+        import parse_cache
+        logic = self.get_logic()
+
+        def compute():
+            itinerary = logic.parse(code)
+            # Results still waiting on airport lookups will change; don't keep them
+            return (itinerary, itinerary.text + luggage_text(luggage)), not itinerary.pending_airports
+
+        version = logic.sync_airport_map()
+        result, hit = self.results.get_or_compute(parse_cache.make_key(code, luggage, version), compute)
+        if not hit and logic.airport_map_version != version and not result[0].pending_airports:
+            # Names found online during the parse moved the version the next key is built from
+            self.results.put(parse_cache.make_key(code, luggage, logic.airport_map_version), result)
+        return result
+
+    def _on_processed(self, result, error):
+        if error is not None:
+            self._set_idle()
+            messagebox.showerror("Error", f"An error occurred: {error}")
+            return
+        self.itinerary, final_result = result
+        elapsed = time.monotonic() - self._busy_since
+        self._set_idle(f"完成 (Done) {elapsed:.1f}s")
+
+        self.output_text.delete("1.0", tk.END)
+        self.output_text.insert(tk.END, final_result)
+
+        # Update Passenger Info fields for PDF if found
+        if self.itinerary.passengers:
+            p = self.itinerary.passengers[0]
+            self.name_entry.config(state="normal")
+            self.name_entry.delete(0, tk.END)
+            self.name_entry.insert(0, p['name'])
+
+            self.passport_entry.config(state="normal")
+            self.passport_entry.delete(0, tk.END)
+            self.passport_entry.insert(0, p['passport'])
+
+        # Copy to clipboard
+        self.root.clipboard_clear()
+        self.root.clipboard_append(final_result)
+        messagebox.showinfo("Success", "结果已经成功复制到粘贴板！")
 
     def generate_docs(self):
         name = self.name_entry.get().strip()
@@ -148,7 +285,48 @@ class BilleteApp:
             messagebox.showwarning("Warning", "请输入旅客名字！！")
             return
         
-        messagebox.showinfo("Info", f"Generating docs for {name}...\n(Feature coming soon)")
+        if self.itinerary is None or not self.itinerary.flights:
+            messagebox.showwarning("Warning", "请先处理代码！！")
+            return
+        folder = filedialog.askdirectory(title="保存到 (Save to)")
+        if not folder:
+            return
+
+        # The form's name and passport go on the first passenger
+        passengers = [dict(p) for p in self.itinerary.passengers] or [{}]
+        passengers[0].update(name=name, passport=self.passport_entry.get().strip())
+        data = docgen.itinerary_data(passengers, self.itinerary.flights, self.itinerary.layovers, self.luggage())
+
+        if self.doc_jobs is None:
+            self.doc_jobs = docgen.DocJobs()
+        try:
+            jobs = [(self.doc_jobs.submit(data, fmt), docgen.document_name(data, fmt)) for fmt in docgen.DOC_FORMATS]
+        except Exception as e:
+            messagebox.showerror("Error", f"An error occurred: {e}")
+            return
+        self._job += 1
+        self._set_busy("生成中... (Generating)")
+        self.pdf_btn.config(text="生成中... (Generating)")
+        self.root.after(100, self._poll_docs, self._job, jobs, folder)
+
+    def _poll_docs(self, job, jobs, folder):
+        """Waits for the render jobs without blocking the window, then copies the files to folder."""
+        if job != self._job:
+            return  # cancelled; the documents still land in the cache
+        statuses = [self.doc_jobs.status(job_id) for job_id, _ in jobs]
+        if any(s['status'] == 'pending' for s in statuses):
+            self.root.after(100, self._poll_docs, job, jobs, folder)
+            return
+        self._set_idle()
+
+        errors = [s.get('error') or s['status'] for s in statuses if s['status'] != 'done']
+        if errors:
+            messagebox.showerror("Error", f"An error occurred: {errors[0]}")
+            return
+        saved = []
+        for job_id, filename in jobs:
+            saved.append(shutil.copyfile(self.doc_jobs.path(job_id), os.path.join(folder, filename)))
+        messagebox.showinfo("Success", "文件已保存 (Saved):\n" + "\n".join(saved))
 
 def run_gui():
     root = tk.Tk()